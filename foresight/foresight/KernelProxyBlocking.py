@@ -1,124 +1,192 @@
-# Handling Streaming
-# First, we need a callback func. Then, when we get a message in handle_output and
-# The message is of type received_message["msg_type"] == "stream", then we call the callback func.
-# on the partially accumlated or on each message. (easier to do the partially accumulated).
-# At the end, if we called on the partially accumulated, we don't need to call at the return
-# if we call on each individual message, we need to make sure TypeScript  accumulates the results.
-
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
 
-from foresight.utils.generic_utils import create_kernel_message
+# asyncio client running code on Jupyter kernels and returning its output, e.g.
+#
+#     async with AsyncKernelClient(token) as client:
+#         output = await client.run_code(kernel_id, "print(a)")
+#         outputs = await client.run_batch(kernel_id, ["a = 1", "a + 1"])
+#
+# Unlike JupyterKernelProxy, which hands each output to a callback as it comes, the
+# output of an execution is returned at once when the kernel is done with it.
 
+import asyncio
 import json
 import uuid
 from collections import defaultdict
 
-import websockets
-
+from websockets.exceptions import ConnectionClosed
 
-class KernelProxyBlocking:
-    def __init__(self, token):
+from foresight.config import config as conf, prod_type
+from foresight.utils.generic_utils import create_kernel_message
+from foresight.utils.sage_websocket import connect_websocket
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingExecution:
+    """
+    Output of an execution collected until the kernel is done with it: its execute_reply
+    (shell channel) and the idle status (iopub channel) it caused were both received
+    """
+
+    def __init__(self, future):
+        self.future = future
+        # key -> list of the parts received, joined once done
+        self.output = defaultdict(list)
+        self.traceback = None
+        self.execute_reply_received = False
+        self.idle_status_received = False
+
+    def add(self, msg):
+        msg_type = msg["msg_type"]
+        content = msg["content"]
+        if msg_type == "stream":
+            self.output["text"].append(content["text"])
+        elif msg_type in ("execute_result", "display_data"):
+            data = content.get("data", {})
+            self.output["text/plain"].append(data.get("text/plain", ""))
+            for mime_type in ("text/html", "image/png"):
+                if mime_type in data:
+                    self.output[mime_type].append(data[mime_type])
+        elif msg_type == "execute_reply":
+            if content["status"] == "error":
+                self.traceback = content["traceback"]
+                self.output["ename"].append(content["ename"])
+                self.output["evalue"].append(content["evalue"])
+            self.execute_reply_received = True
+        elif msg_type == "status" and content["execution_state"] == "idle":
+            self.idle_status_received = True
+
+        if self.execute_reply_received and self.idle_status_received and not self.future.done():
+            self.future.set_result(self.result())
+
+    def result(self):
+        output = {key: "".join(parts) for key, parts in self.output.items()}
+        if self.traceback is not None:
+            output["traceback"] = self.traceback
+        return output
+
+
+class AsyncKernelClient:
+    """
+    One websocket per kernel, opened on the first execution and again after it drops.
+    Many executions can run at once on the same websocket: the messages received are
+    routed to the execution they answer by the msg_id of their parent header.
+    """
+
+    def __init__(self, token=None, base_ws=None):
+        """
+        :param token: token of the Jupyter server, read from redis by default
+        :param base_ws: websocket url of the Jupyter server, jupyter_ws of the config by default
+        """
+        if token is None:
+            import redis
+
+            redis_server = redis.StrictRedis(host=conf[prod_type]["redis_server"], port=6379, db=0)
+            token = redis_server.get('config:jupyter:token').decode()
+        self.base_ws = base_ws if base_ws is not None else conf[prod_type]['jupyter_ws']
         self.session_id = uuid.uuid4().hex
         self.token = token
         self.headers = {'Authorization': f'Token {token}'}
         self.websockets = {}
+        # kernel_id -> msg_id -> _PendingExecution
+        self.pending = defaultdict(dict)
+        self.__readers = {}
+        self.__locks = defaultdict(asyncio.Lock)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close_all()
 
     async def connect(self, kernel_id):
-        web_server_address = f"ws://localhost/api/kernels/{kernel_id}/channels?session_id={self.session_id}"
-        self.websockets[kernel_id] = await websockets.connect(web_server_address, extra_headers=self.headers)
+        """
+        :return: the websocket to the kernel, opened if needed
+        """
+        # one connection at a time, the executions started meanwhile wait for it
+        async with self.__locks[kernel_id]:
+            if kernel_id in self.websockets:
+                return self.websockets[kernel_id]
+            url = f"{self.base_ws}/api/kernels/{kernel_id}/channels?session_id={self.session_id}"
+            ws = await connect_websocket(url, self.headers)
+            self.websockets[kernel_id] = ws
+            self.__readers[kernel_id] = asyncio.get_running_loop().create_task(self.__read(kernel_id, ws))
+            return ws
+
+    async def __read(self, kernel_id, ws):
+        try:
+            async for message in ws:
+                msg = json.loads(message)
+                msg_id = msg.get("parent_header", {}).get("msg_id")
+                pending = self.pending[kernel_id].get(msg_id)
+                if pending is not None:
+                    pending.add(msg)
+        except Exception as e:
+            logger.warning(f"connection to kernel {kernel_id} lost. \n{e}")
+        finally:
+            # connected again by the next execution
+            if self.websockets.get(kernel_id) is ws:
+                del self.websockets[kernel_id]
+                self.__readers.pop(kernel_id, None)
+            for pending in self.pending[kernel_id].values():
+                if not pending.future.done():
+                    pending.future.set_exception(ConnectionError(f"connection to kernel {kernel_id} closed"))
+
+    async def run_code(self, kernel_id, code, timeout=None):
+        """
+        Runs code and waits for its output
+        :param timeout: seconds to wait for the output, none by default
+        :return: dict of the output, e.g. {"text": "printed"}, {"text/plain": "3"} or
+        {"ename": ..., "evalue": ..., "traceback": [...]}
+        """
+        message = create_kernel_message(self.session_id)
+        message["content"]["code"] = code
+        msg_id = uuid.uuid4().hex
+        message["header"]["msg_id"] = msg_id
 
-    async def send_message(self, kernel_id, message):
-        if kernel_id not in  self.websockets:
-            await self.connect(kernel_id)
-        await self.websockets[kernel_id].send(json.dumps(message))
+        ws = await self.connect(kernel_id)
+        if self.websockets.get(kernel_id) is not ws:
+            # dropped by the reader meanwhile, it wouldn't get the output
+            raise ConnectionError(f"connection to kernel {kernel_id} closed")
+        pending = _PendingExecution(asyncio.get_running_loop().create_future())
+        self.pending[kernel_id][msg_id] = pending
+        try:
+            await ws.send(json.dumps(message))
+            return await asyncio.wait_for(pending.future, timeout)
+        except ConnectionClosed as e:
+            raise ConnectionError(f"connection to kernel {kernel_id} closed") from e
+        finally:
+            del self.pending[kernel_id][msg_id]
+
+    async def run_batch(self, kernel_id, codes, timeout=None, return_exceptions=False):
+        """
+        Runs the snippets concurrently, the kernel still runs them in order
+        :return: list of their outputs, in the order of codes
+        """
+        return await asyncio.gather(*[self.run_code(kernel_id, code, timeout) for code in codes],
+                                    return_exceptions=return_exceptions)
 
     async def close(self, kernel_id):
-        if self.websockets[kernel_id] is not None:
-            await self.websockets[kernel_id].close()
-        del self.websockets[kernel_id]
+        ws = self.websockets.pop(kernel_id, None)
+        reader = self.__readers.pop(kernel_id, None)
+        if ws is not None:
+            await ws.close()
+        if reader is not None:
+            await reader
 
     async def close_all(self):
-        for kernel_id in self.websockets:
-            if self.websockets[kernel_id] is not None:
-                await self.websockets[kernel_id].close()
-        self.websockets = {}
+        for kernel_id in list(self.websockets):
+            await self.close(kernel_id)
 
-    async def run_code(self, kernel_id, code):
-        message = create_kernel_message(self.session_id)
-        message["content"]["code"] = code
-        msg_id = uuid.uuid4().hex
-        message["header"]["msg_id"] = msg_id
-        message["header"]["session"] = self.session_id
-
-        if kernel_id in self.websockets:
-            print(f"is closed: {self.websockets[kernel_id].closed}")
-        if kernel_id in self.websockets and self.websockets[kernel_id].closed:
-            print("Disconnected. Reconnecting...")
-            await self.connect(kernel_id)
-        await self.send_message(kernel_id, message)
-
-        return await self.collect_output(kernel_id)
-
-    async def collect_output(self, kernel_id):
-        output_received = False
-        execute_reply_received = False
-        idle_status_received = False
-        error_received = False
-        output = defaultdict(str)
-
-        while True:
-            received_message = await self.websockets[kernel_id].recv()
-            received_message = json.loads(received_message)
-            # print(received_message["msg_type"], received_message["content"])
-
-            if received_message["msg_type"] == "stream":
-                if not "text" in output:
-                    output["text"] = ""
-                # print(f"Stream and received {received_message['content']['text']}")
-                output["text"] += received_message["content"]["text"]
-                output_received = True
-            elif received_message["msg_type"] == "execute_result":
-                output["text/plain"] += received_message["content"]["data"]["text/plain"]
-                if "text/html" in received_message["content"]["data"]:
-                    output["text/html"] += received_message["content"]["data"]["text/html"]
-                output_received = True
-            elif received_message["msg_type"] == "display_data":
-                output["text/plain"] += received_message["content"]["data"]["text/plain"]
-                if "image/png" in received_message["content"]["data"]:
-                    output["image/png"] += received_message["content"]["data"]["image/png"]
-                output_received = True
-            elif received_message["msg_type"] == "execute_reply":
-                if received_message["content"]["status"] == "error":
-                    output["traceback"] = received_message["content"]["traceback"]
-                    output["ename"] += received_message["content"]["ename"]
-                    output["evalue"] += received_message["content"]["evalue"]
-                    error_received = True
-                execute_reply_received = True
-            elif received_message["msg_type"] == "status" and received_message["content"]["execution_state"] == "idle":
-                idle_status_received = True
-            if execute_reply_received and idle_status_received and (output_received or error_received or True):
-                return dict(output)
-
-
-kernel_id = "87609736-d882-41c3-8bc1-898a32f54aec"
-token = "da792de798fb2b96"
-kernel_proxy = KernelProxyBlocking(token)
-
-# await kernel_proxy.connect(kernel_id)
-# code = "print(a)"
-# await kernel_proxy.run_code(kernel_id, code)
-
-# if __name__ == "__main__":
-#     kernel_id = "87609736-d882-41c3-8bc1-898a32f54aec"
-#     token = "da792de798fb2b96"
-#     kernel_proxy = KernelProxyBlocking(token)
-#     code = "print(a)"
-#
-#
-#     async def main():
-#         await kernel_proxy.connect(kernel_id)
-#         await kernel_proxy.run_code(kernel_id, code)
-#         await websockekernel_proxyt_manager.close(kernel_id)
-#
-#     import asyncio
-#     asyncio.run(main())
 
+# kept for the code written against the prototype
+KernelProxyBlocking = AsyncKernelClient
@@ -22,6 +22,7 @@ from foresight.smartbitfactory import SmartBitFactory
 from foresight.utils.sage_communication import SageCommunication
 from foresight.smartbits.genericsmartbit import GenericSmartBit
 from foresight.utils.sage_websocket import SageWebsocket
+from foresight.utils.message_decoder import MessageDecoder
 from foresight.json_templates.templates import create_app_template
 from foresight.alignment_strategies import *
 from pydantic import BaseModel, Field
@@ -42,6 +43,7 @@ class PySage3:
 
         self.rooms = {}
         self.s3_comm = SageCommunication(self.conf, self.prod_type)
+        self.decoder = MessageDecoder()
         self.socket = SageWebsocket(on_message_fn=self.__process_messages)
 
         self.socket.subscribe(["/api/apps", "/api/rooms", "/api/boards"])
@@ -53,17 +55,10 @@ class PySage3:
         print("Completed configuring Sage3 Client")
 
     def __populate_existing(self):
-        rooms_info = self.s3_comm.get_rooms()
-        for room_info in rooms_info:
-            self.__handle_create("ROOMS", room_info)
-        # Populate existing boards
-        boards_info = self.s3_comm.get_boards()
-        for board_info in boards_info:
-            self.__handle_create("BOARDS", board_info)
-        # Populate existing apps
-        apps_info = self.s3_comm.get_apps()
-        for app_info in apps_info:
-            self.__handle_create("APPS", app_info)
+        # rooms, boards and apps are fetched concurrently and created as they stream in
+        for collection, doc in self.s3_comm.stream_existing():
+            if collection != "READY":
+                self.__handle_create(collection, doc)
 
     def create_app(self, room_id, board_id, app_type, state, app=None):
         try:
@@ -74,7 +69,7 @@ class PySage3:
             obj["roomId"] = room_id
             obj["boardId"] = board_id
             obj["state"].update(state)
-            if app_type not in SmartBitFactory.class_names:
+            if not SmartBitFactory.has_class(app_type):
                 raise Exception("Smartbit not supported in interactive mode")
 
             # just try to create to see if it's going to raise an error
@@ -193,44 +188,17 @@ class PySage3:
         pass
 
     def __process_messages(self, ws, msg):
-        message = json.loads(msg)
-        # Duplicate messages for the time being to allow python to work
-        # event.doc is now an array of docs
-        for doc in message["event"]["doc"]:
-            msg = message.copy()
-            msg["event"]["doc"] = doc
-            # End of duplicating messages so old code can work
-            collection = msg["event"]["col"]
-            doc = msg["event"]["doc"]
-            msg_type = msg["event"]["type"]
-            app_id = doc["_id"]
-
+        # one DocEvent per doc of event.doc, sharing the decoded message
+        for event in self.decoder.decode(msg):
             # Its a create message
-            if msg_type == "CREATE":
-                self.__MSG_METHODS[msg_type](collection, doc)
+            if event.type == "CREATE":
+                self.__MSG_METHODS[event.type](event.col, event.doc)
             # Its a delete message
-            elif msg_type == "DELETE":
-                self.__MSG_METHODS[msg_type](collection, doc)
+            elif event.type == "DELETE":
+                self.__MSG_METHODS[event.type](event.col, event.doc)
             # Its an update message
-            elif msg_type == "UPDATE":
-                # all updates for this message [{id: string, updates: {}}, {id:string, updates: {}}...]
-                all_updates = msg["event"]["updates"]
-                msg_updates = {}
-                # find the updates for this specific app
-                for u in all_updates:
-                    if u["id"] == app_id:
-                        msg_updates = u["updates"]
-                        break
-                msg["event"]["updates"] = msg_updates
-
-                if (
-                    "updates" in msg["event"]
-                    and "raised" in msg["event"]["updates"]
-                    and msg["event"]["updates"]["raised"]
-                ):
-                    pass
-
-                self.__MSG_METHODS[msg_type](collection, doc, msg_updates)
+            elif event.type == "UPDATE":
+                self.__MSG_METHODS[event.type](event.col, event.doc, event.updates)
 
     def update_size(self, app, width=None, height=None, depth=None):
         if not isinstance(app, SmartBit):
@@ -285,9 +253,7 @@ class PySage3:
         app.send_updates()
 
     def list_assets(self, room_id=None):
-        assets = self.s3_comm.get_assets()
-        if room_id is not None:
-            assets = [x for x in assets if x["data"]["room"] == room_id]
+        assets = self.s3_comm.get_assets(room_id=room_id)
         assets_info = []
         for asset in assets:
             assets_info.append(
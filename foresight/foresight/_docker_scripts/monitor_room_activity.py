@@ -12,85 +12,271 @@ Will be changed when I get the address of the docker engine API.
 Docker `watcher` or `head` (find a proper name) started with:
 docker run -t \
     -v /var/run/docker.sock:/var/run/docker.sock \
-    python python /foresight/_docker_scripts/websocketlistener.py
+    python python /foresight/_docker_scripts/monitor_room_activity.py
+
+Each room is served by its own proxy container. The controller follows the rooms
+(/api/rooms) and the users in them (/api/presence) over the websocket:
+  - a room created, or entered by a user while it has no proxy, is handed to a standby
+    proxy right away (see RoomHandoff, or ProxyPool without docker). warm_pool_size
+    standby proxies are kept started, imported and connected, so that handoff is all
+    it takes to serve a room
+  - a room deleted, or left empty for idle_timeout seconds, has its proxy stopped
+  - no more than max_nb_supported_rooms rooms are served at once, the others wait for
+    a proxy to be freed
 """
 
-import sys
-from python_on_whales import DockerClient
-from utils.sage_communication import SageCommunication
-from config import config as conf, prod_type
 import os
-import uuid
 import time
+import threading
+import uuid
+from collections import OrderedDict
 
+from foresight.utils.sage_communication import SageCommunication
+from foresight.utils.sage_websocket import SageWebsocket
+from foresight.utils.message_decoder import MessageDecoder
+from foresight.utils.room_handoff import RoomHandoff
+from foresight.config import config as conf, prod_type
 
-host_URL = os.environ.get("DOCKER_HOST")
-
-if not host_URL:
-    print(" the DOCKER_HOST env variable is not set")
-    sys.exit(1)
+import logging
 
-listener_time_sleep = 5
-max_nb_supported_rooms = 10
+logger = logging.getLogger(__name__)
 
 
-def get_prefix(_uuid, len=16):
+class ComposeLauncher:
     """
-    Get the first len=16 chars of a uuid
-    this is needed to add the string as a prefix to the running docker image
-    :param uuid: ex. 'b34cf54e-2f9e-4b9a-a458-27f4b6c658a7'
-    :return: the first len chars, no including `-`. Example 'b34cf54e2f9e'
+    Starts and stops proxy containers, one docker compose project each
     """
-    return uuid.UUID(_uuid).hex[:len]
 
+    def __init__(self, host_url, compose_file=None):
+        if compose_file is None:
+            compose_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docker-compose-proxy.yml")
+        self.host_url = host_url
+        self.compose_file = compose_file
 
-def hadle_docker_compose_action(room_id, action):
-    """
-    :param prefix: the prefix of the room id to use
-    :param action: `up` to start a docker image and `down` to stop it.
-    :return:
-    """
-    if action not in ["UP", "DOWN"]:
-        raise Exception("unrecognized action {action}")
-
-    with open(".env", "w") as env_file:
-        # .env is exporter by docker compose so the proxy script will have access
-        # ROOM_ID below
-        env_file.write(f"ROOM_ID={room_id}")
-
-    docker = DockerClient(host=host_URL, compose_files=["./docker-compose-proxy.yml"],
-                          compose_project_name=get_prefix(room_id))
-    if action.upper() == "UP":
-        docker.compose.up()
-    else:
-        docker.compose.down()
+    def __docker(self, name):
+        from python_on_whales import DockerClient
 
+        return DockerClient(host=self.host_url, compose_files=[self.compose_file],
+                            compose_env_file=self.__env_file(name), compose_project_name=name)
 
-if __name__ == "__main__":
-    # keep track of room that are currently served by proxy
-    active_rooms = set()
+    def __env_file(self, name):
+        # one .env per project, the variables are read by docker compose (see the yml)
+        return os.path.join(os.path.dirname(self.compose_file), f".env-{name}")
+
+    def start(self, name, room_id=None):
+        """
+        :param room_id: room served by the proxy, None to start it in standby
+        """
+        with open(self.__env_file(name), "w") as env_file:
+            env_file.write(f"PROXY_NAME={name}\n")
+            env_file.write(f"ROOM_ID={room_id or ''}\n")
+            env_file.write(f"PROXY_STANDBY={'' if room_id else '1'}\n")
+        self.__docker(name).compose.up(detach=True)
+
+    def stop(self, name):
+        self.__docker(name).compose.down()
+        try:
+            os.remove(self.__env_file(name))
+        except FileNotFoundError:
+            pass
+
+
+class RoomController:
+
+    def __init__(self, launcher, sage_comm=None, handoff=None, warm_pool_size=None,
+                 max_nb_supported_rooms=None, idle_timeout=None):
+        """
+        :param launcher: starts and stops the proxies, see ComposeLauncher
+        :param warm_pool_size: standby proxies kept started, WARM_POOL_SIZE env. variable
+        or 2 by default
+        :param max_nb_supported_rooms: rooms served at once, MAX_NB_SUPPORTED_ROOMS env.
+        variable or 10 by default
+        :param idle_timeout: seconds a room stays served once empty, ROOM_IDLE_TIMEOUT env.
+        variable or 600 by default
+        """
+        if warm_pool_size is None:
+            warm_pool_size = int(os.getenv("WARM_POOL_SIZE", 2))
+        if max_nb_supported_rooms is None:
+            max_nb_supported_rooms = int(os.getenv("MAX_NB_SUPPORTED_ROOMS", 10))
+        if idle_timeout is None:
+            idle_timeout = float(os.getenv("ROOM_IDLE_TIMEOUT", 600))
+        self.launcher = launcher
+        self.sage_comm = sage_comm
+        self.handoff = handoff if handoff is not None else RoomHandoff()
+        self.warm_pool_size = warm_pool_size
+        self.max_nb_supported_rooms = max_nb_supported_rooms
+        self.idle_timeout = idle_timeout
+
+        # rooms on the server
+        self.rooms = set()
+        # rooms served by a proxy -> time it was handed to the proxy
+        self.active_rooms = {}
+        # rooms waiting for a proxy to be freed, in arrival order
+        self.waiting_rooms = OrderedDict()
+        # user_id -> room_id the user is in, from /api/presence
+        self.presence = {}
+        self.last_activity = {}
+        # names of all the proxies started, and how many of them wait for a room
+        self.proxies = set()
+        self.nb_standby = 0
+        self.socket = None
+        self.decoder = MessageDecoder()
+        self.__lock = threading.RLock()
 
-    sage_comm = SageCommunication(conf, prod_type)
+    def start(self):
+        self.socket = SageWebsocket(on_message_fn=self.process_messages, on_reconnect_fn=self.resync)
+        # subscribed first so no room created meanwhile is missed
+        self.socket.subscribe(["/api/rooms", "/api/presence"])
+        self.fill_pool()
+        self.resync()
 
-    while True:
-        current_rooms = sage_comm.get_rooms()
-        current_room_ids = [x["_id"] for x in current_rooms]
+    def resync(self):
+        """
+        Catches up with the rooms created and deleted since the last sync. Only called
+        at startup and after a reconnection, the events keep the rooms up to date otherwise
+        """
+        rooms = {room["_id"] for room in self.sage_comm.get_rooms()}
+        with self.__lock:
+            for room_id in rooms - self.rooms:
+                self.room_created(room_id)
+            for room_id in self.rooms - rooms:
+                self.room_deleted(room_id)
 
-        # handle inactive_room_ids here (down the docker images)
-        inactive_room_ids = active_rooms - set(current_room_ids)
-        for room_id in inactive_room_ids:
-            hadle_docker_compose_action(room_id, "UP")
-            active_rooms.remove(room_id)
-            max_nb_supported_rooms -= 1
+    def process_messages(self, ws, msg):
+        for event in self.decoder.decode(msg):
+            if event.col == "ROOMS":
+                if event.type == "CREATE":
+                    self.room_created(event.doc["_id"])
+                elif event.type == "DELETE":
+                    self.room_deleted(event.doc["_id"])
+            elif event.col == "PRESENCE":
+                room_id = None if event.type == "DELETE" else event.doc["data"].get("roomId")
+                self.user_moved(event.doc["_id"], room_id or None)
 
-        # handle newly added rooms
-        new_room_ids = set(current_room_ids) - active_rooms
+    def room_created(self, room_id):
+        with self.__lock:
+            self.rooms.add(room_id)
+            self.last_activity[room_id] = time.time()
+            self.activate(room_id)
 
-        for room_id in new_room_ids:
-            if len(active_rooms) < max_nb_supported_rooms:
-                hadle_docker_compose_action(room_id, "UP")
-                active_rooms.add(room_id)
-                max_nb_supported_rooms += 1
+    def room_deleted(self, room_id):
+        with self.__lock:
+            self.rooms.discard(room_id)
+            self.last_activity.pop(room_id, None)
+            self.deactivate(room_id)
+
+    def user_moved(self, user_id, room_id):
+        """
+        :param room_id: room the user is now in, None if they left
+        """
+        with self.__lock:
+            previous = self.presence.pop(user_id, None)
+            if previous is not None:
+                # the room stays warm idle_timeout seconds after its last user left
+                self.last_activity[previous] = time.time()
+            if room_id is None:
+                return
+            self.presence[user_id] = room_id
+            self.last_activity[room_id] = time.time()
+            if room_id in self.rooms:
+                self.activate(room_id)
+
+    def activate(self, room_id):
+        with self.__lock:
+            if room_id in self.active_rooms or room_id in self.waiting_rooms:
+                return
+            if len(self.active_rooms) >= self.max_nb_supported_rooms:
+                logger.warning(f"{len(self.active_rooms)} rooms served already, room {room_id} waits for a proxy")
+                self.waiting_rooms[room_id] = time.time()
+                return
+            self.handoff.offer(room_id)
+            self.active_rooms[room_id] = time.time()
+            if self.nb_standby > 0:
+                self.nb_standby -= 1
+            else:
+                # pool exhausted, this one takes the room once started
+                self.__start_proxy()
+            self.fill_pool()
+        logger.info(f"room {room_id} handed to a proxy")
+
+    def deactivate(self, room_id):
+        with self.__lock:
+            if self.waiting_rooms.pop(room_id, None) is not None or room_id not in self.active_rooms:
+                return
+            del self.active_rooms[room_id]
+            name = self.handoff.release(room_id)
+            if name is not None:
+                self.proxies.discard(name)
+                self.launcher.stop(name)
+            else:
+                # not taken yet, the proxy it was meant for stays in standby
+                self.nb_standby += 1
+            logger.info(f"room {room_id} scaled down")
+            # free slot for the room waiting the longest that still has users. The rooms
+            # left meanwhile are dropped, they wait again when a user enters them
+            occupied = set(self.presence.values())
+            while self.waiting_rooms:
+                next_room, _ = self.waiting_rooms.popitem(last=False)
+                if next_room in occupied:
+                    self.activate(next_room)
+                    break
+
+    def check_idle(self):
+        """
+        Scales down the rooms nobody has been in for idle_timeout seconds
+        """
+        now = time.time()
+        with self.__lock:
+            occupied = set(self.presence.values())
+            for room_id in list(self.active_rooms):
+                if room_id in occupied:
+                    continue
+                if now - self.last_activity.get(room_id, 0) > self.idle_timeout:
+                    self.deactivate(room_id)
+
+    def fill_pool(self):
+        with self.__lock:
+            while self.nb_standby < self.warm_pool_size:
+                self.__start_proxy()
+                self.nb_standby += 1
+
+    def __start_proxy(self):
+        name = f"proxy-{uuid.uuid4().hex[:12]}"
+        self.proxies.add(name)
+        self.launcher.start(name)
+
+    def run_forever(self, check_interval=30):
+        while True:
+            try:
+                time.sleep(check_interval)
+                self.check_idle()
+            except KeyboardInterrupt:
+                self.stop()
+                break
+
+    def stop(self):
+        if self.socket is not None:
+            self.socket.clean_up()
+        with self.__lock:
+            for name in self.proxies:
+                self.launcher.stop(name)
+            self.proxies.clear()
+            self.nb_standby = 0
+
+
+if __name__ == "__main__":
+    host_URL = os.environ.get("DOCKER_HOST")
+
+    if host_URL:
+        controller = RoomController(ComposeLauncher(host_URL), SageCommunication(conf, prod_type))
+    else:
+        # no docker, the proxies are processes of this host forked from a ProxyPool
+        # already importing everything they need
+        from foresight.proxy_pool import ProxyPool
 
-        # sleep and be nice to the system
-        time.sleep(listener_time_sleep)
+        print("the DOCKER_HOST env variable is not set, running the proxies as local processes")
+        pool = ProxyPool()
+        controller = RoomController(pool, SageCommunication(conf, prod_type), handoff=pool,
+                                    warm_pool_size=pool.size)
+    controller.start()
+    controller.run_forever()
@@ -3,8 +3,9 @@
 
 # check the room id is provided
 # ROOM_ID is exported by the compose up script as part of the .env file
+# standby proxies (PROXY_STANDBY) are handed their room once started
 
-if [ -z "$ROOM_ID" ]; then
+if [ -z "$ROOM_ID" ] && [ -z "$PROXY_STANDBY" ]; then
     echo "Must include the room id to run a proxy cotainer" 1>&2
     exit 1
 fi
@@ -14,6 +15,6 @@ export PIP_ROOT_USER_ACTION=ignore
 pip install --upgrade pip
 pip install -r /foresight/requirements.txt
 echo ${ROOM_ID} > /foresight/room.id
-python /foresight/_docker_scripts/test.py
 
-# start proxy.py $1 
+# proxy.py reads ROOM_ID, or waits for a room when PROXY_STANDBY is set
+cd / && python -m foresight.proxy
@@ -0,0 +1,160 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ActionExecutor:
+    """
+    Runs smartbit and board actions (executeFunc) on a bounded pool of worker threads
+    so that a slow action does not block the thread receiving websocket messages.
+
+    Actions submitted with the same key (an app or board id) run one at a time and in
+    submission order. Actions with different keys run in parallel. When max_pending
+    actions are waiting, submit rejects the action rather than blocking the caller, which
+    is usually the thread receiving websocket messages. Work submitted with bounded=False
+    is queued regardless and doesn't count against max_pending.
+
+    Threads are used rather than processes since actions mutate the in-memory smartbits
+    and use their connections (kernels, redis, http clients).
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        if max_workers is None:
+            max_workers = int(os.getenv("PROXY_MAX_WORKERS", 8))
+        if max_pending is None:
+            max_pending = int(os.getenv("PROXY_MAX_PENDING", 1000))
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sage-action")
+
+        self.__lock = threading.Lock()
+        self.__idle = threading.Condition(self.__lock)
+        self.__slots = threading.BoundedSemaphore(max_pending)
+        # key -> deque of (enqueued_at, name, func, params, bounded). The head of the deque
+        # is the action currently running (or about to run) for that key
+        self.__queues = {}
+        self.__metrics = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "pending": 0,
+            "max_pending": 0,
+            "total_wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "total_run_time": 0.0,
+            "max_run_time": 0.0,
+        }
+
+    def submit(self, key, func, params=None, name=None, bounded=True):
+        """
+        Queues func(**params) to run after all the actions previously submitted with key
+        :param key: serialization key, usually the id of the app or board the action targets
+        :param func: the callable to run
+        :param params: keyword arguments passed to func
+        :param name: name used in logs, defaults to the name of func
+        :param bounded: False to queue func even when max_pending actions are waiting, for
+        the work that can't be dropped (e.g. applying the server's updates to an app)
+        :return: False if the action was rejected since max_pending actions are waiting
+        """
+        if params is None:
+            params = {}
+        if name is None:
+            name = getattr(func, "__name__", str(func))
+
+        if bounded and not self.__slots.acquire(blocking=False):
+            with self.__lock:
+                self.__metrics["rejected"] += 1
+            logger.error(f"Rejected function `{name}` on `{key}`, {self.max_pending} actions are already pending")
+            return False
+        job = (time.monotonic(), name, func, params, bounded)
+        with self.__lock:
+            self.__metrics["submitted"] += 1
+            self.__metrics["pending"] += 1
+            self.__metrics["max_pending"] = max(self.__metrics["max_pending"], self.__metrics["pending"])
+            if key in self.__queues:
+                self.__queues[key].append(job)
+                return True
+            self.__queues[key] = deque([job])
+        self.pool.submit(self.__run_next, key)
+        return True
+
+    def __run_next(self, key):
+        with self.__lock:
+            enqueued_at, name, func, params, bounded = self.__queues[key][0]
+
+        started_at = time.monotonic()
+        failed = False
+        try:
+            logger.debug(f"About to execute function --{name}-- on {key} with params --{params}--")
+            func(**params)
+        except Exception as e:
+            failed = True
+            logger.error(f"Exception trying to execute function `{name}` on `{key}`. \n{e}")
+        finished_at = time.monotonic()
+
+        with self.__lock:
+            wait_time = started_at - enqueued_at
+            run_time = finished_at - started_at
+            self.__metrics["pending"] -= 1
+            self.__metrics["failed" if failed else "completed"] += 1
+            self.__metrics["total_wait_time"] += wait_time
+            self.__metrics["max_wait_time"] = max(self.__metrics["max_wait_time"], wait_time)
+            self.__metrics["total_run_time"] += run_time
+            self.__metrics["max_run_time"] = max(self.__metrics["max_run_time"], run_time)
+
+            queue = self.__queues[key]
+            queue.popleft()
+            if not queue:
+                del self.__queues[key]
+            has_next = key in self.__queues
+            if self.__metrics["pending"] == 0:
+                self.__idle.notify_all()
+        if bounded:
+            self.__slots.release()
+
+        # give the worker back to the pool between actions so a busy app cannot
+        # monopolize a thread while other apps wait
+        if has_next:
+            self.pool.submit(self.__run_next, key)
+
+    def queue_depth(self, key=None):
+        """
+        Number of actions pending (running or waiting) for key, or for all keys if key is None
+        """
+        with self.__lock:
+            if key is None:
+                return self.__metrics["pending"]
+            return len(self.__queues.get(key, ()))
+
+    def get_metrics(self):
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            metrics["active_keys"] = len(self.__queues)
+        done = metrics["completed"] + metrics["failed"]
+        metrics["avg_wait_time"] = metrics["total_wait_time"] / done if done else 0.0
+        metrics["avg_run_time"] = metrics["total_run_time"] / done if done else 0.0
+        return metrics
+
+    def clean_up(self, wait=True):
+        """
+        Stops the workers. With wait, all the actions already submitted run first
+        """
+        if wait:
+            with self.__idle:
+                self.__idle.wait_for(lambda: self.__metrics["pending"] == 0)
+        self.pool.shutdown(wait=wait)
@@ -6,7 +6,6 @@
 #  the file LICENSE, distributed as part of this software.
 #-----------------------------------------------------------------------------
 
-from funcx.sdk.client import FuncXClient
 # from config import funcx
 import time
 import threading
@@ -34,6 +33,9 @@ class AIClient(Borg):
         # TODO reformat this as dict[app_id: str, set ]
         self.running_jobs = set()
         if 'fxc' not in self.__dict__:
+            # imported with the first client, funcx is slow to import
+            from funcx.sdk.client import FuncXClient
+
             print("Instantiating a FuncX client")
             self.fxc = FuncXClient()
 
@@ -1,5 +1,15 @@
 from foresight.smartbits.smartbit import SmartBit
 from typing import List
+from functools import wraps
+
+
+def batched(_func):
+    """sends all the updates made by the alignment function as a single batch request"""
+    @wraps(_func)
+    def wrapper(*args, **kwargs):
+        with SmartBit.batch():
+            return _func(*args, **kwargs)
+    return wrapper
 
 
 def get_app_geometry(smartbits: List[SmartBit] = None):
@@ -10,6 +20,7 @@ def get_app_geometry(smartbits: List[SmartBit] = None):
     bottom_y = max([smartbit.data.position.y + smartbit.data.size.height for smartbit in smartbits])
     return left_x, right_x, top_y, bottom_y
 
+@batched
 def align_to_left(smartbits: List[SmartBit]):
     left_x, _, _, _ = get_app_geometry(smartbits)
     for smartbit in smartbits:
@@ -17,6 +28,7 @@ def align_to_left(smartbits: List[SmartBit]):
         smartbit.send_updates()
 
 
+@batched
 def align_to_right(smartbits: List[SmartBit]):
     _, right_x, _, _ = get_app_geometry(smartbits)
     for smartbit in smartbits:
@@ -24,6 +36,7 @@ def align_to_right(smartbits: List[SmartBit]):
         smartbit.send_updates()
 
 
+@batched
 def align_col_center(smartbits: List[SmartBit]):
     # Find the widest app
     left_x, right_x, _, _ = get_app_geometry(smartbits)
@@ -36,6 +49,7 @@ def align_col_center(smartbits: List[SmartBit]):
         smartbit.send_updates()
 
 
+@batched
 def align_row_center(smartbits: List[SmartBit]):
     _, _, top_y, bottom_y = get_app_geometry(smartbits)
     center = (bottom_y - top_y) / 2
@@ -45,19 +59,24 @@ def align_row_center(smartbits: List[SmartBit]):
                                     ((smartbit.data.size.height / 2) - smartbit.data.position.y)
         smartbit.send_updates()
 
+@batched
 def align_stack(smartbits: List[SmartBit], gap: int = 20):
     left_x, _, top_y, _ = get_app_geometry(smartbits)
     for i, smartbit in enumerate(smartbits):
         smartbit.data.position.y = top_y + i * gap
         smartbit.data.position.x = left_x + i * gap
         smartbit.data.raised = True
-    for i, smartbit in enumerate(smartbits):
-        smartbit.data.raised = True
+    for smartbit in smartbits:
         smartbit.send_updates()
+    # raised needs to reach the server as True before it is reset, so the two
+    # states can't be merged in the same batch
+    SmartBit._coalescer.flush()
+    for smartbit in smartbits:
         smartbit.data.raised = False
         smartbit.send_updates()
 
 
+@batched
 def align_to_bottom(smartbits: List[SmartBit]):
     _, _, _, bottom_y = get_app_geometry(smartbits)
     for smartbit in smartbits:
@@ -65,6 +84,7 @@ def align_to_bottom(smartbits: List[SmartBit]):
         smartbit.send_updates()
 
 
+@batched
 def align_by_row(smartbits: List[SmartBit], num_rows: int = 1, gap: int = 20) -> None:
     left_x, _, top_y, _ = get_app_geometry(smartbits)
     for i, smartbit in enumerate(smartbits):
@@ -80,6 +100,7 @@ def align_by_row(smartbits: List[SmartBit], num_rows: int = 1, gap: int = 20) ->
     for smartbit in smartbits:
         smartbit.send_updates()
 
+@batched
 def align_by_col(smartbits: List[SmartBit], num_cols: int = 1, gap: int = 20) -> None:
     sorted_smartbits = sorted(smartbits, key=lambda sb: (sb.data.size.height), reverse=True)
 
@@ -111,6 +132,7 @@ def align_by_col(smartbits: List[SmartBit], num_cols: int = 1, gap: int = 20) ->
         smartbit.send_updates()
 
 
+@batched
 def align_to_top(smartbits: List[SmartBit]):
     _, _, top_y, _ = get_app_geometry(smartbits)
     for smartbit in smartbits:
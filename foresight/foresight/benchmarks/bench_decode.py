@@ -0,0 +1,94 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+"""
+Throughput of turning websocket messages into per-doc events, as done by
+SAGEProxy.process_messages.
+
+Compares the former json.loads + shallow copy of the message for each doc with
+MessageDecoder for each installed decoder, on a trace of messages shaped like the
+server's: app moves (UPDATE of 1 to 50 apps), state updates on a page of DataTable
+viewData, and app creations.
+
+python -m foresight.benchmarks.bench_decode [trace.jsonl]
+
+A trace captured from a running server (one message per line) can be given instead.
+"""
+
+import copy
+import json
+import sys
+import time
+
+from foresight.smartbits.tests.sample_sb_docs import counter_doc
+from foresight.utils.generic_utils import group_updates_by_id
+from foresight.utils.message_decoder import MessageDecoder, available_decoders
+
+
+def app_doc(i):
+    doc = copy.deepcopy(counter_doc)
+    doc["_id"] = f"app-{i}"
+    doc["data"]["state"] = doc.pop("state")
+    return doc
+
+
+def make_trace():
+    trace = []
+    for nb_apps in [1, 1, 1, 5, 50]:
+        docs = [app_doc(i) for i in range(nb_apps)]
+        updates = [{"id": d["_id"], "updates": {"position": d["data"]["position"]}} for d in docs]
+        trace.append({"id": "s", "event": {"col": "APPS", "type": "UPDATE", "doc": docs, "updates": updates}})
+    page = {"columns": [f"c{i}" for i in range(20)], "data": [[i * 0.5] * 20 for i in range(50)]}
+    doc = app_doc(0)
+    doc["data"]["state"]["viewData"] = page
+    trace.append({"id": "s", "event": {"col": "APPS", "type": "UPDATE", "doc": [doc],
+                                       "updates": [{"id": doc["_id"], "updates": {"state.viewData": page}}]}})
+    trace.append({"id": "s", "event": {"col": "APPS", "type": "CREATE", "doc": [app_doc(1)]}})
+    return [json.dumps(m) for m in trace]
+
+
+def legacy_decode(raw):
+    message = json.loads(raw)
+    updates_by_id = {}
+    if message['event']['type'] == "UPDATE":
+        updates_by_id = group_updates_by_id(message['event']['updates'])
+    events = []
+    for doc in message['event']['doc']:
+        msg = message.copy()
+        msg['event']['doc'] = doc
+        if msg["event"]["type"] == "UPDATE":
+            msg['event']['updates'] = updates_by_id.get(doc["_id"], {})
+        events.append({"event": dict(msg["event"])})
+    return events
+
+
+def throughput(decode, trace, seconds=1.0):
+    nb_messages = 0
+    nb_docs = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for raw in trace:
+            nb_docs += len(decode(raw))
+        nb_messages += len(trace)
+    return nb_messages / (time.perf_counter() - start), nb_docs / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            trace = [line.strip() for line in f if line.strip()]
+    else:
+        trace = make_trace()
+    print(f"{len(trace)} messages, {sum(len(m) for m in trace) / 1024:.0f} KiB")
+    print(f"{'decoder':>16} | {'messages/s':>10} | {'docs/s':>10} | {'speedup':>8}")
+    rows = [("json + copy", legacy_decode)] + [(name, MessageDecoder(name).decode) for name in available_decoders()]
+    base = None
+    for name, decode in rows:
+        messages, docs = throughput(decode, trace)
+        base = base or messages
+        print(f"{name:>16} | {messages:>10.0f} | {docs:>10.0f} | {messages / base:>7.1f}x")
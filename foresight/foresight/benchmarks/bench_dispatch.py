@@ -0,0 +1,64 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+"""
+Microbenchmark of the per-message dispatch work done by the proxy for a batched
+APPS UPDATE: finding each doc's updates and resolving its smartbit.
+
+Compares the former linear scan of event.updates + rooms/boards dict walk with the
+one-pass grouping + flat app index, for growing batch sizes.
+
+python -m foresight.benchmarks.bench_dispatch
+"""
+
+import timeit
+import uuid
+
+from foresight.utils.generic_utils import group_updates_by_id
+
+
+def make_batch(nb_docs, nb_rooms=4, nb_boards=8):
+    rooms = {}
+    index = {}
+    docs = []
+    for i in range(nb_docs):
+        room_id = f"room-{i % nb_rooms}"
+        board_id = f"board-{i % nb_boards}"
+        app_id = str(uuid.uuid4())
+        rooms.setdefault(room_id, {}).setdefault(board_id, {})[app_id] = object()
+        index[app_id] = rooms[room_id][board_id][app_id]
+        docs.append({"_id": app_id, "data": {"roomId": room_id, "boardId": board_id}})
+    updates = [{"id": d["_id"], "updates": {"state.count": 1}} for d in docs]
+    return rooms, index, docs, updates
+
+
+def linear_dispatch(rooms, docs, updates):
+    for doc in docs:
+        msg_updates = {}
+        for u in updates:
+            if u["id"] == doc["_id"]:
+                msg_updates = u["updates"]
+                break
+        sb = rooms[doc["data"]["roomId"]][doc["data"]["boardId"]][doc["_id"]]
+
+
+def indexed_dispatch(index, docs, updates):
+    updates_by_id = group_updates_by_id(updates)
+    for doc in docs:
+        msg_updates = updates_by_id.get(doc["_id"], {})
+        sb = index.get(doc["_id"])
+
+
+if __name__ == "__main__":
+    print(f"{'batch size':>10} | {'linear (us)':>12} | {'indexed (us)':>12} | {'speedup':>8}")
+    for nb_docs in [1, 10, 100, 500, 1000, 5000]:
+        rooms, index, docs, updates = make_batch(nb_docs)
+        number = max(1, 20000 // nb_docs)
+        t_linear = timeit.timeit(lambda: linear_dispatch(rooms, docs, updates), number=number) / number
+        t_indexed = timeit.timeit(lambda: indexed_dispatch(index, docs, updates), number=number) / number
+        print(f"{nb_docs:>10} | {t_linear * 1e6:>12.1f} | {t_indexed * 1e6:>12.1f} | {t_linear / t_indexed:>7.1f}x")
@@ -0,0 +1,104 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+"""
+Microbenchmark of applying an UPDATE message to a smartbit (refresh_data_form_update).
+
+Compares the former implementation, which re-set every leaf of the doc for each
+update key that is not a path into a dict, with the per-class compiled UpdateSetter
+that only writes the updated keys. Runs on the sample Counter doc of
+smartbits/tests/sample_sb_docs.py and on a DataTable-sized doc whose viewData holds a
+page of 50x20 cells.
+
+Importing the smartbits needs the same environment as the proxy (ENVIRONMENT, TOKEN).
+
+python -m foresight.benchmarks.bench_refresh
+"""
+
+import copy
+import time
+
+from foresight.benchmarks.bench_tracking import make_classes, Root, doc as datatable_doc
+from foresight.smartbits.counter import Counter
+from foresight.smartbits.smartbit import TrackedBaseModel
+from foresight.smartbits.tests.sample_sb_docs import counter_doc
+
+
+def legacy_refresh_data_form_update(self, update_data, updates):
+    update_data['state'] = update_data['data']['state']
+    del (update_data['data']['state'])
+    do_not_modify = ["_id", "_createdAt", '_updatedAt', '_createdBy', '_updatedBy']
+    _ = [update_data.pop(key, None) for key in do_not_modify]
+
+    def attrsetter(name):
+        def setter(obj, val):
+            fields = name.split(".")
+            for field in fields[0:-1]:
+                try:
+                    obj = getattr(obj, field)
+                except:
+                    try:
+                        obj[field] = {}
+                        obj = obj[field]
+                    except:
+                        raise Exception("Not a dict?")
+            try:
+                object.__setattr__(obj, fields[-1], val)
+            except:
+                obj[fields[-1]] = val
+        return setter
+
+    def recursive_iter(u_data, path=[]):
+        if isinstance(u_data, dict) and len(u_data) > 0:
+            for k, item in u_data.items():
+                path.append(k)
+                yield from recursive_iter(item, path)
+                path.pop(-1)
+        else:
+            yield (".".join(path), u_data)
+
+    for updated_field_id, updated_field_val in updates.items():
+        if len(updated_field_id.split(".")) > 1 and self.is_dotted_path_dict(updated_field_id):
+            attrsetter(updated_field_id)(self, updated_field_val)
+        else:
+            for dotted_path, val in recursive_iter(update_data):
+                attrsetter(dotted_path)(self, val)
+
+
+def as_update(doc):
+    update_data = copy.deepcopy(doc)
+    update_data.setdefault("_createdAt", 0)
+    update_data["data"]["state"] = update_data.pop("state")
+    return update_data
+
+
+def run(refresh, sb, doc, updates, number):
+    docs = [as_update(doc) for _ in range(number)]
+    start = time.perf_counter()
+    for update_data in docs:
+        refresh(sb, update_data, updates)
+    return (time.perf_counter() - start) / number
+
+
+if __name__ == "__main__":
+    datatable_cls = make_classes(TrackedBaseModel, Root)
+    cases = [
+        ("Counter: count", Counter, counter_doc, {"state.count": 43}),
+        ("Counter: move", Counter, counter_doc, {"position": {"x": 1, "y": 2, "z": 0}}),
+        ("DataTable: page", datatable_cls, datatable_doc,
+         {"state.currentPage": 2, "state.executeInfo": {"executeFunc": "paginate", "params": {}}}),
+        ("DataTable: move + raise", datatable_cls, datatable_doc,
+         {"position": {"x": 1, "y": 2, "z": 0}, "raised": True}),
+    ]
+    number = 2000
+    print(f"{'update':>24} | {'former (us)':>11} | {'targeted (us)':>13} | {'speedup':>8}")
+    for name, cls, doc, updates in cases:
+        sb = cls(**copy.deepcopy(doc))
+        t_former = run(legacy_refresh_data_form_update, sb, doc, updates, number)
+        t_new = run(cls.refresh_data_form_update, sb, doc, updates, number)
+        print(f"{name:>24} | {t_former * 1e6:>11.1f} | {t_new * 1e6:>13.1f} | {t_former / t_new:>7.1f}x")
@@ -0,0 +1,199 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+"""
+Microbenchmark of field tracking on a smartbit with a DataTable-sized state: cost of
+creating the smartbit, of an attribute write, and of send_updates (collecting the
+written fields and their values) after a paginate-like action that writes 10 fields.
+
+Compares the former tracking (dotted path string added to a shared set on every write,
+paths resolved again with attrgetter at send time, nested models wired by two BFS
+per instance) with the per-class FieldTable and dirty bits of TrackedBaseModel.
+
+Importing the smartbits needs the same environment as the proxy (ENVIRONMENT, TOKEN).
+
+python -m foresight.benchmarks.bench_tracking
+"""
+
+import copy
+import timeit
+from operator import attrgetter
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from foresight.smartbits.smartbit import TrackedBaseModel
+
+
+class LegacyTrackedBaseModel(BaseModel):
+    path: Optional[str]
+    touched: Optional[set] = set()
+
+    def __setattr__(self, name, value):
+        try:
+            if self.path is not None:
+                if name[0] != "_":
+                    self.touched.add(f"{self.path}.{name}"[1:])
+            super().__setattr__(name, value)
+        except:
+            self.touched.remove(f"{self.path}.{name}"[1:])
+
+    def copy_touched(self):
+        touched = self.touched
+        fields = [("self", self)]
+        while fields:
+            field = fields.pop(0)
+            for child in [(i, field[1].__dict__[i]) for i in field[1].__fields__.keys()]:
+                if isinstance(child[1], BaseModel) and child[0] != "_":
+                    child[1].touched = touched
+                    fields.append(child)
+
+    def set_path(self):
+        self.path = ""
+        fields = [("self", self)]
+        while fields:
+            field = fields.pop(0)
+            path = field[1].path
+            for child in [(i, field[1].__dict__[i]) for i in field[1].__fields__.keys()]:
+                if isinstance(child[1], BaseModel):
+                    child[1].path = path + "." + child[0]
+                    fields.append(child)
+
+    def get_all_touched_fields_dict(self):
+        data = {}
+        for field in self.touched:
+            if field.startswith("data."):
+                data[field[5:]] = attrgetter(field)(self)
+            else:
+                data[field] = attrgetter(field)(self)
+        return data
+
+
+def make_classes(base, root_base):
+    class Position(base):
+        x: int
+        y: int
+        z: int
+
+    class Size(base):
+        width: int
+        height: int
+        depth: int
+
+    class Data(base):
+        position: Position
+        size: Size
+        type: str
+        raised: bool
+
+    class ExecuteInfo(base):
+        executeFunc: str
+        params: dict
+
+    class State(base):
+        executeInfo: ExecuteInfo
+        viewData: Optional[dict]
+        totalRows: int
+        rowsPerPage: int
+        currentPage: int
+        pageNumbers: list
+        indexOfFirstRow: int
+        indexOfLastRow: int
+        selectedCols: list
+        selectedCol: str
+        selectedRows: list
+        selectedRow: str
+        timestamp: float
+
+    class App(root_base):
+        app_id: str = Field(alias='_id')
+        data: Data
+        state: State
+
+    return App
+
+
+class LegacyRoot(LegacyTrackedBaseModel):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.copy_touched()
+        self.set_path()
+
+
+class Root(TrackedBaseModel):
+    # same wiring as SmartBit.__init__
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.track_fields()
+
+
+doc = {
+    "_id": "app",
+    "data": {"position": {"x": 0, "y": 0, "z": 0}, "size": {"width": 400, "height": 400, "depth": 0},
+             "type": "DataTable", "raised": False},
+    "state": {"executeInfo": {"executeFunc": "", "params": {}},
+              "viewData": {"columns": [f"c{i}" for i in range(20)], "data": [[0] * 20 for _ in range(50)]},
+              "totalRows": 1000, "rowsPerPage": 50, "currentPage": 1, "pageNumbers": list(range(1, 21)),
+              "indexOfFirstRow": 0, "indexOfLastRow": 50, "selectedCols": [], "selectedCol": "",
+              "selectedRows": [], "selectedRow": "", "timestamp": 0.0},
+}
+
+
+def paginate(app):
+    # the fields written by DataTable.paginate
+    state = app.state
+    state.totalRows = 1000
+    state.pageNumbers = list(range(1, 21))
+    state.indexOfLastRow = 100
+    state.indexOfFirstRow = 50
+    state.viewData = doc["state"]["viewData"]
+    state.timestamp = 1.0
+    state.executeInfo.executeFunc = ""
+    state.executeInfo.params = {}
+    app.data.position.x = 10
+    app.data.raised = True
+
+
+def send_legacy(app):
+    data = app.get_all_touched_fields_dict()
+    app.touched.clear()
+    return data
+
+
+def send(app):
+    data = app.get_all_touched_fields_dict()
+    app.clear_touched()
+    return data
+
+
+if __name__ == "__main__":
+    legacy_cls = make_classes(LegacyTrackedBaseModel, LegacyRoot)
+    tracked_cls = make_classes(TrackedBaseModel, Root)
+    legacy = legacy_cls(**copy.deepcopy(doc))
+    tracked = tracked_cls(**copy.deepcopy(doc))
+    assert send_legacy(legacy) == {} and send(tracked) == {}
+    paginate(legacy)
+    paginate(tracked)
+    assert send_legacy(legacy) == send(tracked)
+
+    number = 20000
+    print(f"{'operation':>28} | {'former (us)':>11} | {'tracked (us)':>12} | {'speedup':>8}")
+    rows = [
+        ("create", lambda: legacy_cls(**doc), lambda: tracked_cls(**doc)),
+        ("setattr leaf", lambda: setattr(legacy.state, "currentPage", 2),
+         lambda: setattr(tracked.state, "currentPage", 2)),
+        ("setattr nested leaf", lambda: setattr(legacy.data.position, "x", 2),
+         lambda: setattr(tracked.data.position, "x", 2)),
+        ("paginate (10 writes)", lambda: paginate(legacy), lambda: paginate(tracked)),
+        ("paginate + send_updates", lambda: (paginate(legacy), send_legacy(legacy)),
+         lambda: (paginate(tracked), send(tracked))),
+    ]
+    for name, former, new in rows:
+        t_former = timeit.timeit(former, number=number) / number
+        t_new = timeit.timeit(new, number=number) / number
+        print(f"{name:>28} | {t_former * 1e6:>11.2f} | {t_new * 1e6:>12.2f} | {t_former / t_new:>7.1f}x")
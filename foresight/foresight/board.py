@@ -9,8 +9,8 @@ import json
 
 from foresight.smartbitcollection import SmartBitsCollection
 from foresight.utils.layout import Layout
-from foresight.celery_tasks import CeleryTaskQueue
 from foresight.alignment_strategies import *
+from foresight.smartbits.smartbit import SmartBit
 
 BOARD_COLORS = ['red', 'orange', 'yellow', 'green', 'teal', 'blue', 'cyan', 'purple', 'pink']
 
@@ -30,13 +30,32 @@ class Board:
         self.whiteboard_lines = None
         self.smartbits = SmartBitsCollection()
         self.stored_app_dims = {}
-        self.cq = CeleryTaskQueue()
+        # created by the first task, importing celery and connecting to redis
+        self._cq = None
 
         if "executeInfo" in doc["data"]:
             self.executeInfo = doc["data"]["executeInfo"]
         else:
             self.executeInfo = {"executeFunc": "", "params": {}}
 
+    @property
+    def cq(self):
+        if self._cq is None:
+            from foresight.celery_tasks import CeleryTaskQueue
+
+            self._cq = CeleryTaskQueue()
+        return self._cq
+
+    def batch(self):
+        """
+        Context manager sending the updates of all the apps changed inside the block
+        as a single batch request
+
+        with board.batch():
+            ...
+        """
+        return SmartBit.batch()
+
     def reorganize_layout(
             self,
             viewport_position,
@@ -77,27 +96,29 @@ class Board:
         self.stored_app_dims = app_dims
         # print(f"app_dims is {app_dims}")
 
-        app_to_type = {x: type(self.smartbits[x]).__name__ for x in app_dims.keys()}
+        app_to_type = {x: self.smartbits[x].data.type for x in app_dims.keys()}
         # print(f"app_to_type is {app_to_type}")
 
         self.layout = Layout(app_dims, viewport_position, viewport_size)
         self.layout.fdp_graphviz_layout(app_to_type)
 
-        for app_id, coords in self.layout._layout_dict.items():
-            sb = self.smartbits[app_id]
-            sb.data.position.x = coords[0]
-            sb.data.position.y = coords[1]
-            sb.send_updates()
+        with self.batch():
+            for app_id, coords in self.layout._layout_dict.items():
+                sb = self.smartbits[app_id]
+                sb.data.position.x = coords[0]
+                sb.data.position.y = coords[1]
+                sb.send_updates()
         print("Done executing organize_layout on the board")
 
         self.executeInfo = {"executeFunc": "", "params": {}}
 
     def restore_layout(self):
-        for app_id, coords in self.stored_app_dims.items():
-            sb = self.smartbits[app_id]
-            sb.data.size.width = coords[0]
-            sb.data.size.height = coords[1]
-            sb.send_updates()
+        with self.batch():
+            for app_id, coords in self.stored_app_dims.items():
+                sb = self.smartbits[app_id]
+                sb.data.size.width = coords[0]
+                sb.data.size.height = coords[1]
+                sb.send_updates()
 
     def update_stickies_form_labels(self, result):
         data = result['data']['application/json']
@@ -105,11 +126,12 @@ class Board:
 
         # {custer_label: number, ....}
         clusters = { b:a for a,b in enumerate(data.values())}
-        for k, v in data.items():
-            sb = self.smartbits[k]
-            sb.state.text = f"{sb.state.text} ({v})"
-            sb.state.color = BOARD_COLORS[clusters[v]]
-            sb.send_updates()
+        with self.batch():
+            for k, v in data.items():
+                sb = self.smartbits[k]
+                sb.state.text = f"{sb.state.text} ({v})"
+                sb.state.color = BOARD_COLORS[clusters[v]]
+                sb.send_updates()
 
 
     def group_by_topic(self,
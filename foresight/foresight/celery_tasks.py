@@ -1,12 +1,18 @@
 from foresight.config import config as conf, prod_type
+import os
 import uuid
-from threading import Thread, Lock
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Condition
 
 from celery import Celery
+import redis
 import time
 import httpx
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 redis_server = conf[prod_type]["redis_server"]
 app = Celery('celery_tasks', broker=f'redis://{redis_server}/0', backend=f'redis://{redis_server}/0')
 seer_server = conf[prod_type]["seer_server"]
@@ -35,50 +41,126 @@ def seer_task(task_name, input):
     return resp.json()
 
 
+class ResultDispatcher:
+    """
+    Hands the results of the celery tasks to their callbacks as soon as they are stored,
+    one per process, shared by all the CeleryTaskQueue.
+
+    The redis result backend publishes each result on a channel of its own, the dispatcher
+    subscribes to the channels of the tasks it waits for on a single connection and calls
+    the callbacks on a pool of CELERY_CALLBACK_WORKERS threads (2 by default). No task is
+    polled, the delay before a callback doesn't depend on the number of tasks pending.
+    """
+    _shared_state = {}
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if "callbacks" not in self.__dict__:
+            self.lock = Lock()
+            # task_id -> (AsyncResult, callback, on_done)
+            self.callbacks = {}
+            self.executor = ThreadPoolExecutor(max_workers=int(os.getenv("CELERY_CALLBACK_WORKERS", 2)),
+                                               thread_name_prefix="celery-callbacks")
+            self.redis = redis.StrictRedis(host=redis_server, port=6379, db=0)
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            self.thread = None
+
+    def watch(self, result, callback, on_done=None):
+        """
+        Calls callback with the result of the task once it succeeded
+        :param on_done: called without arguments once the task is over, succeeded or not
+        """
+        channel = self.__channel(result.id)
+        with self.lock:
+            self.callbacks[result.id] = (result, callback, on_done)
+            self.pubsub.subscribe(**{channel: self.__on_message})
+            if self.thread is None:
+                # waits for the messages up to 1s at a time, only to notice when it is stopped
+                self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True,
+                                                        exception_handler=self.__on_error)
+        # done before the subscription
+        if result.ready():
+            self.__complete(result.id)
+
+    @staticmethod
+    def __channel(task_id):
+        return app.backend.get_key_for_task(task_id).decode()
+
+    def __on_message(self, message):
+        channel = message["channel"]
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        self.__complete(channel[len(self.__channel("")):])
+
+    def __on_error(self, e, pubsub, thread):
+        logger.warning(f"Lost the connection to the celery results, checking the tasks pending. \n{e}")
+        # the results published meanwhile were missed, redis-py subscribes again on reconnection
+        time.sleep(1)
+        with self.lock:
+            task_ids = [task_id for task_id, (result, _, _) in self.callbacks.items() if result.ready()]
+        for task_id in task_ids:
+            self.__complete(task_id)
+
+    def __complete(self, task_id):
+        with self.lock:
+            entry = self.callbacks.pop(task_id, None)
+            if entry is None:
+                return
+            self.pubsub.unsubscribe(self.__channel(task_id))
+        self.executor.submit(self.__deliver, task_id, *entry)
+
+    @staticmethod
+    def __deliver(task_id, result, callback, on_done):
+        try:
+            if result.successful():
+                callback(result.result)
+            else:
+                logger.error(f"Task {task_id} failed.")
+        except Exception as e:
+            logger.error(f"Error handling the result of task {task_id}. \n{e}")
+        finally:
+            if on_done is not None:
+                on_done()
+
+
+def _reset_after_fork():
+    # the dispatcher thread of the parent doesn't exist in a forked child
+    ResultDispatcher._shared_state.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
 class CeleryTaskQueue:
     def __init__(self):
         self.task_name_to_func = {"seer": seer_task}
 
-        self.job_queue = Queue()
-        self.job_checker_thread = Thread(target=self.check_jobs, args=())
-        self.job_checker_thread.start()
+        self.dispatcher = ResultDispatcher()
         self.pending_tasks = [0]
         self.pending_tasks_lock = Lock()
+        self.__tasks_done = Condition(self.pending_tasks_lock)
 
-    def check_jobs(self):
-        while True:
-            # Get a job from the queue, blocking until one is available
-            job = self.job_queue.get()
-
-            if job == "STOP":
-                break
-
-            task_id, result, callback = job
-            if result.ready():
-                if result.successful():
-                    callback(result.result)
-                else:
-                    print(f"Task {task_id} failed.")
-                with self.pending_tasks_lock:
-                    self.pending_tasks[0] -= 1
-            # If the job is not completed, add it back to the queue
-            else:
-                self.job_queue.put(job)
-            time.sleep(1)
+    def __submit(self, result, callback):
+        with self.pending_tasks_lock:
+            self.pending_tasks[0] += 1
+        self.dispatcher.watch(result, callback, on_done=self.__task_done)
+
+    def __task_done(self):
+        with self.__tasks_done:
+            self.pending_tasks[0] -= 1
+            self.__tasks_done.notify_all()
 
     # Task execution
     def __execute_add_task(self, custom_callback):
         task_id = str(uuid.uuid4())  # Generate a UUID for the task
         result = add.apply_async(args=({"x": 1, "y": 2},), task_id=task_id)  # Run the task with the generated UUID
-        return task_id, result, custom_callback
+        return result, custom_callback
 
     def execute_add_task(self, task_input, custom_callback):
         "User for example only"
         print(f"Task input is {task_input}")
-        job = self.__execute_add_task(custom_callback)
-        self.job_queue.put(job)
-        with self.pending_tasks_lock:
-            self.pending_tasks[0] += 1
+        self.__submit(*self.__execute_add_task(custom_callback))
 
     def execute_task(self, task_input, custom_callback):
         # TODO: implement proper validation here: task input is valid and callback is callable
@@ -93,23 +175,16 @@ class CeleryTaskQueue:
         if task is not None:
             task_id = str(uuid.uuid4())
             result = task.apply_async(args=(task_params["_id"], task_params['query']), task_id=task_id)
-            job = (task_id, result, custom_callback)
-            self.job_queue.put(job)
+            self.__submit(result, custom_callback)
         else:
             raise ValueError(f"Task {task_name} is not supported")
-        with self.pending_tasks_lock:
-            self.pending_tasks[0] += 1
 
     def terminate(self):
-        already_printed = False
-        while self.pending_tasks[0] > 0:
-            time.sleep(1)
-            if not already_printed:
+        with self.__tasks_done:
+            if self.pending_tasks[0] > 0:
                 print("Terminating Celery Queue ...")
                 print("Waiting for pending tasks to complete ...")
-                already_printed = True
-        self.job_queue.put("STOP")
-        self.job_checker_thread.join()
+            self.__tasks_done.wait_for(lambda: self.pending_tasks[0] <= 0)
 
 
 # adding a main
@@ -6,20 +6,30 @@
 #  the file LICENSE, distributed as part of this software.
 #-----------------------------------------------------------------------------
 
+import asyncio
+import copy
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
 import redis
 import uuid
 import datetime
 import requests
 import json
-from ws4py.client import WebSocketBaseClient
-from ws4py.manager import WebSocketManager
-from ws4py import format_addresses
 from foresight.config import config as conf, prod_type
+from foresight.utils.sage_websocket import connect_websocket
 
 import logging
 logger = logging.getLogger(__name__)
 
-# TODO : CONVERT JupyterKernelProxy INTO singleton (use BORG)
+# redis key of the kernels known to SAGE3 (alias, owner, room...)
+KERNELS_KEY = "JUPYTER:KERNELS"
+
+
 def format_execute_request_msg(exec_uuid, code, msg_type='execute_request'):
     content = {'code': code, 'silent': False}
     hdr = {'msg_id': uuid.UUID(exec_uuid).hex,
@@ -35,110 +45,728 @@ def format_execute_request_msg(exec_uuid, code, msg_type='execute_request'):
     return msg
 
 
-class TestiongJupyterClient(WebSocketBaseClient):
-    def __init__(self, address, headers):
-        super().__init__(address, headers=headers)
+class KernelMultiplexer:
+    """
+    One asyncio event loop, on a daemon thread, running the websockets of all the
+    kernels of the process, and a pool of threads running the callbacks.
 
-    def handshake_ok(self):
-        print("Testing: done opening the connection to the Jupyter Kernel client")
+    The callbacks (e.g. SageCell.handle_exec_result) block on HTTP requests, so they never
+    run on the loop: the outputs of each execution are queued and handed to its callback
+    one at a time, in order, on the callback threads. The queue of an execution holds
+    max_buffered outputs at most; once full, the channel of that kernel stops reading
+    until the callback catches up, the other kernels aren't affected.
+    """
+    _shared_state = {}
 
-    def received_message(self, msg):
-        # check if the message
-        msg = json.loads(msg.data.decode("utf-8"))
-        print(f"Testing: received msg {msg}")
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if "loop" not in self.__dict__:
+            self.callback_workers = int(os.getenv("JUPYTER_CALLBACK_WORKERS", 4))
+            self.max_buffered = int(os.getenv("JUPYTER_MAX_BUFFERED", 100))
+            self.executor = ThreadPoolExecutor(max_workers=self.callback_workers,
+                                               thread_name_prefix="jupyter-callbacks")
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="jupyter-kernels", daemon=True)
+            self.thread.start()
+
+    def submit(self, coro):
+        """
+        Runs coro on the loop, from any other thread
+        :return: concurrent.futures.Future of its result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
 
-class JupyterKernelProxy:
-    class JupyterClient(WebSocketBaseClient):
-        def __init__(self, address, headers, parent_proxy_instnace):
-            self.pending_reponses = {}
-            self.parent_proxy_instance = parent_proxy_instnace
-            super().__init__(address, headers=headers)
-
-        def handshake_ok(self):
-            logger.debug("Opening %s" % format_addresses(self))
-            self.parent_proxy_instance.conn_manager.add(self)
-
-        def received_message(self, msg):
-            # check if the message
-            # print(f"processing a message {msg}")
-            msg = json.loads(msg.data.decode("utf-8"))
-            msg_id_uuid = str(uuid.UUID(msg["parent_header"]["msg_id"].split("_")[0]))
-            result = {}
 
-            # print(f"received {msg}")
-            if msg["channel"] != "iopub":
-                return
+def _reset_after_fork():
+    # the loop thread and the connections of the parent don't exist in a forked child
+    KernelMultiplexer._shared_state.clear()
+    KernelConnectionPool._shared_state.clear()
+
 
-            if msg_id_uuid in self.pending_reponses:
-                # I am done
-                if msg['header']['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
-                    # ready to send the result back
-                    if self.pending_reponses[msg_id_uuid] is None:
-                        result = {'request_id': msg_id_uuid, 'execute_result': {}}
-                        self.parent_proxy_instance.callback_info[msg_id_uuid](result)
-
-                    del(self.pending_reponses[msg_id_uuid])
-                    result = {}
-
-                if msg['msg_type'] in ['execute_result', 'display_data', "error", "stream"]:
-                    result = {"request_id": msg["parent_header"]["msg_id"], msg['msg_type']: msg['content']}
-                elif msg['msg_type'] in ["execute_reply"]:
-                    if msg['content']["status"] == "error":
-                        result = {"request_id": msg["parent_header"]["msg_id"], "error": msg['content']['traceback']}
-                    else:
-                        result = {"request_id": msg["parent_header"]["msg_id"], msg['msg_type']: msg['content']}
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
+
+class Execution:
+    """
+    Outputs of one execute request waiting for its callback
+    """
+    # queued after the last output of the execution
+    DONE = object()
+
+    def __init__(self, request_id, callback_fn, multiplexer, end_fn=None, position_fn=None):
+        """
+        :param end_fn: called without arguments after the last output, if any
+        :param position_fn: called with the position of the execution in the queue of the
+        kernel when it changes, 0 once sent to the kernel, if any
+        """
+        self.request_id = request_id
+        self.callback_fn = callback_fn
+        self.end_fn = end_fn
+        self.position_fn = position_fn
+        self.position = None
+        self.multiplexer = multiplexer
+        self.queue = asyncio.Queue(maxsize=multiplexer.max_buffered)
+        self.task = multiplexer.loop.create_task(self.__dispatch())
+
+    async def put(self, result):
+        await self.queue.put(result)
+
+    async def set_position(self, position):
+        if position == self.position:
+            return
+        self.position = position
+        if self.position_fn is not None:
+            # queued with the outputs so the callbacks see them in order
+            await self.queue.put(position)
+
+    async def __dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            result = await self.queue.get()
+            if result is self.DONE:
+                break
+            if isinstance(result, int):
+                await loop.run_in_executor(self.multiplexer.executor, self.__call_safely, self.position_fn, result)
+                continue
+            await loop.run_in_executor(self.multiplexer.executor, self.__call_safely, self.callback_fn, result)
+        if self.end_fn is not None:
+            await loop.run_in_executor(self.multiplexer.executor, self.__call_safely, self.end_fn)
+
+    def __call_safely(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Error handling the output of execution {self.request_id}. \n{e}")
+
+
+class KernelScheduler:
+    """
+    Order in which the executions sent to a kernel are run, one at a time: each user has
+    a queue of executions, run in order, and the users take turns. The user who had the
+    fewest turns goes next, a user starting to queue executions is given as many turns
+    as the one who went last, so a user can't save up turns by waiting.
+
+    Keeps the time the executions waited in the queue and ran on the kernel.
+    """
+
+    def __init__(self):
+        # user -> request_ids waiting, the users who queued first first
+        self.queues = OrderedDict()
+        # user -> number of turns taken, and those of the user who went last
+        self.turns = {}
+        self.turn = 0
+        self.enqueued_at = {}
+        self.running = None
+        self.started_at = None
+        self.metrics = {
+            # sent to the kernel, and done
+            "dispatched": 0,
+            "executions": 0,
+            "cancelled": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "run_time": 0.0,
+            "max_run_time": 0.0,
+        }
+
+    def push(self, request_id, user):
+        if user not in self.queues:
+            self.queues[user] = deque()
+            self.turns[user] = max(self.turns.get(user, 0), self.turn)
+        self.queues[user].append(request_id)
+        self.enqueued_at[request_id] = time.time()
+
+    def __next_user(self, turns):
+        return min(self.queues, key=lambda user: turns[user])
+
+    def next(self):
+        """
+        :return: request_id of the execution to run now, None if one is running or none waits
+        """
+        if self.running is not None or not self.queues:
+            return None
+        user = self.__next_user(self.turns)
+        request_id = self.queues[user].popleft()
+        if not self.queues[user]:
+            del self.queues[user]
+        self.turn = self.turns[user]
+        self.turns[user] += 1
+        self.__prune_turns()
+        self.running = request_id
+        self.started_at = time.time()
+        self.metrics["dispatched"] += 1
+        wait_time = self.started_at - self.enqueued_at.pop(request_id)
+        self.metrics["wait_time"] += wait_time
+        self.metrics["max_wait_time"] = max(self.metrics["max_wait_time"], wait_time)
+        return request_id
+
+    def is_waiting(self, request_id):
+        return request_id in self.enqueued_at
+
+    def remove(self, request_id):
+        """
+        Removes the execution once done, or cancelled
+        :return: True if it was waiting, False if running or unknown
+        """
+        if request_id == self.running:
+            run_time = time.time() - self.started_at
+            self.metrics["executions"] += 1
+            self.metrics["run_time"] += run_time
+            self.metrics["max_run_time"] = max(self.metrics["max_run_time"], run_time)
+            self.running = None
+            return False
+        if request_id not in self.enqueued_at:
+            return False
+        del self.enqueued_at[request_id]
+        for user, queue in list(self.queues.items()):
+            if request_id in queue:
+                queue.remove(request_id)
+                if not queue:
+                    del self.queues[user]
+                    self.__prune_turns()
+                break
+        return True
+
+    def __prune_turns(self):
+        # the users with nothing queued are given self.turn when they queue again, unless
+        # they had more turns
+        for user in [user for user, turns in self.turns.items() if user not in self.queues and turns <= self.turn]:
+            del self.turns[user]
+
+    def positions(self):
+        """
+        :return: request_id -> position of the executions waiting, 1 for the next to run
+        """
+        positions = {}
+        queues = {user: deque(queue) for user, queue in self.queues.items()}
+        turns = {user: self.turns[user] for user in queues}
+        while queues:
+            # min keeps the first user queued on ties, as __next_user
+            user = min(queues, key=lambda user: turns[user])
+            positions[queues[user].popleft()] = len(positions) + 1
+            turns[user] += 1
+            if not queues[user]:
+                del queues[user]
+        return positions
+
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        metrics["waiting"] = len(self.enqueued_at)
+        metrics["running"] = self.running is not None
+        if metrics["dispatched"]:
+            metrics["avg_wait_time"] = metrics["wait_time"] / metrics["dispatched"]
+        if metrics["executions"]:
+            metrics["avg_run_time"] = metrics["run_time"] / metrics["executions"]
+        return metrics
+
+
+class KernelChannel:
+    """
+    Websocket to the channels of a kernel, run by the KernelMultiplexer and shared by
+    all the proxies executing code on that kernel (see KernelConnectionPool). The outputs
+    are routed to the execution they belong to by the msg_id of their parent header.
+
+    The executions are sent to the kernel one at a time, in the order of the
+    KernelScheduler, the others wait in the channel where they can still be cancelled.
+
+    Reconnects with a backoff whenever the connection drops, the executions running or
+    waiting are lost then. The execution running is ended with an error when the kernel
+    restarts or dies, and after run_timeout seconds without its idle status
+    (JUPYTER_RUN_TIMEOUT env. variable, 3600 by default, 0 to wait forever), so the
+    executions queued behind it still run.
+    """
+
+    def __init__(self, address, headers, multiplexer, backoff=0.5, max_backoff=30, run_timeout=None):
+        if run_timeout is None:
+            run_timeout = float(os.getenv("JUPYTER_RUN_TIMEOUT", 3600))
+        self.address = address
+        self.headers = headers
+        self.multiplexer = multiplexer
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.run_timeout = run_timeout
+        # request_id -> last result sent to the callback, None if nothing was
+        self.pending_reponses = {}
+        # request_id -> Execution
+        self.executions = {}
+        self.scheduler = KernelScheduler()
+        # request_id -> execute request of the executions waiting
+        self.requests = {}
+        self.ws = None
+        self.closed = False
+        self.__connected = None
+        self.__task = None
+        # ends the execution running after run_timeout
+        self.__watchdog = None
+
+    def connect(self):
+        self.__task = self.multiplexer.submit(self.__connect_forever())
+
+    async def __connect_forever(self):
+        delay = self.backoff
+        while not self.closed:
+            try:
+                async with connect_websocket(self.address, self.headers) as ws:
+                    self.ws = ws
+                    delay = self.backoff
+                    logger.debug(f"Opening {self.address}")
+                    self.__connected_event().set()
+                    async for message in ws:
+                        await self.received_message(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self.closed:
+                    logger.error(f"error in the connection to the kernel at {self.address}. \n{e}")
+            finally:
+                self.__connected_event().clear()
+                self.ws = None
+            if self.closed:
+                break
+            await self.__abort_executions("the connection to the kernel was lost")
+            wait = delay * (0.5 + random.random() / 2)
+            logger.warning(f"kernel websocket disconnected, reconnecting in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.max_backoff)
+
+    def __connected_event(self):
+        # created on the loop, asyncio.Event is bound to it before python 3.10
+        if self.__connected is None:
+            self.__connected = asyncio.Event()
+        return self.__connected
+
+    async def send(self, request_id, msg, callback_fn, end_fn=None, user=None, position_fn=None):
+        """
+        Queues an execute request, sent once its turn comes. Its outputs are handed to
+        callback_fn, then end_fn is called once the kernel is done with it
+        :param user: the executions of a user run in order, the users take turns
+        """
+        execution = Execution(request_id, callback_fn, self.multiplexer, end_fn, position_fn)
+        self.executions[request_id] = execution
+        self.pending_reponses[request_id] = None
+        self.requests[request_id] = msg
+        self.scheduler.push(request_id, user)
+        await self.__schedule()
+
+    async def cancel(self, request_id):
+        """
+        Cancels an execution not sent to the kernel yet
+        :return: True if it was
+        """
+        if not self.scheduler.is_waiting(request_id):
+            return False
+        self.scheduler.remove(request_id)
+        self.scheduler.metrics["cancelled"] += 1
+        await self.__finish(request_id)
+        return True
+
+    def get_metrics(self):
+        return self.scheduler.get_metrics()
+
+    async def __schedule(self):
+        # sends the next execution if the kernel is free, and tells the others their position
+        if self.closed:
+            return
+        request_id = self.scheduler.next()
+        if request_id is not None:
+            loop = asyncio.get_running_loop()
+            loop.create_task(self.__send_request(request_id, self.requests.pop(request_id)))
+            if self.run_timeout > 0:
+                self.__watchdog = loop.create_task(self.__watch(request_id))
+            await self.executions[request_id].set_position(0)
+        for request_id, position in self.scheduler.positions().items():
+            await self.executions[request_id].set_position(position)
+
+    async def __send_request(self, request_id, msg, timeout=10):
+        try:
+            await asyncio.wait_for(self.__connected_event().wait(), timeout)
+            if self.scheduler.running != request_id:
+                # aborted meanwhile
+                return
+            await self.ws.send(json.dumps(msg))
+        except Exception as e:
+            logger.error(f"Error occurred duirng execution of command, {e}")
+            await self.__finish(request_id, {"request_id": request_id, "error": [repr(e)]})
+
+    async def __watch(self, request_id):
+        await asyncio.sleep(self.run_timeout)
+        if self.scheduler.running != request_id:
+            return
+        # done with the watchdog, not cancelled by __finish
+        self.__watchdog = None
+        logger.error(f"execution {request_id} got no idle status after {self.run_timeout}s, ending it")
+        await self.__finish(request_id, {"request_id": request_id,
+                                         "error": [f"no reply from the kernel after {self.run_timeout}s"]})
+
+    async def received_message(self, msg):
+        msg = json.loads(msg)
+        if msg.get("channel") != "iopub":
+            return
+        if msg["header"]["msg_type"] == "status" and \
+                msg["content"]["execution_state"] in ("restarting", "dead", "starting"):
+            # the execution running won't get its idle status
+            request_id = self.scheduler.running
+            if request_id is not None:
+                state = msg["content"]["execution_state"]
+                logger.warning(f"kernel at {self.address} is {state}, ending execution {request_id}")
+                await self.__finish(request_id, {"request_id": request_id, "error": [f"the kernel is {state}"]})
+            return
+        if "msg_id" not in msg.get("parent_header", {}):
+            return
+        try:
+            msg_id_uuid = str(uuid.UUID(msg["parent_header"]["msg_id"].split("_")[0]))
+        except ValueError:
+            # not one of ours
+            return
+        if msg_id_uuid not in self.pending_reponses:
+            return
+
+        result = {}
+        # I am done
+        if msg['header']['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+            # ready to send the result back
+            if self.pending_reponses[msg_id_uuid] is None:
+                result = {'request_id': msg_id_uuid, 'execute_result': {}}
+            await self.__finish(msg_id_uuid, result)
+            return
+
+        if msg['msg_type'] in ['execute_result', 'display_data', "error", "stream"]:
+            result = {"request_id": msg["parent_header"]["msg_id"], msg['msg_type']: msg['content']}
+        elif msg['msg_type'] in ["execute_reply"]:
+            if msg['content']["status"] == "error":
+                result = {"request_id": msg["parent_header"]["msg_id"], "error": msg['content']['traceback']}
+            else:
+                result = {"request_id": msg["parent_header"]["msg_id"], msg['msg_type']: msg['content']}
+
+        execution = self.executions.get(msg_id_uuid)
+        if result and execution is not None:
+            logger.debug(f"jupyter kernel result is {result}")
+            self.pending_reponses[msg_id_uuid] = result
+            # waits here while the execution has max_buffered outputs queued
+            await execution.put(result)
+
+    async def __finish(self, request_id, result=None):
+        running = request_id == self.scheduler.running
+        if running and self.__watchdog is not None:
+            self.__watchdog.cancel()
+            self.__watchdog = None
+        execution = self.executions.pop(request_id, None)
+        self.pending_reponses.pop(request_id, None)
+        self.requests.pop(request_id, None)
+        self.scheduler.remove(request_id)
+        if execution is not None:
             if result:
-                logger.debug(f"jupyter kernel result is {result}")
-                self.pending_reponses[msg_id_uuid] = result
-                self.parent_proxy_instance.callback_info[msg_id_uuid](result)
+                await execution.put(result)
+            await execution.put(Execution.DONE)
+        elif not running:
+            return
+        await self.__schedule()
+
+    async def __abort_executions(self, reason):
+        request_ids = list(self.executions)
+        if self.scheduler.running is not None and self.scheduler.running not in self.executions:
+            # discarded while running
+            request_ids.append(self.scheduler.running)
+        for request_id in request_ids:
+            await self.__finish(request_id, {"request_id": request_id, "error": [reason]})
+
+    async def discard(self, request_ids):
+        """
+        Stops handing the outputs of these executions to their callbacks. The one running
+        keeps the kernel until its idle status, so the next one isn't sent meanwhile
+        """
+        for request_id in request_ids:
+            execution = self.executions.pop(request_id, None)
+            if execution is not None:
+                execution.task.cancel()
+            if request_id == self.scheduler.running:
+                continue
+            self.pending_reponses.pop(request_id, None)
+            self.requests.pop(request_id, None)
+            self.scheduler.remove(request_id)
+        await self.__schedule()
+
+    async def __close(self):
+        self.closed = True
+        if self.ws is not None:
+            await self.ws.close()
+        executions = list(self.executions.values())
+        await self.__abort_executions("the connection to the kernel was closed")
+        # lets the callbacks queued already run
+        await asyncio.gather(*[execution.task for execution in executions], return_exceptions=True)
+
+    def close(self, timeout=5):
+        try:
+            self.multiplexer.submit(self.__close()).result(timeout=timeout)
+            if self.__task is not None:
+                self.__task.result(timeout=timeout)
+        except Exception as e:
+            logger.debug(f"kernel websocket closed with {e}")
+            if self.__task is not None:
+                self.__task.cancel()
+
+
+class KernelCatalog:
+    """
+    Kernels running on the Jupyter server and their entries in the JUPYTER:KERNELS redis
+    key, cached for ttl seconds (JUPYTER_KERNELS_TTL env. variable, 5 by default).
 
+    Only one refresh runs at a time: the callers asking while it runs wait for its result
+    instead of fetching too. The cache is invalidated when JUPYTER:KERNELS is modified,
+    through redis keyspace notifications, and by invalidate() for the changes made on the
+    Jupyter server only (kernel started, restarted...).
+
+    The notifications needed (notify-keyspace-events Kg$d) are only enabled on the redis
+    server with configure_notifications (JUPYTER_KERNELS_CONFIGURE_NOTIFICATIONS env.
+    variable). Without them, the catalog is only refreshed after ttl and by invalidate().
+    """
+
+    def __init__(self, fetch_fn, ttl=None, redis_server=None, key=None, configure_notifications=None):
+        """
+        :param fetch_fn: returns the catalog, called on refresh
+        :param redis_server: notifies the modifications of key, if given
+        :param configure_notifications: enables the keyspace notifications on redis_server
+        if they are not
+        """
+        if ttl is None:
+            ttl = float(os.getenv("JUPYTER_KERNELS_TTL", 5))
+        if configure_notifications is None:
+            configure_notifications = bool(os.getenv("JUPYTER_KERNELS_CONFIGURE_NOTIFICATIONS"))
+        self.fetch_fn = fetch_fn
+        self.ttl = ttl
+        self.redis_server = redis_server
+        self.key = key
+        self.configure_notifications = configure_notifications
+        self.nb_fetches = 0
+
+        self.__value = None
+        self.__fetched_at = None
+        # incremented on invalidation, a refresh started before is outdated
+        self.__generation = 0
+        self.__refreshing = False
+        self.__lock = threading.Lock()
+        self.__changed = threading.Condition(self.__lock)
+        self.__listener = None
+        self.__listener_lock = threading.Lock()
+
+    def get(self):
+        if self.__listener is None and self.redis_server is not None:
+            self.__start_listener()
+        with self.__changed:
+            while True:
+                if self.__fetched_at is not None and time.time() - self.__fetched_at < self.ttl:
+                    return self.__value
+                if not self.__refreshing:
+                    break
+                self.__changed.wait()
+            self.__refreshing = True
+            generation = self.__generation
+        try:
+            value = self.fetch_fn()
+        except Exception:
+            with self.__changed:
+                self.__refreshing = False
+                self.__changed.notify_all()
+            raise
+        with self.__changed:
+            self.nb_fetches += 1
+            self.__value = value
+            # handed to the callers waiting, but refreshed by the next one if invalidated meanwhile
+            self.__fetched_at = time.time() if generation == self.__generation else None
+            self.__refreshing = False
+            self.__changed.notify_all()
+        return value
+
+    def invalidate(self):
+        with self.__lock:
+            self.__generation += 1
+            self.__fetched_at = None
+
+    def __start_listener(self):
+        # outside of the cache lock, the callers don't wait for redis. Those coming while
+        # another one starts the listener rely on the ttl meanwhile
+        if not self.__listener_lock.acquire(blocking=False):
+            return
+        try:
+            if self.__listener is None:
+                self.__listen()
+        finally:
+            self.__listener_lock.release()
+
+    def __listen(self):
+        db = self.redis_server.connection_pool.connection_kwargs.get("db", 0)
+        try:
+            flags = self.redis_server.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+            # K: keyspace channel, g$: del/set, d: module commands such as JSON.SET. A is
+            # an alias for the events (g$d included), not for the channel
+            enabled = flags + ("g$d" if "A" in flags else "")
+            missing = "".join(flag for flag in "Kg$d" if flag not in enabled)
+            if missing and not self.configure_notifications:
+                logger.warning(f"notify-keyspace-events lacks {missing}, {self.key} cached for {self.ttl}s. "
+                               f"Set JUPYTER_KERNELS_CONFIGURE_NOTIFICATIONS to enable them")
+                # not tried again
+                self.__listener = False
+                return
+            if missing:
+                self.redis_server.config_set("notify-keyspace-events", flags + missing)
+            pubsub = self.redis_server.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{f"__keyspace@{db}__:{self.key}": lambda _: self.invalidate()})
+            self.__listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            logger.warning(f"Couldn't listen to the modifications of {self.key}, cached for {self.ttl}s. \n{e}")
+            # not tried again
+            self.__listener = False
+
+
+class KernelConnectionPool:
+    """
+    Connections to the Jupyter server shared by all the JupyterKernelProxy of the process:
+    one redis client, the token read once, and one KernelChannel per kernel, opened by
+    the first proxy executing code on the kernel and closed once the last one using it
+    is cleaned up.
+    """
+    _shared_state = {}
 
     def __init__(self):
+        self.__dict__ = self._shared_state
+        if "channels" not in self.__dict__:
+            self.lock = threading.Lock()
+            self.multiplexer = KernelMultiplexer()
+            self.redis_server = redis.StrictRedis(host=conf[prod_type]["redis_server"], port=6379, db=0)
+            self.jupyter_token = None
+            # kernel url -> [KernelChannel, number of proxies using it]
+            self.channels = {}
+            self.catalog = KernelCatalog(self.fetch_kernels, redis_server=self.redis_server, key=KERNELS_KEY)
+
+    @property
+    def token(self):
+        if self.jupyter_token is None:
+            self.jupyter_token = self.redis_server.get('config:jupyter:token').decode()
+        return self.jupyter_token
+
+    def fetch_kernels(self):
+        """
+        :return: the kernels of the Jupyter server, and their entries of JUPYTER:KERNELS,
+        from which those of the kernels gone are removed
+        """
+        response = requests.get(conf[prod_type]["jupyter_server"] + "/api/kernels",
+                                headers={"Authorization": f"Token {self.token}"})
+        kernels = response.json()
+        kernels_ids = {k["id"] for k in kernels}
+        registry = self.redis_server.json().get(KERNELS_KEY) or {}
+        for kernel_id in set(registry) - kernels_ids:
+            self.redis_server.json().delete(KERNELS_KEY, kernel_id)
+            del registry[kernel_id]
+        return kernels, registry
+
+    def acquire(self, url, headers):
+        """
+        :param url: url of the channels of the kernel, without session
+        :return: the KernelChannel of the kernel, connected or connecting
+        """
+        with self.lock:
+            if url in self.channels:
+                entry = self.channels[url]
+                entry[1] += 1
+                return entry[0]
+            channel = KernelChannel(f"{url}?session_id={uuid.uuid4().hex}", headers, self.multiplexer)
+            self.channels[url] = [channel, 1]
+        channel.connect()
+        return channel
+
+    def release(self, url, request_ids=()):
+        """
+        Closes the channel if nobody else uses it, otherwise only drops the executions
+        of the proxy releasing it
+        """
+        with self.lock:
+            entry = self.channels.get(url)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.channels[url]
+        if entry[1] <= 0:
+            entry[0].close()
+        elif request_ids:
+            self.multiplexer.submit(entry[0].discard(list(request_ids)))
+
+
+class JupyterKernelProxy:
+    """
+    Handle on the KernelConnectionPool: as many can be created as needed, by each SageCell
+    for instance, they share the connections to the kernels.
+    """
+
+    def __init__(self, token=None, base_ws=None):
+        """
+        :param token: token of the Jupyter server, read from redis by default
+        :param base_ws: websocket url of the Jupyter server, jupyter_ws of the config by default
+        """
+        self.pool = KernelConnectionPool()
+        # kernel_id -> KernelChannel used by this proxy
         self.connections = {}
-        self.redis_server = redis.StrictRedis(host=conf[prod_type]["redis_server"], port=6379, db=0)
+        self.redis_server = self.pool.redis_server
 
-        self.base_ws = conf[prod_type]['jupyter_ws']
-        self.token = self.redis_server.get('config:jupyter:token').decode()
+        self.base_ws = base_ws if base_ws is not None else conf[prod_type]['jupyter_ws']
+        self.token = token if token is not None else self.pool.token
         self.headers = [('Authorization', f"Token {self.token}")]
-        self.conn_manager = WebSocketManager()
-        self.conn_manager.start()
+        self.multiplexer = self.pool.multiplexer
+        # request_id -> callback of the executions running
         self.callback_info = {}
         self.results = {}
+        self.__lock = threading.Lock()
 
-    def add_client(self, kernel_id):
-        # do we need the test below or are we testing for it aready in the execute and interrupt?
-        if kernel_id not in self.connections or self.connections[kernel_id].stream is None:
-            socket_url = f"{self.base_ws}/api/kernels/{kernel_id}/channels"
-            session_id = uuid.uuid4().hex
-            socket_url = f"{socket_url}?session_id={session_id}"
+    def __kernel_url(self, kernel_id):
+        return f"{self.base_ws}/api/kernels/{kernel_id}/channels"
 
-            self.connections[kernel_id] = self.JupyterClient(socket_url,
-                                                             headers=self.headers,
-                                                             parent_proxy_instnace=self)
-            self.connections[kernel_id].connect()
+    def add_client(self, kernel_id):
+        with self.__lock:
+            if kernel_id not in self.connections:
+                self.connections[kernel_id] = self.pool.acquire(self.__kernel_url(kernel_id), self.headers)
 
     def execute(self, command_info):
+        """
+        Non blocking, the outputs are handed to command_info["call_fn"] on a callback thread,
+        then command_info["end_fn"], if given, is called once the execution is over.
+
+        The executions wait for their turn on the kernel, see KernelScheduler. Those of
+        command_info["user"] run in order, taking turns with those of the other users, and
+        command_info["position_fn"], if given, is called with their position in the queue
+        """
         user_passed_uuid = command_info["uuid"]
         msg = format_execute_request_msg(user_passed_uuid, command_info["code"])
         kernel_id = command_info['kernel']
         callback_fn = command_info["call_fn"]
+        end_fn = command_info.get("end_fn")
 
-        if kernel_id not in self.connections or self.connections[kernel_id].stream is None:
-            self.add_client(kernel_id)
+        def end():
+            self.callback_info.pop(user_passed_uuid, None)
+            if end_fn is not None:
+                end_fn()
 
-        try:
-            self.connections[kernel_id].pending_reponses[user_passed_uuid] = None
-            self.callback_info[user_passed_uuid] = callback_fn
-            self.connections[kernel_id].send(json.dumps(msg), binary=False)
-        except Exception as e:
-            # something happen, do not track this results
-            logger.error(f"Error occurred duirng execution of command, {e}")
-            del self.results[user_passed_uuid]
-            # TODO something happened and code couldn't be run
-            #  send error back to the user
-            del self.callback_info[user_passed_uuid]
+        self.add_client(kernel_id)
+        self.callback_info[user_passed_uuid] = callback_fn
+        self.multiplexer.submit(self.connections[kernel_id].send(user_passed_uuid, msg, callback_fn, end,
+                                                                 command_info.get("user"),
+                                                                 command_info.get("position_fn")))
+
+    def cancel(self, command_info, timeout=5):
+        """
+        Cancels the execution command_info["uuid"] if it is still waiting for its turn
+        :return: True if it was cancelled, False if it was sent to the kernel already
+        """
+        channel = self.connections.get(command_info['kernel'])
+        if channel is None:
+            return False
+        return self.multiplexer.submit(channel.cancel(command_info["uuid"])).result(timeout=timeout)
 
+    def get_metrics(self):
+        """
+        :return: kernel_id -> executions waiting, wait and run times on the kernel
+        """
+        return {kernel_id: channel.get_metrics() for kernel_id, channel in self.connections.items()}
 
     def interrupt(self, command_info):
         """
@@ -152,21 +780,25 @@ class JupyterKernelProxy:
             if response.status_code != 204:
                 logger.error("Couldn't interrupt running job. code was")
 
+    def get_kernels(self):
+        """
+        :return: the kernels of the Jupyter server, see KernelCatalog
+        """
+        kernels, _ = self.pool.catalog.get()
+        return copy.deepcopy(kernels)
 
+    def get_available_kernels(self):
+        """
+        :return: kernel_id -> entry of JUPYTER:KERNELS, for the kernels running
+        """
+        _, registry = self.pool.catalog.get()
+        return copy.deepcopy(registry)
 
-    def remove_stale_tokens(self, gateway_kernels):
-        kernels_ids = [k["id"] for k in gateway_kernels]
-        redis_kernels = set(self.redis_server.json().get('JUPYTER:KERNELS').keys())
-        redis_kernels_to_remove = redis_kernels - set(kernels_ids)
-        for k in redis_kernels_to_remove:
-            self.redis_server.json().delete('JUPYTER:KERNELS', k)
-
-    def get_kernels(self):
-        headers_dict = dict(self.headers)
-        response = requests.get(conf[prod_type]["jupyter_server"] + "/api/kernels", headers=headers_dict)
-        kernels = response.json()
-        self.remove_stale_tokens(kernels)
-        return kernels
+    def invalidate_kernels(self):
+        """
+        To be called after starting, restarting or shutting down a kernel
+        """
+        self.pool.catalog.invalidate()
 
 
     def get_room_kernel_id(self):
@@ -183,8 +815,12 @@ class JupyterKernelProxy:
             raise Exception("couldn't communicate with the Jupyter Kernel Gateway.")
 
     def clean_up(self):
-        pass
-        self.conn_manager.close_all()
-        self.conn_manager.stop()
-        self.conn_manager.join()
-
+        """
+        Releases the kernels used by this proxy. Its executions still running are dropped,
+        those of the other proxies on the same kernels aren't affected
+        """
+        with self.__lock:
+            connections, self.connections = self.connections, {}
+            request_ids, self.callback_info = list(self.callback_info), {}
+        for kernel_id in connections:
+            self.pool.release(self.__kernel_url(kernel_id), request_ids)
@@ -17,16 +17,20 @@
 
 import time
 import os
+import socket
+import threading
+from functools import partial
 from typing import Callable
 from pydantic import BaseModel
-import json
 import logging
 from foresight.board import Board
 from foresight.room import Room
-from foresight.smartbitfactory import SmartBitFactory
+from foresight.smartbitfactory import LazySmartBit
 from foresight.utils.sage_communication import SageCommunication
 from foresight.smartbits.genericsmartbit import GenericSmartBit
 from foresight.utils.sage_websocket import SageWebsocket
+from foresight.utils.message_decoder import MessageDecoder
+from foresight.action_executor import ActionExecutor
 
 from foresight.config import config as conf, prod_type
 
@@ -72,10 +76,21 @@ def update_dest_from_src(src_val, dest_app, dest_field):
 
 class SAGEProxy:
 
-    def __init__(self, conf, prod_type):
+    def __init__(self, conf, prod_type, max_workers=None, room_id=None, board_id=None, room_ids=None):
+        """
+        :param room_id: only serve this room (its boards and apps) instead of all of them
+        :param board_id: only serve this board (and its apps)
+        :param room_ids: only serve these rooms. Rooms can then be added and removed with
+        add_room and remove_room, see ProxySupervisor
+        """
         self.done_init = False
         self.conf = conf
         self.prod_type = prod_type
+        if room_ids is None and room_id is not None:
+            room_ids = [room_id]
+        # None serves all the rooms
+        self.room_ids = set(room_ids) if room_ids is not None else None
+        self.board_id = board_id
         self.__headers = {'Authorization': f"Bearer {os.getenv('TOKEN')}"}
         self.__MSG_METHODS = {
             "CREATE": self.__handle_create,
@@ -87,9 +102,27 @@ class SAGEProxy:
         self.received_msg_log = {}
 
         self.rooms = {}
+        # rooms whose boards and apps are all loaded. Events for rooms still loading
+        # are kept in pending_events and replayed once the room is ready
+        self.loading = True
+        self.ready_rooms = set()
+        # rooms added with add_room whose tree is being loaded
+        self.loading_rooms = set()
+        self.pending_events = {}
+        self.__ready_lock = threading.Lock()
+        # flat app_id -> smartbit index kept in sync with the rooms/boards tree
+        # so updates can be dispatched without walking rooms and boards
+        self.smartbits = {}
+        # app_id -> _updatedAt of the last doc applied, to find the apps updated
+        # while the websocket was disconnected
+        self.updated_at = {}
+        # executeFunc actions and linked app callbacks run off the websocket thread,
+        # serialized per app/board
+        self.executor = ActionExecutor(max_workers=max_workers)
         self.s3_comm = SageCommunication(self.conf, self.prod_type)
-        self.socket = SageWebsocket(on_message_fn=self.process_messages)
-        self.socket.subscribe(['/api/apps', '/api/rooms', '/api/boards'])
+        self.decoder = MessageDecoder()
+        self.socket = SageWebsocket(on_message_fn=self.process_messages, on_reconnect_fn=self.resync)
+        self.socket.subscribe(self.subscription_routes())
 
         # Grab and load info already on the board
 
@@ -97,62 +130,125 @@ class SAGEProxy:
         self.done_init = True
 
     def populate_existing(self):
-        # Populate existing rooms
-        rooms_info = self.s3_comm.get_rooms()
-        # print(rooms_info)
-        for room_info in rooms_info:
-            self.__handle_create("ROOMS", room_info)
-
-        # Populate existing boards
-        boards_info = self.s3_comm.get_boards()
-        # print(boards_info)
-        for board_info in boards_info:
-            self.__handle_create("BOARDS", board_info)
-        # Populate existing apps
-        apps_info = self.s3_comm.get_apps()
-        # print(apps_info)
-        for app_info in apps_info:
-            self.__handle_create("APPS", app_info)
+        # rooms are fetched concurrently and their boards and apps are created while
+        # the rest is still streaming in. Each room is marked ready, and starts
+        # processing its events, as soon as its own tree is loaded
+        self.loading = True
+        for collection, doc in self.s3_comm.stream_existing(room_ids=self.room_ids, board_id=self.board_id):
+            if collection == "READY":
+                self.set_room_ready(doc)
+            else:
+                self.__handle_create(collection, doc)
+        # replay the events of rooms that were not part of the fetch (created while loading)
+        with self.__ready_lock:
+            self.loading = False
+            for room_id in list(self.pending_events.keys()):
+                self.__replay_pending(room_id)
+
+    def subscription_routes(self):
+        """
+        Routes subscribed to: the events of the board or room served, or of everything
+        """
+        if self.board_id is not None:
+            return [f"/api/subscription/boards/{self.board_id}"]
+        if self.room_ids is not None:
+            return [f"/api/subscription/rooms/{room_id}" for room_id in sorted(self.room_ids)]
+        return ['/api/apps', '/api/rooms', '/api/boards']
+
+    def add_room(self, room_id):
+        """
+        Starts serving room_id: subscribes to its events and loads its boards and apps.
+        Its events received meanwhile are replayed once it is loaded.
+        """
+        if self.room_ids is None or room_id in self.room_ids:
+            return
+        with self.__ready_lock:
+            self.room_ids.add(room_id)
+            self.loading_rooms.add(room_id)
+        self.socket.subscribe([f"/api/subscription/rooms/{room_id}"])
+        try:
+            for collection, doc in self.s3_comm.stream_existing(room_ids=[room_id]):
+                if collection != "READY":
+                    self.__handle_create(collection, doc)
+        finally:
+            self.set_room_ready(room_id)
+
+    def remove_room(self, room_id):
+        """
+        Stops serving room_id: unsubscribes from its events and cleans up its smartbits
+        """
+        if self.room_ids is None or room_id not in self.room_ids:
+            return
+        self.socket.unsubscribe([f"/api/subscription/rooms/{room_id}"])
+        with self.__ready_lock:
+            self.room_ids.discard(room_id)
+            self.ready_rooms.discard(room_id)
+            self.pending_events.pop(room_id, None)
+            room = self.rooms.get(room_id)
+            if room is not None:
+                for board in room.boards.values():
+                    for _, sb in board.smartbits:
+                        sb.clean_up()
+                self.__handle_delete("ROOMS", {"_id": room_id})
+        logger.info(f"room {room_id} removed")
+
+    def is_room_ready(self, room_id):
+        if room_id in self.loading_rooms:
+            return False
+        return not self.loading or room_id in self.ready_rooms
+
+    def set_room_ready(self, room_id):
+        with self.__ready_lock:
+            self.ready_rooms.add(room_id)
+            self.__replay_pending(room_id)
+            # only once replayed, so newer events keep waiting for the lock meanwhile
+            self.loading_rooms.discard(room_id)
+        logger.info(f"room {room_id} is ready")
+
+    def __replay_pending(self, room_id):
+        # called with the lock held so replayed events can't be overtaken by newer ones
+        pending = self.pending_events.pop(room_id, [])
+        if pending:
+            logger.debug(f"replaying {len(pending)} events received while loading room {room_id}")
+        for event in pending:
+            self.__process_doc(event)
 
     def process_messages(self, ws, msg):
         logger.debug("received and processing a new message")
-        message = json.loads(msg)
-        # Duplicate messages for the time being to allow python to work
-        # event.doc is now an array of docs
-        for doc in message['event']['doc']:
-            msg = message.copy()
-            msg['event']['doc'] = doc
-            logger.debug(msg)
-        # End of duplicating messages so old code can work
-            collection = msg["event"]['col']
-            doc = msg['event']['doc']
-            msg_type = msg["event"]["type"]
-            app_id = doc["_id"]
-
-            # Its a create message
-            if msg_type == "CREATE":
-                self.__MSG_METHODS[msg_type](collection, doc)
-            # Its a delete message
-            elif msg_type == "DELETE":
-                self.__MSG_METHODS[msg_type](collection, doc)
-            # Its an update message
-            elif msg_type == "UPDATE":
-                # all updates for this message [{id: string, updates: {}}, {id:string, updates: {}}...]
-                all_updates = msg['event']['updates']
-                msg_updates = {}
-                # find the updates for this specific app
-                for u in all_updates:
-                    if u['id'] == app_id:
-                        msg_updates = u['updates']
-                        break
-                msg['event']['updates'] = msg_updates
-
-                if "updates" in msg['event'] and 'raised' in msg['event']['updates'] and msg['event']['updates']["raised"]:
-                    pass
-
-                if app_id in self.callbacks:
-                    self.handle_linked_app(app_id, msg)
-                self.__MSG_METHODS[msg_type](collection, doc, msg_updates)
+        # one DocEvent per doc of event.doc, sharing the decoded message
+        for event in self.decoder.decode(msg):
+            logger.debug(event)
+            if not self.loading and self.room_ids is None:
+                self.__process_doc(event)
+                continue
+            doc = event.doc
+            room_id = doc["_id"] if event.col == "ROOMS" else doc["data"].get("roomId")
+            with self.__ready_lock:
+                if self.room_ids is not None and room_id not in self.room_ids:
+                    # room removed, its events can arrive until the server handles the UNSUB
+                    continue
+                if self.is_room_ready(room_id):
+                    self.__process_doc(event)
+                else:
+                    self.pending_events.setdefault(room_id, []).append(event)
+
+    def __process_doc(self, event):
+        collection = event.col
+        doc = event.doc
+        msg_type = event.type
+        app_id = doc["_id"]
+
+        # Its a create message
+        if msg_type == "CREATE":
+            self.__MSG_METHODS[msg_type](collection, doc)
+        # Its a delete message
+        elif msg_type == "DELETE":
+            self.__MSG_METHODS[msg_type](collection, doc)
+        # Its an update message
+        elif msg_type == "UPDATE":
+            if app_id in self.callbacks:
+                self.handle_linked_app(app_id, event.updates)
+            self.__MSG_METHODS[msg_type](collection, doc, event.updates)
 
     def __handle_create(self, collection, doc):
         # we need state to be at the same level as data
@@ -166,12 +262,18 @@ class SAGEProxy:
         elif collection == "APPS":
             doc["state"] = doc["data"]["state"]
             del (doc["data"]["state"])
-            smartbit = SmartBitFactory.create_smartbit(doc)
+            # the smartbit class is only built when the app is used, see LazySmartBit
+            smartbit = LazySmartBit(doc)
+            self.updated_at[smartbit.app_id] = doc.get("_updatedAt")
             room_id = doc["data"]["roomId"]
             board_id = doc["data"]["boardId"]
             if room_id in self.rooms:
                 if board_id in self.rooms[room_id].boards:
                     self.rooms[room_id].boards[board_id].smartbits[smartbit.app_id] = smartbit
+                    self.smartbits[smartbit.app_id] = smartbit
+                    if smartbit.hydrate_eagerly:
+                        # off the websocket thread, before the actions of the app
+                        self.executor.submit(smartbit.app_id, smartbit.hydrate, name="hydrate", bounded=False)
 
     # Handle Update Messages
     def __handle_update(self, collection, doc, updates):
@@ -190,44 +292,61 @@ class SAGEProxy:
                 try:
                     board = self.rooms[room_id].boards[id]
                     _func = getattr(board, func_name)
-                    _params = updates["executeInfo"]["params"]
-
-                    logger.debug(
-                        f"About to execute board function --{func_name}-- with params --{_params}--")
-                    _func(**_params)
+                    _params = dict(updates["executeInfo"]["params"])
+                    self.executor.submit(id, _func, _params, name=func_name)
                 except Exception as e:
                     logger.error(
                         f"Exception trying to execute board function {func_name}. \n\t{e}")
 
         elif collection == "APPS":
-            board_id = doc['data']["boardId"]
-            room_id = doc['data']['roomId']
-            sb = self.rooms[room_id].boards[board_id].smartbits[id]
-            if type(sb) is GenericSmartBit:
+            sb = self.smartbits.get(id)
+            self.updated_at[id] = doc.get("_updatedAt")
+            if sb is not None and sb.is_generic:
 
                 logger.debug("not handling generic smartbit update")
                 logger.debug(f"\t\tmessage was {doc}")
                 return
-            if sb is not None:
-                # Note that set_data_form_update clear touched field
-                sb.refresh_data_form_update(doc, updates)
-
-                exec_info = getattr(sb.state, "executeInfo", None)
-
-                if exec_info is not None:
-                    func_name = getattr(exec_info, "executeFunc")
-                    if func_name != '':
-                        try:
-                            _func = getattr(sb, func_name)
-                            _params = getattr(exec_info, "params")
-                            # TODO: validate the params are valid
-                            _func(**_params)
-                        except Exception as e:
-                            logger.error(
-                                f"Exception trying to execute function `{func_name}` on sb `{sb}`. \n{e}")
-                else:
+            if sb is None:
+                return
+            if self.executor.queue_depth(id) > 0:
+                # an action of the app is queued or running: the update is applied once it
+                # is done, as when actions ran inline, so it neither sees the executeFunc the
+                # action is about to clear nor restores it
+                self.executor.submit(id, self.__apply_app_update, {"sb": sb, "doc": doc, "updates": updates},
+                                     name="update", bounded=False)
+            else:
+                self.__apply_app_update(sb, doc, updates)
+
+    def __apply_app_update(self, sb, doc, updates):
+        id = doc["_id"]
+        # Note that set_data_form_update clear touched field
+        sb.refresh_data_form_update(doc, updates)
+        # apps stay as raw docs until an action targets them
+        if not sb.has_pending_action():
+            return
+        sb = sb.hydrate()
+        if sb is None or type(sb) is GenericSmartBit:
+            logger.error(f"Couldn't create smartbit {id} to run its action")
+            return
+
+        exec_info = getattr(sb.state, "executeInfo", None)
+
+        if exec_info is not None:
+            func_name = getattr(exec_info, "executeFunc")
+            if func_name != '':
+                try:
+                    _func = getattr(sb, func_name)
+                    # copied since the next update can overwrite the params before
+                    # the action runs
+                    _params = dict(getattr(exec_info, "params"))
+                    # TODO: validate the params are valid
+                    self.executor.submit(id, _func, _params, name=func_name)
+                except Exception as e:
                     logger.error(
-                        "\n\n\nTried to update non existent smartbit\n\n\n")
+                        f"Exception trying to execute function `{func_name}` on sb `{sb}`. \n{e}")
+        else:
+            logger.error(
+                "\n\n\nTried to update non existent smartbit\n\n\n")
 
     # Handle Delete Messages
     def __handle_delete(self, collection, doc):
@@ -235,46 +354,101 @@ class SAGEProxy:
         logger.debug(f"Delete Event {collection} {_id}")
         if collection == "ROOMS":
             try:
+                for board in self.rooms[_id].boards.values():
+                    self.__unindex_board(board)
                 del self.rooms[_id]
             except:
                 logger.debug(f"Couldn't delete room_id: {_id}")
         elif collection == "BOARDS":
             room_id = doc['data']['roomId']
             try:
+                self.__unindex_board(self.rooms[room_id].boards[_id])
                 del self.rooms[room_id].boards[_id]
             except:
                 logger.debug(
-                    f"Couldn't delete board_id: {id}")
+                    f"Couldn't delete board_id: {_id}")
         elif collection == "APPS":
             board_id = doc['data']["boardId"]
             room_id = doc['data']['roomId']
             try:
                 # get the smartbit and clean up after itself before deleting
 
-                sb = self.rooms[room_id].boards[board_id].smartbits[_id]
+                sb = self.smartbits.pop(_id)
+                self.updated_at.pop(_id, None)
                 sb.clean_up()
                 del self.rooms[room_id].boards[board_id].smartbits[_id]
             except:
                 logger.error(f"Couldn't delete app_id: {_id}")
 
-    def handle_linked_app(self, app_id, msg):
+    def __unindex_board(self, board):
+        # boards are deleted with all their apps, drop those from the index too
+        for app_id, _ in board.smartbits:
+            self.smartbits.pop(app_id, None)
+            self.updated_at.pop(app_id, None)
+
+    def resync(self):
+        """
+        Brings the rooms, boards and apps up to date with the server after the websocket
+        reconnected: creates and deletes what was created and deleted in the meantime,
+        and applies the docs of the apps updated since the last doc received for them
+        """
+        logger.info("Resyncing rooms, boards and apps after reconnection")
+        seen = {"ROOMS": set(), "BOARDS": set(), "APPS": set()}
+        nb_changes = 0
+        for collection, doc in self.s3_comm.stream_existing(room_ids=self.room_ids, board_id=self.board_id):
+            if collection == "READY":
+                continue
+            _id = doc["_id"]
+            seen[collection].add(_id)
+            if collection == "ROOMS":
+                if _id in self.rooms:
+                    self.rooms[_id].handleUpdate(doc)
+                    continue
+            elif collection == "BOARDS":
+                room = self.rooms.get(doc["data"]["roomId"])
+                if room is None or _id in room.boards:
+                    continue
+            elif _id in self.smartbits:
+                if self.updated_at.get(_id) != doc.get("_updatedAt"):
+                    # all the fields of data, including the state, are applied
+                    self.__handle_update(collection, doc, dict(doc["data"]))
+                    nb_changes += 1
+                continue
+            self.__handle_create(collection, doc)
+            nb_changes += 1
+
+        for room_id, room in list(self.rooms.items()):
+            if room_id not in seen["ROOMS"]:
+                self.__handle_delete("ROOMS", {"_id": room_id})
+                nb_changes += 1
+                continue
+            for board_id, board in list(room.boards.items()):
+                if board_id not in seen["BOARDS"]:
+                    self.__handle_delete("BOARDS", {"_id": board_id, "data": {"roomId": room_id}})
+                    nb_changes += 1
+                    continue
+                for app_id, _ in list(board.smartbits):
+                    if app_id not in seen["APPS"]:
+                        self.__handle_delete("APPS", {"_id": app_id,
+                                                      "data": {"roomId": room_id, "boardId": board_id}})
+                        nb_changes += 1
+        logger.info(f"Resync done, {nb_changes} changes applied")
+
+    def handle_linked_app(self, app_id, updates):
         if app_id in self.callbacks:
             # handle callback
 
             for linked_info in self.callbacks[app_id].values():
-                if f"state.{linked_info.src_field}" in msg['event']['updates']:
+                if f"state.{linked_info.src_field}" in updates:
                     # print("Yes, the tracked fields was updated")
                     # TODO 4: make callback function optional. In which case, jsut update dest with src
-                    # TODO 1. We need to dispatch the function on a different thread, not run it
-                    #  on the same thread as proxy
-                    # TODO 2. Catch to avoid errors here so the thread does not crash
                     try:
-                        board_id = linked_info.board_id
-                        src_val = msg['event']['updates'][f"state.{linked_info.src_field}"]
+                        src_val = updates[f"state.{linked_info.src_field}"]
                         dest_field = linked_info.dest_field
                         dest_id = linked_info.dest_app
-                        dest_app = self.room.boards[board_id].smartbits[dest_id]
-                        linked_info.callback(src_val, dest_app, dest_field)
+                        dest_app = self.smartbits[dest_id].hydrate()
+                        self.executor.submit(dest_id, partial(linked_info.callback, src_val, dest_app, dest_field),
+                                             name=f"linked app callback {linked_info.callback}")
                     except Exception as e:
                         logger.error(
                             f"Error happened during callback for linked app {app_id}.\n {e}")
@@ -289,10 +463,9 @@ class SAGEProxy:
         #     logger.warn("Messages queue was not empty while starting to clean proxy")
         # self.__message_queue.close()
 
-        for room_id in sage_proxy.rooms.keys():
-            for board_id in sage_proxy.rooms[room_id].boards.keys():
-                for app_info in sage_proxy.rooms[room_id].boards[board_id].smartbits:
-                    app_info[1].clean_up()
+        self.executor.clean_up()
+        for sb in self.smartbits.values():
+            sb.clean_up()
 
     def register_linked_app(self, board_id, src_app, dest_app, src_field, dest_field, callback):
         if src_app not in self.callbacks:
@@ -328,12 +501,30 @@ if __name__ == "__main__":
     # signal.signal(signal.SIGINT, clean_up_terminate)
     # signal.signal(signal.SIGTERM, clean_up_terminate)
     # signal.signal(signal.SIGHUP, clean_up_terminate)
-    sage_proxy = SAGEProxy(conf, prod_type)
+    sage_proxy = None
+    if os.getenv("PROXY_WORKERS") and not os.getenv("ROOM_ID") and not os.getenv("BOARD_ID"):
+        # rooms spread over PROXY_WORKERS processes, see proxy_supervisor.py
+        from foresight.proxy_supervisor import ProxySupervisor
+
+        supervisor = ProxySupervisor(conf, prod_type)
+        supervisor.start()
+        supervisor.run_forever()
+    elif os.getenv("PROXY_STANDBY"):
+        # started ahead by monitor_room_activity.py, connected and waiting for its room
+        from foresight.utils.room_handoff import RoomHandoff
+
+        sage_proxy = SAGEProxy(conf, prod_type, room_ids=[])
+        room_id = RoomHandoff().take(os.getenv("PROXY_NAME", socket.gethostname()))
+        sage_proxy.add_room(room_id)
+    else:
+        # ROOM_ID/BOARD_ID restrict the proxy to one room/board, see monitor_room_activity.py
+        sage_proxy = SAGEProxy(conf, prod_type, room_id=os.getenv("ROOM_ID"), board_id=os.getenv("BOARD_ID"))
 
-    while True:
-        try:
-            time.sleep(10)
-        except KeyboardInterrupt:
-            sage_proxy.clean_up()
-            break
+    if sage_proxy is not None:
+        while True:
+            try:
+                time.sleep(10)
+            except KeyboardInterrupt:
+                sage_proxy.clean_up()
+                break
     logger.info("Terminating SageProxy")
@@ -0,0 +1,255 @@
+# -----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+# -----------------------------------------------------------------------------
+
+# Pool of proxy processes started ahead of time, waiting for a room.
+#
+# The processes are forked from a fork server that has already imported the proxy,
+# the boards and every smartbit module (pandas, pyarrow, celery...), so a new process
+# only has to connect to the server. Once connected it tells the pool it is READY and
+# waits for a room. Handing it a room then only loads that room's boards and apps.
+#
+# Handoff protocol, over a pipe between the pool and each process:
+#   process -> pool  ("READY", name)      connected, waiting for a room
+#   pool -> process  ("ROOM", room_id)    serve room_id
+#   process -> pool  ("SERVING", room_id) room_id is loaded and its events processed
+#   pool -> process  ("STOP", None)       clean up and exit
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import uuid
+from collections import deque
+
+from foresight.smartbitfactory import SmartBitFactory
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def preload_modules():
+    """
+    modules imported once by the fork server instead of by every proxy
+    """
+    modules = ["foresight.proxy", f"{SmartBitFactory.cls_root}.genericsmartbit"]
+    modules += [f"{SmartBitFactory.cls_root}.{name.lower()}" for name in SmartBitFactory.class_names]
+    return modules
+
+
+def serve_rooms(name, conn):
+    """
+    Entry point of a pool process, see the handoff protocol above
+    """
+    from foresight.proxy import SAGEProxy
+    from foresight.config import config as conf, prod_type
+
+    proxy = SAGEProxy(conf, prod_type, room_ids=[])
+    conn.send(("READY", name))
+    while True:
+        try:
+            command, room_id = conn.recv()
+        except EOFError:
+            # the pool is gone
+            break
+        if command == "STOP":
+            break
+        if command == "ROOM":
+            proxy.add_room(room_id)
+            conn.send(("SERVING", room_id))
+    proxy.clean_up()
+
+
+class ProxyPool:
+    """
+    Keeps size proxy processes started and connected, and hands them rooms.
+
+    It has the same interface as ComposeLauncher and RoomHandoff (start/stop,
+    offer/owner/release), so RoomController can run the proxies as local processes:
+    rooms offered while no process is READY are handed to the next one that is.
+    """
+
+    def __init__(self, size=None, target=serve_rooms, preload=None):
+        """
+        :param size: number of processes waiting for a room, PROXY_POOL_SIZE env.
+        variable or 2 by default
+        """
+        if size is None:
+            size = int(os.getenv("PROXY_POOL_SIZE", 2))
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self.__ctx = multiprocessing.get_context("forkserver")
+            self.__ctx.set_forkserver_preload(preload_modules() if preload is None else preload)
+        else:
+            logger.warning("forkserver is not available, the pool processes import the proxy themselves")
+            self.__ctx = multiprocessing.get_context("spawn")
+        self.size = size
+        self.target = target
+        # name -> (process, connection)
+        self.processes = {}
+        # processes READY and without a room, oldest first
+        self.idle = deque()
+        # processes started but not READY yet
+        self.starting = set()
+        # rooms offered and not handed to a process yet
+        self.offered = deque()
+        # room_id -> name of the process serving it
+        self.owners = {}
+        self.serving = set()
+
+        self.__lock = threading.RLock()
+        self.__changed = threading.Condition(self.__lock)
+        self.__closing = False
+        # written to so the listener waits on the connections of new processes too
+        self.__wake_r, self.__wake_w = multiprocessing.Pipe(duplex=False)
+        self.__listener = threading.Thread(target=self.__listen, name="sage-proxy-pool", daemon=True)
+        self.__listener.start()
+
+    def fill(self):
+        """
+        Starts processes until size of them are READY or starting
+        """
+        with self.__lock:
+            for _ in range(self.size - len(self.idle) - len(self.starting)):
+                self.start()
+
+    def start(self, name=None, room_id=None):
+        """
+        Starts a process. It takes room_id, or the first room offered, once READY
+        :return: name of the process
+        """
+        if name is None:
+            name = f"proxy-{uuid.uuid4().hex[:12]}"
+        parent_conn, child_conn = self.__ctx.Pipe()
+        process = self.__ctx.Process(target=self.target, args=(name, child_conn), name=name, daemon=True)
+        process.start()
+        child_conn.close()
+        with self.__lock:
+            self.processes[name] = (process, parent_conn)
+            self.starting.add(name)
+            if room_id is not None:
+                self.offered.appendleft(room_id)
+        self.__wake_w.send(None)
+        return name
+
+    def stop(self, name):
+        with self.__lock:
+            entry = self.processes.pop(name, None)
+            self.starting.discard(name)
+            if name in self.idle:
+                self.idle.remove(name)
+            for room_id in [room_id for room_id, owner in self.owners.items() if owner == name]:
+                del self.owners[room_id]
+                self.serving.discard(room_id)
+        if entry is None:
+            return
+        process, conn = entry
+        try:
+            conn.send(("STOP", None))
+        except (BrokenPipeError, OSError):
+            pass
+        process.join(timeout=10)
+        if process.is_alive():
+            logger.error(f"pool process {name} didn't stop, terminating it")
+            process.terminate()
+        conn.close()
+
+    def offer(self, room_id):
+        """
+        Hands room_id to a READY process, or to the next one to be
+        """
+        with self.__lock:
+            self.offered.append(room_id)
+            self.__match()
+
+    def owner(self, room_id):
+        with self.__lock:
+            return self.owners.get(room_id)
+
+    def release(self, room_id):
+        """
+        :return: name of the process that was serving room_id, None if it wasn't handed yet
+        """
+        with self.__lock:
+            if room_id in self.offered:
+                self.offered.remove(room_id)
+            self.serving.discard(room_id)
+            return self.owners.pop(room_id, None)
+
+    def wait_serving(self, room_id, timeout=None):
+        """
+        Waits until the process handed room_id has loaded it
+        :return: True if it did before timeout
+        """
+        with self.__changed:
+            return self.__changed.wait_for(lambda: room_id in self.serving, timeout)
+
+    def __match(self):
+        while self.idle and self.offered:
+            name = self.idle.popleft()
+            room_id = self.offered.popleft()
+            try:
+                self.processes[name][1].send(("ROOM", room_id))
+            except (BrokenPipeError, OSError):
+                # died while idle, the listener removes it
+                self.offered.appendleft(room_id)
+                continue
+            self.owners[room_id] = name
+            logger.info(f"room {room_id} handed to {name}")
+
+    def __listen(self):
+        while not self.__closing:
+            with self.__lock:
+                conns = {conn: name for name, (_, conn) in self.processes.items()}
+            try:
+                ready = multiprocessing.connection.wait(list(conns) + [self.__wake_r])
+            except OSError:
+                # a connection was closed by stop meanwhile
+                continue
+            for conn in ready:
+                if conn is self.__wake_r:
+                    self.__wake_r.recv()
+                    continue
+                try:
+                    message, value = conn.recv()
+                except (EOFError, OSError):
+                    self.__process_died(conns[conn])
+                    continue
+                with self.__changed:
+                    if message == "READY":
+                        self.starting.discard(value)
+                        self.idle.append(value)
+                        self.__match()
+                    elif message == "SERVING":
+                        self.serving.add(value)
+                    self.__changed.notify_all()
+
+    def __process_died(self, name):
+        with self.__lock:
+            entry = self.processes.pop(name, None)
+            if entry is None:
+                # stopped
+                return
+            entry[1].close()
+            self.starting.discard(name)
+            if name in self.idle:
+                self.idle.remove(name)
+            lost = [room_id for room_id, owner in self.owners.items() if owner == name]
+            logger.error(f"pool process {name} died (exit code {entry[0].exitcode}), rooms {lost} offered again")
+            for room_id in lost:
+                del self.owners[room_id]
+                self.serving.discard(room_id)
+                self.offered.appendleft(room_id)
+            if lost:
+                self.start()
+
+    def close(self):
+        self.__closing = True
+        for name in list(self.processes):
+            self.stop(name)
+        self.__wake_w.send(None)
+        self.__listener.join(timeout=5)
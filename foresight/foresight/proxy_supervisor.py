@@ -0,0 +1,271 @@
+# -----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+# -----------------------------------------------------------------------------
+
+# Runs the proxy as N worker processes, each one serving a share of the rooms, so
+# the smartbits of different rooms don't compete for the same interpreter (GIL).
+# Rooms are spread over the workers with consistent hashing: adding or removing a
+# worker only moves the rooms the change affects.
+
+import bisect
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+
+from foresight.utils.sage_communication import SageCommunication
+from foresight.utils.sage_websocket import SageWebsocket
+from foresight.utils.message_decoder import MessageDecoder
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """
+    Maps keys (room ids) to nodes (workers). Each node is placed `replicas` times on
+    the ring so the keys are spread evenly; a key belongs to the first node found
+    clockwise from its hash.
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = set()
+        self.__hashes = []
+        self.__owners = {}
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            h = _hash(f"{node}:{i}")
+            self.__owners[h] = node
+            bisect.insort(self.__hashes, h)
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for i in range(self.replicas):
+            h = _hash(f"{node}:{i}")
+            del self.__owners[h]
+            self.__hashes.pop(bisect.bisect_left(self.__hashes, h))
+
+    def get_node(self, key):
+        """
+        :return: the node owning key, None if the ring is empty
+        """
+        if not self.__hashes:
+            return None
+        i = bisect.bisect(self.__hashes, _hash(key)) % len(self.__hashes)
+        return self.__owners[self.__hashes[i]]
+
+
+def run_worker(worker_id, commands, conf, prod_type):
+    """
+    Entry point of a worker process: a SAGEProxy serving the rooms it is told to
+    :param commands: queue of (command, room_id), command being ADD, REMOVE or STOP
+    """
+    # imported here so the supervisor itself doesn't load the smartbits
+    from foresight.proxy import SAGEProxy
+
+    proxy = SAGEProxy(conf, prod_type, room_ids=[])
+    logger.info(f"proxy worker {worker_id} started")
+    while True:
+        command, room_id = commands.get()
+        if command == "STOP":
+            break
+        try:
+            if command == "ADD":
+                proxy.add_room(room_id)
+            elif command == "REMOVE":
+                proxy.remove_room(room_id)
+        except Exception as e:
+            logger.error(f"proxy worker {worker_id} couldn't {command} room {room_id}. \n{e}")
+    proxy.clean_up()
+    logger.info(f"proxy worker {worker_id} stopped")
+
+
+class ProxySupervisor:
+    """
+    Starts the proxy workers and tells each one which rooms to serve. It follows the
+    rooms created and deleted on the server, moves the rooms of a worker added or
+    removed with add_worker/remove_worker and restarts the workers that died.
+    """
+
+    def __init__(self, conf, prod_type, nb_workers=None, replicas=100):
+        """
+        :param nb_workers: number of worker processes, PROXY_WORKERS env. variable or the
+        number of CPUs by default
+        """
+        if nb_workers is None:
+            nb_workers = int(os.getenv("PROXY_WORKERS", 0)) or os.cpu_count() or 1
+        self.conf = conf
+        self.prod_type = prod_type
+        self.ring = ConsistentHashRing(replicas=replicas)
+        # worker_id -> (process, commands queue)
+        self.workers = {}
+        # room_id -> worker_id
+        self.assignments = {}
+        self.s3_comm = None
+        self.socket = None
+        self.decoder = MessageDecoder()
+        self.__ctx = multiprocessing.get_context("spawn")
+        self.__lock = threading.RLock()
+        self.__next_worker = 0
+        for _ in range(nb_workers):
+            self.add_worker()
+
+    def start(self):
+        """
+        Follows the rooms on the server and assigns the existing ones
+        """
+        self.s3_comm = SageCommunication(self.conf, self.prod_type)
+        self.socket = SageWebsocket(on_message_fn=self.process_messages, on_reconnect_fn=self.resync)
+        # subscribed first so no room created meanwhile is missed
+        self.socket.subscribe(["/api/rooms"])
+        self.resync()
+
+    def _start_worker(self, worker_id):
+        commands = self.__ctx.Queue()
+        process = self.__ctx.Process(target=run_worker, args=(worker_id, commands, self.conf, self.prod_type),
+                                     name=f"sage-proxy-{worker_id}")
+        process.start()
+        return process, commands
+
+    def __send(self, worker_id, command, room_id):
+        self.workers[worker_id][1].put((command, room_id))
+
+    def assign_room(self, room_id):
+        with self.__lock:
+            if room_id in self.assignments:
+                return
+            worker_id = self.ring.get_node(room_id)
+            self.assignments[room_id] = worker_id
+            self.__send(worker_id, "ADD", room_id)
+        logger.info(f"room {room_id} assigned to {worker_id}")
+
+    def release_room(self, room_id):
+        with self.__lock:
+            worker_id = self.assignments.pop(room_id, None)
+            if worker_id is not None:
+                self.__send(worker_id, "REMOVE", room_id)
+
+    def add_worker(self, worker_id=None):
+        """
+        Starts a worker and moves to it the rooms it now owns
+        :return: the id of the worker
+        """
+        with self.__lock:
+            if worker_id is None:
+                worker_id = f"worker-{self.__next_worker}"
+                self.__next_worker += 1
+            self.workers[worker_id] = self._start_worker(worker_id)
+            self.ring.add_node(worker_id)
+            self.__rebalance()
+        return worker_id
+
+    def remove_worker(self, worker_id):
+        """
+        Stops a worker and moves its rooms to the remaining workers
+        """
+        with self.__lock:
+            if len(self.workers) == 1:
+                raise ValueError("Can't remove the last proxy worker")
+            self.ring.remove_node(worker_id)
+            self.__send(worker_id, "STOP", None)
+            process, _ = self.workers.pop(worker_id)
+            self.__rebalance()
+        process.join(timeout=10)
+
+    def __rebalance(self):
+        moved = 0
+        for room_id, owner in self.assignments.items():
+            worker_id = self.ring.get_node(room_id)
+            if worker_id == owner:
+                continue
+            if owner in self.workers:
+                self.__send(owner, "REMOVE", room_id)
+            self.__send(worker_id, "ADD", room_id)
+            self.assignments[room_id] = worker_id
+            moved += 1
+        if moved:
+            logger.info(f"moved {moved} of {len(self.assignments)} rooms across {len(self.workers)} workers")
+
+    def check_workers(self):
+        """
+        Restarts the workers that died and hands them back their rooms
+        """
+        with self.__lock:
+            for worker_id, (process, _) in list(self.workers.items()):
+                if process.is_alive():
+                    continue
+                logger.error(f"proxy worker {worker_id} died (exit code {process.exitcode}), restarting it")
+                self.workers[worker_id] = self._start_worker(worker_id)
+                for room_id, owner in self.assignments.items():
+                    if owner == worker_id:
+                        self.__send(worker_id, "ADD", room_id)
+
+    def resync(self):
+        """
+        Assigns the rooms created and releases the rooms deleted since the last sync
+        """
+        rooms = {room["_id"] for room in self.s3_comm.get_rooms()}
+        with self.__lock:
+            for room_id in rooms - self.assignments.keys():
+                self.assign_room(room_id)
+            for room_id in self.assignments.keys() - rooms:
+                self.release_room(room_id)
+
+    def process_messages(self, ws, msg):
+        for event in self.decoder.decode(msg):
+            if event.col != "ROOMS":
+                continue
+            if event.type == "CREATE":
+                self.assign_room(event.doc["_id"])
+            elif event.type == "DELETE":
+                self.release_room(event.doc["_id"])
+
+    def get_assignments(self):
+        """
+        :return: dict worker_id -> sorted list of the rooms it serves
+        """
+        with self.__lock:
+            assignments = {worker_id: [] for worker_id in self.workers}
+            for room_id, worker_id in self.assignments.items():
+                assignments[worker_id].append(room_id)
+        return {worker_id: sorted(rooms) for worker_id, rooms in assignments.items()}
+
+    def run_forever(self, check_interval=5):
+        while True:
+            try:
+                time.sleep(check_interval)
+                self.check_workers()
+            except KeyboardInterrupt:
+                self.stop()
+                break
+
+    def stop(self):
+        if self.socket is not None:
+            self.socket.clean_up()
+        with self.__lock:
+            for worker_id in self.workers:
+                self.__send(worker_id, "STOP", None)
+            for worker_id, (process, _) in self.workers.items():
+                process.join(timeout=10)
+                if process.is_alive():
+                    logger.error(f"proxy worker {worker_id} didn't stop, terminating it")
+                    process.terminate()
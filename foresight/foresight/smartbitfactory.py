@@ -6,16 +6,90 @@
 #  the file LICENSE, distributed as part of this software.
 # -----------------------------------------------------------------------------
 
+import threading
+
+from pydantic import ValidationError
+
 from foresight.utils.generic_utils import import_cls
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # python < 3.8
+    entry_points = None
+
+
+class SchemaCheck:
+    """
+    Keys a doc needs for a smartbit class to be built from it: the required fields
+    (by alias) of the class and of the models nested in it, compiled once per class.
+
+    It only checks that the keys are there, and that nested models get dicts, which
+    catches docs written for another version of the class without running the full
+    pydantic validation.
+    """
+    _checks = {}
+
+    def __init__(self, model_cls):
+        from foresight.smartbits.smartbit import TrackedBaseModel
+
+        # (alias, required, SchemaCheck of the nested model or None)
+        self.fields = []
+        for field in model_cls.__fields__.values():
+            nested = SchemaCheck.for_class(field.type_) if TrackedBaseModel.is_model_field(field) else None
+            self.fields.append((field.alias, field.required is True, nested))
+
+    @classmethod
+    def for_class(cls, model_cls):
+        check = cls._checks.get(model_cls)
+        if check is None:
+            check = cls._checks[model_cls] = cls(model_cls)
+        return check
+
+    def missing(self, doc, path=""):
+        """
+        :return: dotted path of the first key missing or of the wrong type, None if
+        the doc has them all
+        """
+        for alias, required, nested in self.fields:
+            value = doc.get(alias)
+            if value is None:
+                if required and alias not in doc:
+                    return f"{path}{alias}"
+                continue
+            if nested is not None:
+                if not isinstance(value, dict):
+                    return f"{path}{alias}"
+                missing = nested.missing(value, f"{path}{alias}.")
+                if missing is not None:
+                    return missing
+        return None
+
 
 class SmartBitFactory:
+    """
+    Creates the smartbits from the app docs.
+
+    The class of each app type is resolved once and cached. It is, in order:
+     - a class registered with SmartBitFactory.register
+     - a class advertised by an installed package in the `foresight.smartbits` entry
+       point group, named after the app type:
+           [options.entry_points]
+           foresight.smartbits =
+               MyApp = my_package.my_app:MyApp
+     - a class of foresight.smartbits listed in class_names, e.g. Counter in
+       foresight.smartbits.counter
+     - GenericSmartBit otherwise
+
+    Docs missing fields of their class (see SchemaCheck) are built as GenericSmartBit
+    without trying the class first.
+    """
     # TODO: move this to configure file since it's also used in wall
     cls_root = "foresight.smartbits"
+    entry_point_group = "foresight.smartbits"
 
     # TODO: read these names from some conf file; not hardcoded here
     class_names = {
@@ -35,40 +109,228 @@ class SmartBitFactory:
         "VideoViewer": "videoviewer",
         "IFrame": "iframe",
         "Seer": "seer",
+        "KernelDashboard": "kerneldashboard",
     }
 
+    # app type -> smartbit class, filled as the types are resolved
+    _classes = {}
+    # app type -> class or entry point registered for it
+    _registered = {}
+    _entry_points_loaded = False
+    _lock = threading.RLock()
+
+    @classmethod
+    def register(cls, smartbit_type, smartbit_class=None):
+        """
+        Registers the class of an app type, taking precedence over the entry points
+        and built-in classes. Can be used as a class decorator:
+
+        @SmartBitFactory.register("MyApp")
+        class MyApp(SmartBit):
+            ...
+        """
+        def decorator(smartbit_class):
+            with cls._lock:
+                cls._registered[smartbit_type] = smartbit_class
+                cls._classes.pop(smartbit_type, None)
+            return smartbit_class
+
+        if smartbit_class is None:
+            return decorator
+        return decorator(smartbit_class)
+
+    @classmethod
+    def __load_entry_points(cls):
+        if cls._entry_points_loaded:
+            return
+        with cls._lock:
+            if cls._entry_points_loaded:
+                return
+            if entry_points is not None:
+                eps = entry_points()
+                # select() from python 3.10, a dict of groups before
+                eps = eps.select(group=cls.entry_point_group) if hasattr(eps, "select") \
+                    else eps.get(cls.entry_point_group, [])
+                for ep in eps:
+                    # registered classes win over entry points
+                    cls._registered.setdefault(ep.name, ep)
+            cls._entry_points_loaded = True
+
+    @classmethod
+    def has_class(cls, smartbit_type):
+        """
+        True if the app type has its own smartbit class. Nothing is imported to tell.
+        """
+        cls.__load_entry_points()
+        return smartbit_type in cls._registered or smartbit_type in cls.class_names
+
+    @classmethod
+    def generic_class(cls):
+        return cls.get_class("GenericSmartBit")
+
+    @classmethod
+    def get_class(cls, smartbit_type):
+        """
+        :return: the smartbit class of the app type, resolved the first time only
+        """
+        smartbit_class = cls._classes.get(smartbit_type)
+        if smartbit_class is None:
+            with cls._lock:
+                smartbit_class = cls._classes.get(smartbit_type)
+                if smartbit_class is None:
+                    smartbit_class = cls._classes[smartbit_type] = cls.__resolve(smartbit_type)
+        return smartbit_class
+
+    @classmethod
+    def __resolve(cls, smartbit_type):
+        if smartbit_type == "GenericSmartBit":
+            return import_cls(f"{cls.cls_root}.genericsmartbit", "GenericSmartBit")
+        cls.__load_entry_points()
+        registered = cls._registered.get(smartbit_type)
+        try:
+            if registered is not None:
+                return registered if isinstance(registered, type) else registered.load()
+            if smartbit_type in cls.class_names:
+                return import_cls(f"{cls.cls_root}.{smartbit_type.lower()}", smartbit_type)
+        except Exception as e:  # error in the import
+            logger.error(f"Couldn't import the {smartbit_type} smartbit, using GenericSmartBit instead. {e}")
+        return cls.generic_class()
+
     @classmethod
     def create_smartbit(cls, doc):
-        smartbit_class = None
+        """
+        :param doc: app doc with state moved next to data
+        :return: the smartbit, None if the doc can't be converted at all
+        """
         smartbit_type = doc["data"]["type"]
-        smartbit_instance = None
-        # print(f"class path is {cls_path}")
+        smartbit_class = cls.get_class(smartbit_type)
+        generic_class = cls.generic_class()
+        if smartbit_class is not generic_class:
+            missing = SchemaCheck.for_class(smartbit_class).missing(doc)
+            if missing is not None:
+                # doc not compatible with current sb class. maybe too old.
+                logger.info(f"{smartbit_type} app {doc.get('_id')} has no valid `{missing}`, "
+                            f"creating a GenericSmartBit")
+                smartbit_class = generic_class
         try:
-            if smartbit_type in cls.class_names:
-                cls_path = ".".join([cls.cls_root, smartbit_type.lower()])
-            else:
-                cls_path = "foresight.smartbits.genericsmartbit"
-                smartbit_type = "GenericSmartBit"
+            return smartbit_class(**doc)
+        except ValidationError as e:
+            if smartbit_class is generic_class:
+                logger.error(f"Couldn't convert doc to actual smartbit: {smartbit_type}. {e}")
+                return None
+            logger.info(f"Couldn't create the {smartbit_type} smartbit, creating a GenericSmartBit. {e}")
+        except Exception:
+            # the doc is valid but the smartbit failed to start (kernel, redis...)
+            logger.exception(f"Error creating the {smartbit_type} smartbit {doc.get('_id')}")
+            if smartbit_class is generic_class:
+                return None
+        try:
+            return generic_class(**doc)
+        except ValidationError as e:
+            logger.error(f"Couldn't convert doc to actual smartbit: {smartbit_type}. {e}")
+            return None
 
-            smartbit_class = import_cls(cls_path, smartbit_type)
-        except Exception as e:  # eror in the import
-            logger.error(f"Couldn't not import {smartbit_type} from {cls_path} {e}")
 
-        try:
-            smartbit_instance = smartbit_class(**doc)
-        except:  #  issue with doc not compatible with current sb class. maybe too old.
-            try:
-                if smartbit_class is not None and smartbit_type != "GenericSmartBit":
-                    cls_path = ".".join([cls.cls_root, "genericsmartbit"])
-                    smartbit_type = "GenericSmartBit"
-                    smartbit_class = import_cls(cls_path, smartbit_type)
-                    smartbit_instance = smartbit_class(**doc)
-                else:
-                    logger.info(
-                        f"Couldn't convert doc to actual smartbit: {smartbit_class} {smartbit_type}"
-                    )
-                    # raise Exception("Couldn't conver doc to actual smartbit")
-            except Exception as e:
-                logger.error(f"Couldn't create the class in the SmartbitFactory {e}")
-
-        return smartbit_instance
+class LazySmartBit:
+    """
+    Stand-in for a smartbit that keeps the raw app doc and only builds the smartbit
+    class when something needs it: an action (executeFunc) targets the app, a linked
+    app callback writes to it, or code reads one of its attributes. The smartbit classes
+    setting hydrate_eagerly are built right away by the proxy.
+
+    Until then, updates received for the app simply replace the stored doc so the
+    smartbit is built from the latest state whenever it is hydrated. Once hydrated,
+    the doc is dropped and attribute access, updates and clean_up go to the smartbit.
+    """
+    __slots__ = ("app_id", "app_type", "_doc", "_smartbit", "_lock")
+
+    def __init__(self, doc):
+        """
+        :param doc: app doc with state moved next to data, as passed to create_smartbit
+        """
+        object.__setattr__(self, "app_id", doc["_id"])
+        object.__setattr__(self, "app_type", doc["data"]["type"])
+        object.__setattr__(self, "_doc", doc)
+        object.__setattr__(self, "_smartbit", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    @property
+    def hydrated(self):
+        return self._smartbit is not None
+
+    @property
+    def is_generic(self):
+        """True if the app has no dedicated smartbit class (or its doc doesn't fit it)"""
+        if self._smartbit is not None:
+            return type(self._smartbit).__name__ == "GenericSmartBit"
+        return not SmartBitFactory.has_class(self.app_type)
+
+    @property
+    def doc(self):
+        """the latest doc received for the app, None once hydrated"""
+        return self._doc
+
+    @property
+    def hydrate_eagerly(self):
+        """True if the smartbit class asks to be built as soon as the app is created"""
+        if self._smartbit is not None or not SmartBitFactory.has_class(self.app_type):
+            return False
+        return getattr(SmartBitFactory.get_class(self.app_type), "hydrate_eagerly", False)
+
+    def has_pending_action(self):
+        """True if the latest doc asks to run an action (executeFunc) on the app"""
+        if self._smartbit is not None:
+            exec_info = getattr(self._smartbit.state, "executeInfo", None)
+            return exec_info is not None and exec_info.executeFunc != ""
+        exec_info = self._doc["state"].get("executeInfo")
+        return isinstance(exec_info, dict) and bool(exec_info.get("executeFunc"))
+
+    def hydrate(self):
+        """
+        Builds the smartbit if not done yet
+        :return: the smartbit, None if the doc couldn't be converted
+        """
+        smartbit = self._smartbit
+        if smartbit is not None:
+            return smartbit
+        with self._lock:
+            if self._smartbit is None:
+                smartbit = SmartBitFactory.create_smartbit(self._doc)
+                if smartbit is None:
+                    return None
+                object.__setattr__(self, "_smartbit", smartbit)
+                object.__setattr__(self, "_doc", None)
+                logger.debug(f"hydrated {self.app_type} smartbit {self.app_id}")
+            return self._smartbit
+
+    def refresh_data_form_update(self, update_data, updates):
+        with self._lock:
+            if self._smartbit is None:
+                # same layout as the docs passed to create_smartbit
+                update_data["state"] = update_data["data"]["state"]
+                del update_data["data"]["state"]
+                object.__setattr__(self, "_doc", update_data)
+                return
+        self._smartbit.refresh_data_form_update(update_data, updates)
+
+    def clean_up(self):
+        # nothing was started for an app that was never hydrated
+        if self._smartbit is not None:
+            self._smartbit.clean_up()
+
+    def __getattr__(self, name):
+        # only called for attributes not defined above
+        smartbit = self.hydrate()
+        if smartbit is None:
+            raise AttributeError(f"Couldn't create the {self.app_type} smartbit {self.app_id} to get `{name}`")
+        return getattr(smartbit, name)
+
+    def __setattr__(self, name, value):
+        if name in LazySmartBit.__slots__:
+            raise AttributeError(f"`{name}` is read-only")
+        setattr(self.hydrate(), name, value)
+
+    def __repr__(self):
+        if self._smartbit is not None:
+            return repr(self._smartbit)
+        return f"LazySmartBit(app_id={self.app_id!r}, app_type={self.app_type!r})"
@@ -6,6 +6,8 @@
 #  the file LICENSE, distributed as part of this software.
 # -----------------------------------------------------------------------------
 
+from typing import ClassVar
+
 from foresight.smartbits.smartbit import SmartBit, ExecuteInfo
 from foresight.smartbits.smartbit import TrackedBaseModel
 from pydantic import PrivateAttr
@@ -18,6 +20,8 @@ class CSVViewerState(TrackedBaseModel):
 class CSVViewer(SmartBit):
     # the key that is assigned to this in state is
     state: CSVViewerState
+    # sends its state once created
+    hydrate_eagerly: ClassVar[bool] = True
     # _some_private_info: dict = PrivateAttr()
 
     def __init__(self, **kwargs):
@@ -13,10 +13,7 @@ from typing import Optional, TypeVar
 from urllib.request import urlopen
 from urllib.parse import urlparse
 from os.path import splitext
-import pandas as pd
-import numpy as np
-# import pyarrow as pa
-import pyarrow.csv as csv
+# pandas, numpy and pyarrow are imported by load_data, the only place using them
 import time
 import math
 # import magic
@@ -118,6 +115,10 @@ class DataTable(SmartBit):
     # TODO, add a decorator to automatically set executeFunc
     # and params to ""
     def load_data(self, url):
+        import pandas as pd
+        import numpy as np
+        import pyarrow.csv as csv
+
         start = time.time()
         extension = self.get_ext(url)
         response = urlopen(url)
@@ -6,6 +6,8 @@
 #  the file LICENSE, distributed as part of this software.
 #-----------------------------------------------------------------------------
 
+from typing import ClassVar
+
 from foresight.smartbits.smartbit import SmartBit, ExecuteInfo
 from foresight.smartbits.smartbit import TrackedBaseModel
 from pydantic import PrivateAttr
@@ -14,6 +16,11 @@ import requests
 from foresight.jupyterkernelproxy import JupyterKernelProxy
 from foresight.task_scheduler import TaskScheduler
 
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 class KernelDashboardState(TrackedBaseModel):
     """
     This class represents the state of the kernel dashboard
@@ -27,6 +34,8 @@ class KernelDashboardState(TrackedBaseModel):
 
 class KernelDashboard(SmartBit):
     state: KernelDashboardState
+    # goes online and starts its heartbeat once created
+    hydrate_eagerly: ClassVar[bool] = True
 
     _redis_space: str = PrivateAttr(default="JUPYTER:KERNELS")
     _base_url: str = PrivateAttr(default=f"{conf[prod_type]['jupyter_server']}/api")
@@ -71,26 +80,22 @@ class KernelDashboard(SmartBit):
                 "auth_users": auth_users
             }
             self._r_json.set(self._redis_space, response_data['id'], kernel_info)
+            self._jupyter_client.invalidate_kernels()
             self.get_available_kernels(user_uuid=owner_uuid)
 
     def delete_kernel(self, kernel_id, user_uuid):
         """ Shutdown a kernel
         """
-        # get all valid kernel ids from jupyter server
-        kernel_list = [k['id'] for k in self._jupyter_client.get_kernels()]
-        if kernel_id in kernel_list:
-            # shutdown kernel from jupyter server and remove from redis server
-            j_url = f'{self._base_url}/kernels/{kernel_id}'
-            response = requests.delete(j_url, headers=self._headers)
-            if response.status_code == 204:
-                self.get_available_kernels(user_uuid=user_uuid)
-            self._r_json.delete(self._redis_space, kernel_id)
-            self.get_available_kernels(user_uuid=user_uuid)
-        else:
-            # cleanup the kernel from redis server if it is not in jupyter server
-            self.get_available_kernels(user_uuid=user_uuid)
-            self._r_json.delete(self._redis_space, kernel_id)
-            self.get_available_kernels(user_uuid=user_uuid)
+        # shutdown kernel from jupyter server, not looked up in the kernels cached since
+        # it might be outdated. 404: already gone
+        j_url = f'{self._base_url}/kernels/{kernel_id}'
+        response = requests.delete(j_url, headers=self._headers)
+        if response.status_code not in (204, 404):
+            logger.error(f"Couldn't shutdown kernel {kernel_id}, code was {response.status_code}")
+        # cleanup the kernel from redis server, whether it was in jupyter server or not
+        self._r_json.delete(self._redis_space, kernel_id)
+        self._jupyter_client.invalidate_kernels()
+        self.get_available_kernels(user_uuid=user_uuid)
 
     def shudown_all_kernels(self):
         kernel_list = [k['id'] for k in self._jupyter_client.get_kernels()]
@@ -100,24 +105,22 @@ class KernelDashboard(SmartBit):
             if response.status_code == 204:
                 print(f"Kernel {kernel_id} shutdown successfully")
                 self._r_json.delete(self._redis_space, kernel_id)
-                self.get_available_kernels()
+        self._jupyter_client.invalidate_kernels()
+        self.get_available_kernels()
 
     def restart_kernel(self, kernel_id, user_uuid):
         j_url = f'{self._base_url}/kernels/{kernel_id}/restart'
         response = requests.post(j_url, headers=self._headers)
         if response.status_code == 200:
+            self._jupyter_client.invalidate_kernels()
             self.get_available_kernels(user_uuid=user_uuid)
 
     def get_available_kernels(self, user_uuid=None):
         """
         This function will get the kernels from the redis server
         """
-        # get all valid kernel ids from jupyter server
-        valid_kernel_list = [k['id'] for k in self._jupyter_client.get_kernels()]
-        # get all kernels from redis server
-        kernels = self._jupyter_client.redis_server.json().get(self._redis_space)
-        # remove kernels the list of available kernels that are not in jupyter server
-        [kernels.pop(k) for k in kernels if k not in valid_kernel_list]
+        # kernels running on the jupyter server and their entry in redis, cached and shared
+        kernels = self._jupyter_client.get_available_kernels()
         available_kernels = []
         for kernel in kernels.keys():
             if user_uuid and kernels[kernel]["is_private"] and kernels[kernel]["owner_uuid"] != user_uuid:
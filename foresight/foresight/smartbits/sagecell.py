@@ -6,11 +6,14 @@
 #  the file LICENSE, distributed as part of this software.
 # -----------------------------------------------------------------------------
 
+from typing import ClassVar
+
 from pydantic import PrivateAttr
 
 from foresight.smartbits.smartbit import SmartBit, ExecuteInfo
 from foresight.smartbits.smartbit import TrackedBaseModel
 from foresight.jupyterkernelproxy import JupyterKernelProxy
+from foresight.utils.cell_output import CellOutput
 
 import logging
 
@@ -31,20 +34,30 @@ class SageCellState(TrackedBaseModel):
     msgId: str = ("",)
     history: list = []
     streaming: bool = False
+    # position of the execution waiting for its turn on the kernel, 1 for the next to run,
+    # 0 if none waits
+    queuePosition: int = 0
     session: str = ""
 
 
 class SageCell(SmartBit):
     state: SageCellState
+    # clears the action left in the doc when created
+    hydrate_eagerly: ClassVar[bool] = True
     _jupyter_client = PrivateAttr()
     _r_json = PrivateAttr()
     _redis_space = PrivateAttr(default="JUPYTER:KERNELS")
+    _room_id = PrivateAttr()
+    # request_id -> CellOutput of the executions running
+    _outputs = PrivateAttr()
 
     def __init__(self, **kwargs):
         # THIS ALWAYS NEEDS TO HAPPEN FIRST!!
         super(SageCell, self).__init__(**kwargs)
         self._jupyter_client = JupyterKernelProxy()
         self._r_json = self._jupyter_client.redis_server.json()
+        self._room_id = kwargs["data"].get("roomId")
+        self._outputs = {}
         self.state.executeInfo.executeFunc = ""
         self.state.executeInfo.params = {}
         if self._r_json.get(self._redis_space) is None:
@@ -56,6 +69,19 @@ class SageCell(SmartBit):
         self.state.output = json.dumps(msg)
         self.send_updates()
 
+    def end_execution(self, _uuid):
+        output = self._outputs.pop(_uuid, None)
+        if output is not None:
+            output.close()
+        self.state.streaming = bool(self._outputs)
+        self.send_updates()
+
+    def spill_output(self, filename, file):
+        """
+        Uploads the output past the size sent in state.output as an asset of the room
+        """
+        self._s3_comm.upload_file({"files": (filename, file, "text/plain")}, {"room": self._room_id})
+
     def generate_error_message(self, user_uuid, error_msg):
         pm = [{"userId": user_uuid, "message": error_msg}]
         self.state.executeInfo.executeFunc = ""
@@ -69,12 +95,8 @@ class SageCell(SmartBit):
         """
         self.state.executeInfo.executeFunc = ""
         self.state.executeInfo.params = {}
-        # get all valid kernel ids from jupyter server
-        valid_kernel_list = [k["id"] for k in self._jupyter_client.get_kernels()]
-        # get all kernels from redis server
-        kernels = self._jupyter_client.redis_server.json().get(self._redis_space)
-        # remove kernels the list of available kernels that are not in jupyter server
-        [kernels.pop(k) for k in kernels if k not in valid_kernel_list]
+        # kernels running on the jupyter server and their entry in redis, cached and shared
+        kernels = self._jupyter_client.get_available_kernels()
         available_kernels = []
         for kernel in kernels.keys():
             if (
@@ -86,25 +108,52 @@ class SageCell(SmartBit):
         self.state.availableKernels = available_kernels
         self.send_updates()
 
-    def execute(self, _uuid):
+    def execute(self, _uuid, user_uuid=None):
         """
         Non blocking function to execute code. The proxy has the responsibility to execute the code
         and to call a call_back function which know how to handle the results message
         :param uuid:
-        :param code:
+        :param user_uuid: user running the cell, the users take turns on a shared kernel.
+        Without it, the cell takes turns with the other cells
         :return:
         """
         self.state.executeInfo.executeFunc = ""
         self.state.executeInfo.params = {}
+        if not self.state.kernel:
+            return
+        # outputs sent as they come, a stream of print coalesced in a few updates
+        output = CellOutput(_uuid, self.handle_exec_result, spill_fn=self.spill_output)
+        self._outputs[_uuid] = output
+        self.state.streaming = True
         command_info = {
             "uuid": _uuid,
-            "call_fn": self.handle_exec_result,
+            "call_fn": output.add,
+            "end_fn": lambda: self.end_execution(_uuid),
+            "user": user_uuid or self.app_id,
+            "position_fn": self.queue_position,
             "code": self.state.code,
             "kernel": self.state.kernel,
             "token": "",
         }
-        if self.state.kernel:
-            self._jupyter_client.execute(command_info)
+        self._jupyter_client.execute(command_info)
+
+    def queue_position(self, position):
+        self.state.queuePosition = position
+        self.send_updates()
+
+    def cancel(self, _uuid=None):
+        """
+        Cancels the execution _uuid, or all those of the cell, not sent to the kernel yet
+        """
+        self.state.executeInfo.executeFunc = ""
+        self.state.executeInfo.params = {}
+        request_ids = [_uuid] if _uuid else list(self._outputs)
+        for request_id in request_ids:
+            command_info = {"uuid": request_id, "kernel": self.state.kernel}
+            if self._jupyter_client.cancel(command_info):
+                logger.debug(f"execution {request_id} cancelled")
+        self.state.queuePosition = 0
+        self.send_updates()
 
     def interrupt(self, _uuid=None):
         self.state.executeInfo.executeFunc = ""
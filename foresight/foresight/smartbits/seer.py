@@ -67,12 +67,8 @@ class Seer(SmartBit):
         """
         This function will get the kernels from the redis server
         """
-        # get all valid kernel ids from jupyter server
-        valid_kernel_list = [k['id'] for k in self._jupyter_client.get_kernels()]
-        # get all kernels from redis server
-        kernels = self._jupyter_client.redis_server.json().get('JUPYTER:KERNELS')
-        # remove kernels the list of available kernels that are not in jupyter server
-        [kernels.pop(k) for k in kernels if k not in valid_kernel_list]
+        # kernels running on the jupyter server and their entry in redis, cached and shared
+        kernels = self._jupyter_client.get_available_kernels()
         available_kernels = []
         for kernel in kernels.keys():
             if not kernels[kernel]['kernel_alias'] or kernels[kernel]['kernel_alias'] == kernels[kernel]['kernel_name']:
@@ -156,4 +152,4 @@ class Seer(SmartBit):
             self._jupyter_client.interrupt(command_info)
 
     def clean_up(self):
-        pass
+        self._jupyter_client.clean_up()
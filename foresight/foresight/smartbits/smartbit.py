@@ -8,20 +8,168 @@
 
 from enum import Enum
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+from pydantic.fields import SHAPE_SINGLETON
 from typing import ClassVar
 from abc import abstractmethod
 
 
 # from utils.generic_utils import create_dict
 from foresight.utils.sage_communication import SageCommunication
+from foresight.utils.update_coalescer import UpdateCoalescer
 from operator import attrgetter
 from foresight.config import config as conf, prod_type
 
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FieldTable:
+    """
+    Every field reachable from a model class through nested TrackedBaseModel fields,
+    numbered once per class. A field that is written is recorded by setting its bit
+    in an int on the root model instead of adding its dotted path to a set.
+
+     - paths[i]: dotted path of field i, e.g. "data.position.x"
+     - keys[i]: key used for field i in the updates sent to the server
+     - getters[i]: attrgetter reading field i from the root model
+     - node_bits[path]: {field name: bit} of the fields of the model at `path`,
+       with the same format as TrackedBaseModel.path ("" for the root, ".data", ...)
+     - nodes: (index of the parent model, field name, path, node_bits[path]) of each
+       nested model, parents first. The root model has index 0 and nodes[i] index i + 1
+    """
+    _tables = {}
+
+    def __init__(self, model_cls):
+        self.paths = []
+        self.keys = []
+        self.getters = []
+        self.node_bits = {}
+        self.nodes = []
+        self.__add_node(model_cls, "")
+
+    def __add_node(self, model_cls, path, parent_index=None, name=None):
+        bits = {}
+        self.node_bits[path] = bits
+        if parent_index is not None:
+            self.nodes.append((parent_index, name, path, bits))
+        index = len(self.nodes)
+        children = []
+        for name, field in model_cls.__fields__.items():
+            if name == "path":
+                continue
+            dotted_path = f"{path}.{name}"[1:]
+            bits[name] = 1 << len(self.paths)
+            self.paths.append(dotted_path)
+            # updates don't need the data prefix
+            self.keys.append(dotted_path[5:] if dotted_path.startswith("data.") else dotted_path)
+            self.getters.append(attrgetter(dotted_path))
+            if TrackedBaseModel.is_model_field(field):
+                children.append((name, field.type_))
+        for name, child_cls in children:
+            self.__add_node(child_cls, f"{path}.{name}", index, name)
+
+    @classmethod
+    def for_class(cls, model_cls):
+        table = cls._tables.get(model_cls)
+        if table is None:
+            table = cls._tables[model_cls] = cls(model_cls)
+        return table
+
+    def touched_paths(self, dirty):
+        paths = set()
+        while dirty:
+            low = dirty & -dirty
+            paths.add(self.paths[low.bit_length() - 1])
+            dirty ^= low
+        return paths
+
+
+class UpdateSetter:
+    """
+    Writes the value of one update key in a model, compiled once per (model class, key).
+
+    The key is resolved against the model fields declared on the class: the nested
+    models leading to the field are read directly, the field is then set, or, for a
+    key going into a dict field ("state.params.x"), the dict is updated in place.
+    A dict sent for a field holding a model updates the fields of that model.
+    Keys that don't match a declared field are ignored, as they are when the
+    smartbit is created.
+    """
+    _setters = {}
+
+    def __init__(self, model_cls, key):
+        parts = key.split(".")
+        if parts[0] != "state" and model_cls.__fields__.get("data") is not None and \
+                parts[0] not in model_cls.__fields__:
+            # keys of the data fields don't have the data prefix
+            parts.insert(0, "data")
+        self.model_path = []
+        self.field = None
+        self.dict_path = []
+        cls = model_cls
+        for i, part in enumerate(parts):
+            field = cls.__fields__.get(part)
+            if field is None:
+                self.field = None
+                return
+            if i == len(parts) - 1 or not TrackedBaseModel.is_model_field(field):
+                self.field = field
+                self.dict_path = parts[i + 1:]
+                return
+            self.model_path.append(part)
+            cls = field.type_
+
+    @classmethod
+    def for_key(cls, model_cls, key):
+        setter = cls._setters.get((model_cls, key))
+        if setter is None:
+            setter = cls._setters[(model_cls, key)] = cls(model_cls, key)
+        return setter
+
+    def __call__(self, model, value):
+        if self.field is None:
+            return
+        for name in self.model_path:
+            model = model.__dict__[name]
+        name = self.field.name
+        if self.dict_path:
+            obj = model.__dict__[name]
+            if obj is None:
+                obj = model.__dict__[name] = {}
+            for part in self.dict_path[:-1]:
+                obj = obj.setdefault(part, {})
+            obj[self.dict_path[-1]] = value
+        elif isinstance(value, dict) and TrackedBaseModel.is_model_field(self.field):
+            sub_model = model.__dict__[name]
+            if sub_model is None:
+                sub_model = self.field.type_(**value)
+                model.__dict__[name] = sub_model
+                if model._root is not None:
+                    sub_model._bind(model._root, f"{model.path}.{name}")
+                return
+            for key, sub_value in value.items():
+                UpdateSetter.for_key(type(sub_model), key)(sub_model, sub_value)
+        else:
+            # written in __dict__ so the field is not marked as touched
+            model.__dict__[name] = value
+
 
 class TrackedBaseModel(BaseModel):
     path: Optional[str]
-    touched: Optional[set] = set()
+    # model at the root of the tree (the smartbit) holding the dirty bits of the
+    # whole tree, its FieldTable, and the {field name: bit} of this model
+    _root: Optional["TrackedBaseModel"] = PrivateAttr(default=None)
+    _table: Optional[FieldTable] = PrivateAttr(default=None)
+    _bits: Optional[dict] = PrivateAttr(default=None)
+    _dirty: int = PrivateAttr(default=0)
+    _fast_setattr: ClassVar[bool] = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        config = cls.__config__
+        cls._fast_setattr = config.allow_mutation and not config.frozen and not config.validate_assignment
     # _s3_comm: SageCommunication = PrivateAttr()
     # The following params should be defined as required in
     # the constructor since Not all apps need them!a
@@ -35,14 +183,54 @@ class TrackedBaseModel(BaseModel):
         # self._ai_client: AIClient  = AIClient()
 
     def __setattr__(self, name, value):
-        try:
-            if self.path is not None:
-                if name[0] != "_":
-                    # print(f"in setting __setattr__ {name} to {value}")
-                    self.touched.add(f"{self.path}.{name}"[1:])
+        bits = self._bits
+        # private attributes are never in bits
+        if bits is None or name not in bits:
+            try:
+                super().__setattr__(name, value)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Couldn't set `{name}` on {type(self).__name__}: {e}")
+            return
+        if self._fast_setattr:
+            # what BaseModel.__setattr__ ends up doing for a known field when
+            # assignments are neither validated nor forbidden
+            self.__dict__[name] = value
+            self.__fields_set__.add(name)
+        else:
             super().__setattr__(name, value)
-        except:
-            self.touched.remove(f"{self.path}.{name}"[1:])
+        root = self._root
+        object.__setattr__(root, "_dirty", root._dirty | bits[name])
+        if isinstance(value, TrackedBaseModel):
+            # writes to a sub-model that replaced another one are tracked too
+            value._bind(root, f"{self.path}.{name}")
+
+    @property
+    def touched(self):
+        """dotted paths of the fields written since the last send, e.g. {"data.position.x"}"""
+        root = self._root if self._root is not None else self
+        if root._table is None:
+            return set()
+        return root._table.touched_paths(root._dirty)
+
+    @staticmethod
+    def is_model_field(field):
+        """True for a field holding a single TrackedBaseModel (possibly optional)"""
+        return field.shape == SHAPE_SINGLETON and isinstance(field.type_, type) and \
+            issubclass(field.type_, TrackedBaseModel)
+
+    def clear_touched(self):
+        root = self._root if self._root is not None else self
+        object.__setattr__(root, "_dirty", 0)
+
+    def _bind(self, root, path):
+        """attaches this model (and the models under it) to the dirty bits of root"""
+        object.__setattr__(self, "_root", root)
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "_bits", root._table.node_bits.get(path))
+        for name in self.__fields__:
+            child = self.__dict__[name]
+            if isinstance(child, TrackedBaseModel):
+                child._bind(root, f"{path}.{name}")
 
     def is_dotted_path_dict(self, dotted_path):
         partial_obj = self
@@ -57,95 +245,67 @@ class TrackedBaseModel(BaseModel):
             return False
 
     def refresh_data_form_update(self, update_data, updates):
-        # TODO replace this temp solution, which updates everything with a
-        #  solution that updates only necessary fields
-
-        update_data['state'] = update_data['data']['state']
-        del (update_data['data']['state'])
-        # we don't need to update the following keys:
-        do_not_modify = ["_id", "_createdAt",
-                         '_updatedAt', '_createdBy', '_updatedBy']
-        _ = [update_data.pop(key) for key in do_not_modify]
-
-        def attrsetter(name):
-            def setter(obj, val):
-                fields = name.split(".")
-                is_dict = False
-                for field in fields[0:-1]:
-                    try:
-                        obj = getattr(obj, field)
-
-                    except:
-                        try:
-                            obj[field] = {}
-                            obj = obj[field]
-                        except:
-                            raise Exception("Not a dict?")
-
-                # using object setattr to avoid adding field to touched
-                error = True
-                try:
-                    object.__setattr__(obj, fields[-1], val)
-                    error = False
-                except:
-                    obj[fields[-1]] = val
-                    error = False
-                finally:
-                    if error:
-                        raise Exception(
-                            f"Error Happened updating {obj[fields[-1]]} ")
-            return setter
-
-        def recursive_iter(u_data, path=[]):
-            if isinstance(u_data, dict) and len(u_data) > 0:
-                for k, item in u_data.items():
-                    path.append(k)
-                    yield from recursive_iter(item, path)
-                    path.pop(-1)
-            else:
-                dotted_path = ".".join(path)
-                yield (dotted_path, u_data)
-
-        # what was updated?
-        for updated_field_id, updated_field_val in updates.items():
-            if len(updated_field_id.split(".")) > 1 and \
-                    self.is_dotted_path_dict(updated_field_id):
-                attrsetter(updated_field_id)(self, updated_field_val)
+        """
+        Applies the fields changed by an UPDATE message without marking them as touched
+        :param update_data: the updated doc. Not used, updates has all the new values
+        :param updates: {key: new value} as sent by the server, keys are relative to
+        data: "position", "state.count", "state.executeInfo.executeFunc", ...
+        """
+        for key, value in updates.items():
+            UpdateSetter.for_key(type(self), key)(self, value)
+
+    def track_fields(self):
+        """
+        Makes this model the root of the tracking: every nested model shares its dirty
+        bits and gets its path and {field name: bit}. Done in one pass over the nested
+        models plan compiled once per class (FieldTable.nodes).
+        """
+        table = FieldTable.for_class(type(self))
+        setattr_ = object.__setattr__
+        setattr_(self, "_root", self)
+        setattr_(self, "_table", table)
+        setattr_(self, "_dirty", 0)
+        setattr_(self, "path", "")
+        setattr_(self, "_bits", table.node_bits[""])
+        models = [self]
+        for parent_index, name, path, bits in table.nodes:
+            parent = models[parent_index]
+            child = parent.__dict__.get(name) if parent is not None else None
+            if isinstance(child, TrackedBaseModel):
+                setattr_(child, "_root", self)
+                setattr_(child, "path", path)
+                setattr_(child, "_bits", bits)
             else:
-                for dotted_path, val in recursive_iter(update_data):
-                    # print(f"working on {dotted_path} and {val}")
-                    attrsetter(dotted_path)(self, val)
+                # e.g. an optional model left to None
+                child = None
+            models.append(child)
 
     def copy_touched(self):
-        touched = self.touched
-        fields = [("self", self)]
-        while fields:
-            field = fields.pop(0)
-            for child in [(i, field[1].__dict__[i]) for i in field[1].__fields__.keys()]:
-
-                if isinstance(child[1], BaseModel) and child[0] != "_":
-                    child[1].touched = touched
-                    fields.append(child)
+        """kept for compatibility, see track_fields"""
+        self.track_fields()
 
     def set_path(self):
-        self.path = ""
-        fields = [("self", self)]
-        while fields:
-            field = fields.pop(0)
-            path = field[1].path
-            for child in [(i, field[1].__dict__[i]) for i in field[1].__fields__.keys()]:
-                if isinstance(child[1], BaseModel):
-                    child[1].path = path + "." + child[0]
-                    fields.append(child)
+        """kept for compatibility, see track_fields"""
+        self.track_fields()
 
     def get_all_touched_fields_dict(self):
+        """
+        :return: {key: current value} of the fields written since the last send, with
+        keys as expected by the server ("position.x", "state.count", ...)
+        """
+        root = self._root if self._root is not None else self
+        table = root._table
         data = {}
-        for field in self.touched:
-            if field.startswith("data."):
-                # updates don't need the data prefix
-                data[field[5:]] = attrgetter(field)(self)
-            else:
-                data[field] = attrgetter(field)(self)
+        if table is None:
+            return data
+        keys = table.keys
+        getters = table.getters
+        dirty = root._dirty
+        while dirty:
+            low = dirty & -dirty
+            i = low.bit_length() - 1
+            data[keys[i]] = getters[i](root)
+            dirty ^= low
         return data
 
     def action_sends_update(_func):
@@ -212,20 +372,36 @@ class SmartBit(TrackedBaseModel):
     data: Data
 
     _s3_comm: ClassVar = SageCommunication(conf, prod_type)
+    _coalescer: ClassVar = UpdateCoalescer(_s3_comm)
+    # built as soon as the app is created rather than by its first action (see
+    # LazySmartBit), for the smartbits whose constructor has to run, e.g. to start a task
+    hydrate_eagerly: ClassVar[bool] = False
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.copy_touched()
-        self.set_path()
+        self.track_fields()
+
+    @classmethod
+    def batch(cls):
+        """
+        Context manager grouping the send_updates of all the smartbits into one batch
+        request sent when the block exits.
+
+        with SmartBit.batch():
+            for sb in smartbits:
+                sb.data.position.x = 0
+                sb.send_updates()
+        """
+        return cls._coalescer.batch()
 
     def send_updates(self):
         new_data = self.get_all_touched_fields_dict()
-        self.touched.clear()
-        self._s3_comm.send_app_update(self.app_id, new_data)
+        self.clear_touched()
+        self._coalescer.send(self.app_id, new_data)
 
     def get_updates_for_batch(self):
         new_data = self.get_all_touched_fields_dict()
-        self.touched.clear()
+        self.clear_touched()
         obj = {'id': self.app_id, 'updates': new_data}
         return obj
 
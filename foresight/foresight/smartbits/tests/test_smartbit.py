@@ -0,0 +1,89 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import copy
+
+import pytest
+
+from foresight.smartbits.counter import Counter
+from foresight.smartbits.smartbit import ExecuteInfo
+from foresight.smartbits.tests.sample_sb_docs import counter_doc
+
+
+@pytest.fixture()
+def counter_instance():
+    yield Counter(**copy.deepcopy(counter_doc))
+
+
+def test_nothing_touched_after_creation(counter_instance):
+    assert counter_instance.touched == set()
+    assert counter_instance.get_all_touched_fields_dict() == {}
+
+
+def test_touched_fields(counter_instance):
+    counter_instance.state.count = 3
+    counter_instance.data.position.x = 10
+    counter_instance.data.raised = False
+    assert counter_instance.touched == {"state.count", "data.position.x", "data.raised"}
+    assert counter_instance.get_all_touched_fields_dict() == {
+        "state.count": 3, "position.x": 10, "raised": False}
+
+    counter_instance.clear_touched()
+    assert counter_instance.get_all_touched_fields_dict() == {}
+
+
+def test_values_read_at_send_time(counter_instance):
+    counter_instance.state.count = 3
+    counter_instance.state.count = 4
+    assert counter_instance.get_all_touched_fields_dict() == {"state.count": 4}
+
+
+def test_replaced_sub_model_is_tracked(counter_instance):
+    counter_instance.state.executeInfo = ExecuteInfo(executeFunc="", params={})
+    counter_instance.clear_touched()
+    counter_instance.state.executeInfo.executeFunc = "reset_to_zero"
+    assert counter_instance.get_all_touched_fields_dict() == {"state.executeInfo.executeFunc": "reset_to_zero"}
+
+
+def test_unknown_field_not_touched(counter_instance):
+    counter_instance.state.not_a_field = 1
+    assert counter_instance.touched == set()
+
+
+def make_update(updates):
+    doc = copy.deepcopy(counter_doc)
+    doc["data"]["state"] = doc.pop("state")
+    return doc, updates
+
+
+def test_refresh_updates_only_given_fields(counter_instance):
+    counter_instance.refresh_data_form_update(*make_update({
+        "state.count": 7, "position": {"x": 1, "y": 2, "z": 3}, "raised": False}))
+    assert counter_instance.state.count == 7
+    assert counter_instance.data.position.x == 1 and counter_instance.data.position.z == 3
+    assert counter_instance.data.raised is False
+    assert counter_instance.data.size.width == 400
+    assert counter_instance.touched == set()
+
+
+def test_refresh_into_dict_field(counter_instance):
+    counter_instance.refresh_data_form_update(*make_update({
+        "state.executeInfo": {"executeFunc": "reset_to_zero", "params": {}},
+        "state.executeInfo.params.value": 3}))
+    assert counter_instance.state.executeInfo.executeFunc == "reset_to_zero"
+    assert counter_instance.state.executeInfo.params == {"value": 3}
+
+    # fields written afterwards are still tracked
+    counter_instance.state.executeInfo.executeFunc = ""
+    assert counter_instance.touched == {"state.executeInfo.executeFunc"}
+
+
+def test_refresh_ignores_unknown_fields(counter_instance):
+    counter_instance.refresh_data_form_update(*make_update({"minimized": True, "state.unknown.x": 1}))
+    assert "minimized" not in counter_instance.data.__dict__
+    assert "unknown" not in counter_instance.state.__dict__
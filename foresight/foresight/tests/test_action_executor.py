@@ -0,0 +1,64 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import threading
+import time
+
+import pytest
+
+from foresight.action_executor import ActionExecutor
+
+
+@pytest.fixture()
+def executor():
+    e = ActionExecutor(max_workers=4, max_pending=100)
+    yield e
+    e.clean_up()
+
+
+def test_same_key_runs_in_order(executor):
+    results = []
+    for i in range(20):
+        executor.submit("app-1", lambda i: (time.sleep(0.001), results.append(i)), {"i": i})
+    executor.clean_up()
+    assert results == list(range(20))
+
+
+def test_different_keys_run_in_parallel(executor):
+    barrier = threading.Barrier(2, timeout=2)
+    executor.submit("app-1", barrier.wait)
+    executor.submit("app-2", barrier.wait)
+    executor.clean_up()
+    assert executor.get_metrics()["completed"] == 2
+
+
+def test_metrics_count_failures(executor):
+    def fail():
+        raise ValueError("bad action")
+    executor.submit("app-1", fail)
+    executor.submit("app-1", lambda: None)
+    executor.clean_up()
+    metrics = executor.get_metrics()
+    assert metrics["failed"] == 1
+    assert metrics["completed"] == 1
+    assert metrics["pending"] == 0
+    assert executor.queue_depth("app-1") == 0
+
+
+def test_submit_rejects_when_full():
+    executor = ActionExecutor(max_workers=1, max_pending=2)
+    release = threading.Event()
+    assert executor.submit("app-1", release.wait)
+    assert executor.submit("app-2", lambda: None)
+    # returns right away instead of blocking until a slot frees up
+    assert not executor.submit("app-3", lambda: None)
+    release.set()
+    executor.clean_up()
+    metrics = executor.get_metrics()
+    assert metrics["rejected"] == 1
+    assert metrics["completed"] == 2
@@ -0,0 +1,96 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import asyncio
+import json
+
+import pytest
+try:
+    # websockets >= 13, as in connect_websocket
+    from websockets.asyncio.server import serve
+except ImportError:
+    from websockets import serve
+
+from foresight.KernelProxyBlocking import AsyncKernelClient
+
+
+async def answer(ws, header, code):
+    # the code is the number of seconds it takes to run, so the replies come out of order
+    await asyncio.sleep(float(code) if code != "raise" else 0)
+
+    async def send(channel, msg_type, content):
+        await ws.send(json.dumps({"channel": channel, "parent_header": header, "header": {"msg_type": msg_type},
+                                  "msg_type": msg_type, "content": content}))
+
+    if code == "raise":
+        await send("shell", "execute_reply", {"status": "error", "ename": "ValueError", "evalue": "bad",
+                                              "traceback": ["line 1"]})
+    else:
+        await send("iopub", "stream", {"name": "stdout", "text": "ran "})
+        await send("iopub", "stream", {"name": "stdout", "text": code})
+        await send("shell", "execute_reply", {"status": "ok"})
+    await send("iopub", "status", {"execution_state": "idle"})
+
+
+async def run_with_kernel(test):
+    async def handler(ws):
+        async for message in ws:
+            message = json.loads(message)
+            asyncio.get_running_loop().create_task(answer(ws, message["header"], message["content"]["code"]))
+
+    async with serve(handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        async with AsyncKernelClient(token="x", base_ws=f"ws://127.0.0.1:{port}") as client:
+            return await test(client)
+
+
+def test_concurrent_executions_get_their_own_output():
+    async def test(client):
+        return await client.run_batch("k", ["0.3", "0.1", "0.2", "raise"])
+
+    outputs = asyncio.run(run_with_kernel(test))
+    assert [output.get("text") for output in outputs[:3]] == ["ran 0.3", "ran 0.1", "ran 0.2"]
+    assert outputs[3] == {"ename": "ValueError", "evalue": "bad", "traceback": ["line 1"]}
+
+
+def test_reconnects_after_the_connection_drops():
+    async def test(client):
+        first = await client.run_code("k", "0")
+        await client.websockets["k"].close()
+        await asyncio.sleep(0.1)
+        assert "k" not in client.websockets
+        return first, await client.run_code("k", "0")
+
+    assert asyncio.run(run_with_kernel(test)) == ({"text": "ran 0"}, {"text": "ran 0"})
+
+
+def test_timeout():
+    async def test(client):
+        with pytest.raises(asyncio.TimeoutError):
+            await client.run_code("k", "1", timeout=0.1)
+        assert not client.pending["k"]
+
+    asyncio.run(run_with_kernel(test))
+
+
+def test_connection_dropped_before_sending():
+    async def test(client):
+        ws = await client.connect("k")
+        await ws.close()
+        await asyncio.sleep(0.1)
+
+        async def connect(kernel_id):
+            # as if the reader dropped it right after connect returned
+            return ws
+
+        client.connect = connect
+        with pytest.raises(ConnectionError):
+            await client.run_code("k", "0")
+        assert not client.pending["k"]
+
+    asyncio.run(run_with_kernel(test))
@@ -0,0 +1,109 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import threading
+import time
+
+import pytest
+
+from foresight.celery_tasks import CeleryTaskQueue, ResultDispatcher, app
+
+
+class FakeResult:
+    def __init__(self, task_id, done=False):
+        self.id = task_id
+        self.done = done
+        self.result = f"result of {task_id}"
+
+    def ready(self):
+        return self.done
+
+    def successful(self):
+        return self.done
+
+
+class FakeTask:
+    def __init__(self, done=False):
+        self.done = done
+        self.results = []
+
+    def apply_async(self, args, task_id):
+        self.results.append(FakeResult(task_id, self.done))
+        return self.results[-1]
+
+
+def run_tasks(queue, nb_tasks, callback, done=False):
+    task = FakeTask(done)
+    queue.task_name_to_func["fake"] = task
+    for i in range(nb_tasks):
+        queue.execute_task({"task_name": "fake", "task_params": {"_id": i, "query": ""}}, callback)
+    return task.results
+
+
+class FakePubSub:
+    """stands for the connection the redis result backend publishes the results on"""
+
+    def __init__(self):
+        self.channels = {}
+
+    def subscribe(self, **channels):
+        self.channels.update(channels)
+
+    def unsubscribe(self, channel):
+        del self.channels[channel]
+
+    def run_in_thread(self, **kwargs):
+        return threading.current_thread()
+
+    def publish(self, result):
+        result.done = True
+        channel = app.backend.get_key_for_task(result.id).decode()
+        self.channels[channel]({"channel": channel.encode(), "data": b"{}"})
+
+
+@pytest.fixture()
+def pubsub(monkeypatch):
+    monkeypatch.setattr(ResultDispatcher, "_shared_state", {})
+    fake = FakePubSub()
+    dispatcher = ResultDispatcher()
+    dispatcher.pubsub = fake
+    yield fake
+    dispatcher.executor.shutdown(wait=True)
+
+
+def test_callback_latency_independent_of_pending_tasks(pubsub):
+    queue = CeleryTaskQueue()
+    received = []
+    results = run_tasks(queue, 1000, received.append)
+    assert queue.pending_tasks[0] == 1000
+
+    start = time.time()
+    pubsub.publish(results[-1])
+    queue.dispatcher.executor.submit(lambda: None).result()
+    assert received == [f"result of {results[-1].id}"]
+    assert time.time() - start < 0.5
+    assert len(pubsub.channels) == 999
+
+    for result in results[:-1]:
+        pubsub.publish(result)
+    queue.terminate()
+    assert len(received) == 1000
+    assert not pubsub.channels
+
+
+def test_task_done_before_subscription(pubsub):
+    queue = CeleryTaskQueue()
+    received = []
+    results = run_tasks(queue, 1, received.append, done=True)
+    queue.terminate()
+    assert received == [f"result of {results[0].id}"]
+    assert not pubsub.channels
+
+
+def test_dispatcher_shared_by_the_queues(pubsub):
+    assert CeleryTaskQueue().dispatcher.callbacks is CeleryTaskQueue().dispatcher.callbacks
@@ -0,0 +1,49 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# cumulative import time allowed, in microseconds as reported by -X importtime
+IMPORT_BUDGET_US = 1_000_000
+
+# only imported when a board, smartbit or task needs them
+HEAVY_MODULES = ["celery", "redis", "pandas", "numpy", "pyarrow", "networkx", "graphviz", "rectpack", "funcx"]
+
+
+def import_in_subprocess(module, cwd):
+    env = dict(os.environ)
+    env.setdefault("ENVIRONMENT", "development")
+    env.setdefault("TOKEN", "token")
+    env["PYTHONPATH"] = os.pathsep.join([str(Path(__file__).parents[2]), env.get("PYTHONPATH", "")])
+    code = f"import sys, threading, {module}; " \
+           f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules]); " \
+           f"print(threading.active_count())"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env,
+                            cwd=cwd, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    cumulative = None
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.split("|")[-1].strip() == module:
+            cumulative = int(line.split("|")[1])
+    heavy, nb_threads = result.stdout.splitlines()
+    return cumulative, heavy, int(nb_threads)
+
+
+@pytest.mark.parametrize("module", ["foresight.proxy", "foresight.Sage3Sugar.pysage3"])
+def test_import_is_light(module, tmp_path):
+    # in tmp_path since importing the proxy creates proxy.log
+    cumulative, heavy, nb_threads = import_in_subprocess(module, tmp_path)
+    assert heavy == "[]"
+    # no connection nor thread started at import
+    assert nb_threads == 1
+    assert cumulative < IMPORT_BUDGET_US, f"importing {module} took {cumulative / 1e6:.2f}s"
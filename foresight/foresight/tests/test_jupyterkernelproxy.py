@@ -72,7 +72,3 @@ def test_get_kernels(jupyter_proxy):
     assert response.status_code == 200
     assert len(response.json()) >= 1
     assert new_kernel_id in [y["id"] for y in response.json()]
-
-def test_remove_stale_tokens():
-    pass
-
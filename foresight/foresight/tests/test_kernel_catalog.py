@@ -0,0 +1,128 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import threading
+import time
+
+import pytest
+
+from foresight.jupyterkernelproxy import KernelCatalog
+
+
+def test_concurrent_callers_share_one_fetch():
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return [{"id": "k1"}], {}
+
+    catalog = KernelCatalog(fetch, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(catalog.get())) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert catalog.nb_fetches == 1
+    assert len(results) == 20 and all(result == ([{"id": "k1"}], {}) for result in results)
+
+
+def test_refreshed_after_ttl_or_invalidation():
+    values = iter(range(10))
+    catalog = KernelCatalog(lambda: next(values), ttl=0.1)
+    assert catalog.get() == 0
+    assert catalog.get() == 0
+    time.sleep(0.2)
+    assert catalog.get() == 1
+    catalog.invalidate()
+    assert catalog.get() == 2
+    assert catalog.nb_fetches == 3
+
+
+def test_invalidated_during_fetch():
+    catalog = None
+
+    def fetch():
+        # e.g. a kernel added to redis while the kernels are fetched
+        catalog.invalidate()
+        return catalog.nb_fetches
+
+    catalog = KernelCatalog(fetch, ttl=60)
+    assert catalog.get() == 0
+    assert catalog.get() == 1
+
+
+def test_failed_fetch_not_cached():
+    calls = []
+
+    def fetch():
+        calls.append(True)
+        if len(calls) == 1:
+            raise ConnectionError("jupyter is down")
+        return "kernels"
+
+    catalog = KernelCatalog(fetch, ttl=60)
+    with pytest.raises(ConnectionError):
+        catalog.get()
+    assert catalog.get() == "kernels"
+
+
+class FakeRedis:
+    def __init__(self, flags, config_delay=0):
+        self.flags = flags
+        self.config_delay = config_delay
+        self.subscribed = []
+        self.connection_pool = type("Pool", (), {"connection_kwargs": {"db": 0}})()
+
+    def config_get(self, name):
+        time.sleep(self.config_delay)
+        return {name: self.flags}
+
+    def config_set(self, name, value):
+        self.flags = value
+
+    def pubsub(self, **kwargs):
+        subscribed = self.subscribed
+        return type("PubSub", (), {"subscribe": lambda self, **channels: subscribed.extend(channels),
+                                   "run_in_thread": lambda self, **kwargs: object()})()
+
+
+@pytest.mark.parametrize("flags, expected", [("", "Kg$d"), ("Ex", "ExKg$d"), ("A", "AK"), ("KA", "KA")])
+def test_keyspace_notifications_enabled(flags, expected):
+    redis_server = FakeRedis(flags)
+    KernelCatalog(lambda: "kernels", redis_server=redis_server, key="JUPYTER:KERNELS",
+                  configure_notifications=True).get()
+    assert redis_server.flags == expected
+    assert redis_server.subscribed == ["__keyspace@0__:JUPYTER:KERNELS"]
+
+
+@pytest.mark.parametrize("flags, listening", [("", False), ("KA", True)])
+def test_keyspace_notifications_not_configured(flags, listening):
+    redis_server = FakeRedis(flags)
+    catalog = KernelCatalog(lambda: "kernels", redis_server=redis_server, key="JUPYTER:KERNELS",
+                            configure_notifications=False)
+    assert catalog.get() == "kernels"
+    # left as is, the catalog relies on the ttl if they're missing
+    assert redis_server.flags == flags
+    assert bool(redis_server.subscribed) == listening
+
+
+def test_listener_started_outside_the_lock():
+    catalog = KernelCatalog(lambda: "kernels", ttl=60, redis_server=FakeRedis("KA", config_delay=0.5),
+                            key="JUPYTER:KERNELS")
+    threading.Thread(target=catalog.get, daemon=True).start()
+    time.sleep(0.1)
+    # not waiting for the first caller's redis calls
+    start = time.time()
+    assert catalog.get() == "kernels"
+    assert time.time() - start < 0.3
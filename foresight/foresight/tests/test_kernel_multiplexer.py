@@ -0,0 +1,210 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+import pytest
+try:
+    # websockets >= 13, as in connect_websocket
+    from websockets.asyncio.server import serve
+except ImportError:
+    from websockets import serve
+
+from foresight.jupyterkernelproxy import JupyterKernelProxy, KernelConnectionPool, KernelMultiplexer
+
+
+class FakeKernel:
+    """websocket server answering each execute request with nb_outputs stream outputs"""
+
+    def __init__(self, nb_outputs, delay=0):
+        self.nb_outputs = nb_outputs
+        self.delay = delay
+        # msg_id of the execute requests, in the order received
+        self.received = []
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop)
+        self.started.wait(5)
+
+    async def handler(self, ws):
+        async for message in ws:
+            message = json.loads(message)
+            header = message["header"]
+            self.received.append(header["msg_id"])
+            await asyncio.sleep(self.delay)
+            if message["content"]["code"] == "hang":
+                continue
+            if message["content"]["code"] == "restart":
+                # the status sent by the server, not caused by a request
+                await ws.send(json.dumps({"channel": "iopub", "parent_header": {}, "header": {"msg_type": "status"},
+                                          "msg_type": "status", "content": {"execution_state": "restarting"}}))
+                continue
+            for i in range(self.nb_outputs):
+                await ws.send(json.dumps({"channel": "iopub", "parent_header": header, "header": {"msg_type": "stream"},
+                                          "msg_type": "stream", "content": {"name": "stdout", "text": str(i)}}))
+            await ws.send(json.dumps({"channel": "iopub", "parent_header": header, "header": {"msg_type": "status"},
+                                      "msg_type": "status", "content": {"execution_state": "idle"}}))
+
+    async def start(self):
+        self.server = await serve(self.handler, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+
+
+def wait_for(predicate, timeout=5):
+    end = time.time() + timeout
+    while not predicate() and time.time() < end:
+        time.sleep(0.02)
+    return predicate()
+
+
+@pytest.fixture()
+def kernel():
+    yield FakeKernel(nb_outputs=20)
+
+
+@pytest.fixture()
+def proxy(kernel):
+    j = JupyterKernelProxy(token="x", base_ws=f"ws://127.0.0.1:{kernel.port}")
+    yield j
+    j.clean_up()
+
+
+def test_slow_callback_doesnt_stall_other_kernels(proxy, monkeypatch):
+    monkeypatch.setitem(KernelMultiplexer._shared_state, "max_buffered", 2)
+    release = threading.Event()
+    slow, fast = [], []
+
+    def slow_callback(result):
+        release.wait(10)
+        slow.append(result)
+
+    slow_uuid, fast_uuid = str(uuid.uuid4()), str(uuid.uuid4())
+    proxy.execute({"uuid": slow_uuid, "kernel": "slow", "code": "", "call_fn": slow_callback})
+    proxy.execute({"uuid": fast_uuid, "kernel": "fast", "code": "", "call_fn": fast.append})
+    try:
+        assert wait_for(lambda: fast_uuid not in proxy.connections["fast"].pending_reponses)
+        assert wait_for(lambda: len(fast) == 20)
+        assert [result["stream"]["text"] for result in fast] == [str(i) for i in range(20)]
+        # the slow one keeps max_buffered outputs queued, not reading the others meanwhile
+        assert not slow
+        execution = proxy.connections["slow"].executions[slow_uuid]
+        assert execution.queue.qsize() <= 2
+    finally:
+        release.set()
+    assert wait_for(lambda: len(slow) == 20)
+    assert [result["stream"]["text"] for result in slow] == [str(i) for i in range(20)]
+    assert slow_uuid not in proxy.callback_info
+
+
+def test_send_failure_reported_to_callback(proxy):
+    proxy.base_ws = "ws://127.0.0.1:1"
+    results = []
+    exec_uuid = str(uuid.uuid4())
+    proxy.execute({"uuid": exec_uuid, "kernel": "unreachable", "code": "", "call_fn": results.append})
+    # reported once the connection has been given up on
+    proxy.connections["unreachable"].close()
+    assert wait_for(lambda: results)
+    assert results[0]["request_id"] == exec_uuid and "error" in results[0]
+
+
+def test_proxies_share_the_kernel_connection(proxy):
+    other = JupyterKernelProxy(token="x", base_ws=proxy.base_ws)
+    first, second = [], []
+    first_uuid, second_uuid = str(uuid.uuid4()), str(uuid.uuid4())
+    proxy.execute({"uuid": first_uuid, "kernel": "k", "code": "", "call_fn": first.append})
+    other.execute({"uuid": second_uuid, "kernel": "k", "code": "", "call_fn": second.append})
+    channel = proxy.connections["k"]
+    assert other.connections["k"] is channel
+    url = f"{proxy.base_ws}/api/kernels/k/channels"
+    assert KernelConnectionPool().channels[url][1] == 2
+
+    # each execution only gets its own outputs
+    assert wait_for(lambda: len(first) == 20 and len(second) == 20)
+    assert {result["request_id"] for result in first} == {uuid.UUID(first_uuid).hex}
+    assert {result["request_id"] for result in second} == {uuid.UUID(second_uuid).hex}
+
+    # cleaning up one proxy leaves the connection to the other
+    other.clean_up()
+    other.clean_up()
+    assert not channel.closed
+    third = []
+    proxy.execute({"uuid": str(uuid.uuid4()), "kernel": "k", "code": "", "call_fn": third.append})
+    assert wait_for(lambda: len(third) == 20)
+    proxy.clean_up()
+    assert channel.closed
+    assert url not in KernelConnectionPool().channels
+
+
+def test_users_take_turns_on_a_kernel(proxy, kernel):
+    kernel.delay = 0.2
+    positions, ended = {}, []
+
+    def run(user):
+        exec_uuid = str(uuid.uuid4())
+        proxy.execute({"uuid": exec_uuid, "kernel": "k", "code": "", "user": user, "call_fn": lambda _: None,
+                       "end_fn": lambda: ended.append(exec_uuid),
+                       "position_fn": lambda position: positions.setdefault(exec_uuid, []).append(position)})
+        return exec_uuid
+
+    first, second, third, cancelled = run("alice"), run("alice"), run("alice"), run("alice")
+    other = run("bob")
+    # bob's only execution runs before alice's next ones
+    assert wait_for(lambda: positions.get(other, [None])[-1] == 1)
+    assert proxy.cancel({"uuid": cancelled, "kernel": "k"})
+    assert not proxy.cancel({"uuid": first, "kernel": "k"})
+    assert wait_for(lambda: len(ended) == 5, timeout=10)
+    expected = [first, other, second, third]
+    assert kernel.received == [uuid.UUID(exec_uuid).hex for exec_uuid in expected]
+    assert positions[first] == [0]
+    assert positions[other][-1] == 0 and positions[third][-1] == 0
+    assert cancelled not in kernel.received
+
+    metrics = proxy.get_metrics()["k"]
+    assert metrics["executions"] == 4 and metrics["cancelled"] == 1 and metrics["waiting"] == 0
+    assert metrics["max_wait_time"] >= 0.4 and metrics["avg_run_time"] >= 0.2
+
+
+@pytest.mark.parametrize("code, run_timeout", [("restart", "60"), ("hang", "0.5")])
+def test_stalled_execution_ended(kernel, monkeypatch, code, run_timeout):
+    monkeypatch.setenv("JUPYTER_RUN_TIMEOUT", run_timeout)
+    proxy = JupyterKernelProxy(token="x", base_ws=f"ws://127.0.0.1:{kernel.port}")
+    stalled, queued, ended = [], [], []
+    stalled_uuid = str(uuid.uuid4())
+    try:
+        proxy.execute({"uuid": stalled_uuid, "kernel": "k", "code": code, "call_fn": stalled.append,
+                       "end_fn": lambda: ended.append(stalled_uuid)})
+        proxy.execute({"uuid": str(uuid.uuid4()), "kernel": "k", "code": "", "call_fn": queued.append})
+        # the execution queued behind it still runs
+        assert wait_for(lambda: len(queued) == 20)
+        assert ended == [stalled_uuid]
+        assert len(stalled) == 1 and "error" in stalled[0]
+    finally:
+        proxy.clean_up()
+
+
+def test_discarded_execution_keeps_the_kernel(proxy, kernel):
+    kernel.delay = 0.3
+    discarded, other = [], []
+    discarded_uuid, other_uuid = str(uuid.uuid4()), str(uuid.uuid4())
+    proxy.execute({"uuid": discarded_uuid, "kernel": "k", "code": "", "user": "alice", "call_fn": discarded.append})
+    proxy.execute({"uuid": other_uuid, "kernel": "k", "code": "", "user": "bob", "call_fn": other.append})
+    channel = proxy.connections["k"]
+    assert wait_for(lambda: channel.scheduler.running == discarded_uuid)
+    KernelMultiplexer().submit(channel.discard([discarded_uuid])).result(5)
+    # still running on the kernel, the next one waits for its idle status
+    assert channel.scheduler.running == discarded_uuid
+    assert channel.scheduler.is_waiting(other_uuid)
+    assert wait_for(lambda: len(other) == 20)
+    assert not discarded
+    assert channel.get_metrics()["executions"] == 2
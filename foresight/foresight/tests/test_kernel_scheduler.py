@@ -0,0 +1,68 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+from foresight.jupyterkernelproxy import KernelScheduler
+
+
+def run_all(scheduler):
+    order = []
+    while (request_id := scheduler.next()) is not None:
+        order.append(request_id)
+        scheduler.remove(request_id)
+    return order
+
+
+def test_users_take_turns():
+    scheduler = KernelScheduler()
+    for request_id in ["a1", "a2", "a3"]:
+        scheduler.push(request_id, "alice")
+    scheduler.push("b1", "bob")
+    scheduler.push("c1", "carol")
+    scheduler.push("b2", "bob")
+    assert scheduler.positions() == {"a1": 1, "b1": 2, "c1": 3, "a2": 4, "b2": 5, "a3": 6}
+    assert run_all(scheduler) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_one_execution_at_a_time():
+    scheduler = KernelScheduler()
+    scheduler.push("a1", "alice")
+    scheduler.push("b1", "bob")
+    assert scheduler.next() == "a1"
+    assert scheduler.next() is None
+    assert scheduler.positions() == {"b1": 1}
+    scheduler.remove("a1")
+    assert scheduler.next() == "b1"
+
+
+def test_cancel_waiting_only():
+    scheduler = KernelScheduler()
+    scheduler.push("a1", "alice")
+    scheduler.push("a2", "alice")
+    assert scheduler.next() == "a1"
+    assert not scheduler.remove("unknown")
+    assert scheduler.remove("a2")
+    assert scheduler.positions() == {}
+    assert not scheduler.remove("a1")
+    metrics = scheduler.get_metrics()
+    assert metrics["executions"] == 1 and metrics["waiting"] == 0 and not metrics["running"]
+
+
+def test_turns_of_idle_users_dropped():
+    scheduler = KernelScheduler()
+    for i in range(100):
+        scheduler.push(f"u{i}", f"user-{i}")
+        scheduler.push(f"v{i}", "vera")
+        run_all(scheduler)
+    # vera went last, the others had no more turns than her
+    assert list(scheduler.turns) == ["vera"]
+    scheduler.push("c1", "carol")
+    scheduler.push("c2", "carol")
+    scheduler.push("v1", "vera")
+    scheduler.remove("c1")
+    scheduler.remove("c2")
+    assert list(scheduler.turns) == ["vera"]
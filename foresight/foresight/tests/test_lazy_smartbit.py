@@ -0,0 +1,101 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import copy
+from types import SimpleNamespace
+
+from foresight.action_executor import ActionExecutor
+from foresight.proxy import SAGEProxy
+from foresight.smartbitfactory import LazySmartBit
+from foresight.smartbits import kerneldashboard
+from foresight.smartbits.counter import Counter
+from foresight.smartbits.tests.sample_sb_docs import counter_doc, kernel_dashboard_doc
+
+
+def make_update(count, execute_func=""):
+    doc = copy.deepcopy(counter_doc)
+    doc["data"]["state"] = doc.pop("state")
+    doc["data"]["state"]["count"] = count
+    doc["data"]["state"]["executeInfo"]["executeFunc"] = execute_func
+    return doc
+
+
+def test_not_hydrated_until_used():
+    sb = LazySmartBit(copy.deepcopy(counter_doc))
+    assert not sb.hydrated
+    assert not sb.is_generic
+    assert sb.app_id == counter_doc["_id"]
+
+    sb.refresh_data_form_update(make_update(7), {"state.count": 7})
+    assert not sb.hydrated
+    assert not sb.has_pending_action()
+    sb.clean_up()
+    assert not sb.hydrated
+
+    # built from the latest doc on first access
+    assert sb.state.count == 7
+    assert sb.hydrated
+    assert isinstance(sb.hydrate(), Counter)
+
+
+def test_pending_action():
+    sb = LazySmartBit(copy.deepcopy(counter_doc))
+    sb.refresh_data_form_update(make_update(7, "reset_to_zero"), {"state.executeInfo.executeFunc": "reset_to_zero"})
+    assert sb.has_pending_action()
+    assert sb.hydrate().state.executeInfo.executeFunc == "reset_to_zero"
+
+
+def test_unknown_type_is_generic():
+    doc = copy.deepcopy(counter_doc)
+    doc["data"]["type"] = "SomethingNew"
+    sb = LazySmartBit(doc)
+    assert sb.is_generic
+
+
+class FakeKernelProxy:
+    headers = {}
+
+    def __init__(self):
+        self.redis_server = SimpleNamespace(json=lambda: SimpleNamespace(get=lambda key: {}, set=lambda *args: None))
+
+
+class FakeTaskScheduler:
+    tasks = []
+
+    def schedule_task(self, fn, nb_secs):
+        self.tasks.append(nb_secs)
+
+
+def test_kernel_dashboard_hydrated_on_create(monkeypatch):
+    monkeypatch.setattr(kerneldashboard, "JupyterKernelProxy", FakeKernelProxy)
+    monkeypatch.setattr(kerneldashboard, "TaskScheduler", FakeTaskScheduler)
+    monkeypatch.setattr(FakeTaskScheduler, "tasks", [])
+    online = []
+    monkeypatch.setattr(kerneldashboard.KernelDashboard, "get_kernel_specs", lambda self: None)
+    monkeypatch.setattr(kerneldashboard.KernelDashboard, "set_online", lambda self: online.append(self.app_id))
+
+    doc = copy.deepcopy(kernel_dashboard_doc)
+    doc["data"]["state"] = doc.pop("state")
+    board = SimpleNamespace(smartbits={})
+    # only what creating apps needs
+    proxy = SAGEProxy.__new__(SAGEProxy)
+    proxy.executor = ActionExecutor(max_workers=1)
+    proxy.updated_at = {}
+    proxy.smartbits = {}
+    proxy.rooms = {doc["data"]["roomId"]: SimpleNamespace(boards={doc["data"]["boardId"]: board})}
+    proxy._SAGEProxy__handle_create("APPS", doc)
+    proxy.executor.clean_up()
+
+    # no action targeted it, it's online and its heartbeat is scheduled anyway
+    assert proxy.smartbits[doc["_id"]].hydrated
+    assert online == [doc["_id"]]
+    assert FakeTaskScheduler.tasks == [15]
+
+
+def test_counter_stays_lazy():
+    assert not LazySmartBit(copy.deepcopy(counter_doc)).hydrate_eagerly
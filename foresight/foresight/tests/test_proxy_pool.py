@@ -0,0 +1,85 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import asyncio
+import os
+
+from foresight.proxy_pool import ProxyPool
+from foresight.smartbits.smartbit import SmartBit
+
+
+def fake_serve_rooms(name, conn):
+    # speaks the handoff protocol of serve_rooms without a server
+    conn.send(("READY", name))
+    while True:
+        command, room_id = conn.recv()
+        if command == "STOP":
+            break
+        if room_id.startswith("crash-once:"):
+            marker = room_id.split(":", 1)[1]
+            if not os.path.exists(marker):
+                open(marker, "w").close()
+                os._exit(1)
+        conn.send(("SERVING", room_id))
+
+
+def serve_rooms_with_s3_comm(name, conn):
+    conn.send(("READY", name))
+    command, room_id = conn.recv()
+    if command == "ROOM":
+        # the state shared with the fork server is reset by the fork
+        conn.send(("SERVING", SmartBit._s3_comm.run(asyncio.sleep(0, result=room_id))))
+    conn.recv()
+
+
+def test_rooms_handed_to_ready_processes():
+    pool = ProxyPool(size=2, target=fake_serve_rooms, preload=[])
+    try:
+        pool.fill()
+        pool.offer("r1")
+        pool.offer("r2")
+        # more rooms than processes, waits for the next one started
+        pool.offer("r3")
+        assert pool.wait_serving("r1", timeout=30)
+        assert pool.wait_serving("r2", timeout=30)
+        assert pool.owner("r3") is None
+
+        name = pool.start()
+        assert pool.wait_serving("r3", timeout=30)
+        assert pool.owner("r3") == name
+        assert len({pool.owner(room_id) for room_id in ("r1", "r2", "r3")}) == 3
+
+        pool.stop(pool.owner("r1"))
+        assert pool.owner("r1") is None
+        assert len(pool.processes) == 2
+    finally:
+        pool.close()
+
+
+def test_rooms_of_dead_process_offered_again(tmp_path):
+    pool = ProxyPool(size=1, target=fake_serve_rooms, preload=[])
+    try:
+        pool.fill()
+        room_id = f"crash-once:{tmp_path / 'crashed'}"
+        pool.offer(room_id)
+        # the first process dies with the room, a new one is started for it
+        assert pool.wait_serving(room_id, timeout=30)
+        assert (tmp_path / "crashed").exists()
+    finally:
+        pool.close()
+
+
+def test_s3_comm_usable_after_fork():
+    # SmartBit._s3_comm is created by the fork server, before the process is forked
+    pool = ProxyPool(size=1, target=serve_rooms_with_s3_comm, preload=["foresight.smartbits.smartbit"])
+    try:
+        pool.fill()
+        pool.offer("r1")
+        assert pool.wait_serving("r1", timeout=30)
+    finally:
+        pool.close()
@@ -0,0 +1,87 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import json
+from collections import Counter
+
+from foresight.proxy_supervisor import ConsistentHashRing, ProxySupervisor
+
+
+class FakeProcess:
+    def __init__(self):
+        self.alive = True
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        pass
+
+
+class FakeQueue(list):
+    def put(self, item):
+        self.append(item)
+
+
+class Supervisor(ProxySupervisor):
+    def _start_worker(self, worker_id):
+        return FakeProcess(), FakeQueue()
+
+
+def test_ring_spreads_keys_and_moves_few_of_them():
+    ring = ConsistentHashRing([f"w{i}" for i in range(4)])
+    keys = [f"room-{i}" for i in range(2000)]
+    before = {key: ring.get_node(key) for key in keys}
+    assert min(Counter(before.values()).values()) > 300
+
+    ring.add_node("w4")
+    after = {key: ring.get_node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    # only rooms moving to the new worker, about a fifth of them
+    assert all(after[key] == "w4" for key in moved)
+    assert 200 < len(moved) < 600
+
+    ring.remove_node("w4")
+    assert {key: ring.get_node(key) for key in keys} == before
+
+
+def test_supervisor_assigns_and_rebalances_rooms():
+    supervisor = Supervisor(None, None, nb_workers=2)
+    for i in range(50):
+        supervisor.assign_room(f"r{i}")
+    assert sum(len(rooms) for rooms in supervisor.get_assignments().values()) == 50
+
+    owner = supervisor.assignments["r0"]
+    commands = supervisor.workers[owner][1]
+    assert ("ADD", "r0") in commands
+
+    worker_id = supervisor.add_worker()
+    moved = supervisor.get_assignments()[worker_id]
+    assert moved
+    for room_id in moved:
+        assert ("ADD", room_id) in supervisor.workers[worker_id][1]
+
+    owner = supervisor.assignments["r0"]
+    supervisor.process_messages(None, json.dumps(
+        {"id": "s", "event": {"col": "ROOMS", "type": "DELETE", "doc": [{"_id": "r0", "data": {}}]}}))
+    assert "r0" not in supervisor.assignments
+    assert supervisor.workers[owner][1][-1] == ("REMOVE", "r0")
+
+
+def test_supervisor_restarts_dead_workers():
+    supervisor = Supervisor(None, None, nb_workers=2)
+    for i in range(10):
+        supervisor.assign_room(f"r{i}")
+    worker_id, (process, _) = next(iter(supervisor.workers.items()))
+    process.alive = False
+
+    supervisor.check_workers()
+    new_process, commands = supervisor.workers[worker_id]
+    assert new_process is not process
+    assert sorted(room_id for _, room_id in commands) == supervisor.get_assignments()[worker_id]
@@ -0,0 +1,61 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import copy
+import threading
+
+import pytest
+
+from foresight.action_executor import ActionExecutor
+from foresight.proxy import SAGEProxy
+from foresight.smartbitfactory import LazySmartBit
+from foresight.smartbits.counter import Counter
+from foresight.smartbits.tests.sample_sb_docs import counter_doc
+
+
+def make_update(execute_func="", x=0):
+    doc = copy.deepcopy(counter_doc)
+    doc["data"]["state"] = doc.pop("state")
+    doc["data"]["state"]["executeInfo"]["executeFunc"] = execute_func
+    doc["data"]["position"]["x"] = x
+    return doc
+
+
+# max_pending=1: the executor is full while the action runs
+@pytest.mark.parametrize("max_pending", [None, 1])
+def test_update_during_slow_action(monkeypatch, max_pending):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_reset(self):
+        calls.append(self.data.position.x)
+        started.set()
+        release.wait(5)
+        self.state.executeInfo.executeFunc = ""
+
+    monkeypatch.setattr(Counter, "reset_to_zero", slow_reset)
+    # only what handling app updates needs
+    proxy = SAGEProxy.__new__(SAGEProxy)
+    proxy.executor = ActionExecutor(max_workers=2, max_pending=max_pending)
+    proxy.updated_at = {}
+    proxy.smartbits = {counter_doc["_id"]: LazySmartBit(copy.deepcopy(counter_doc))}
+    handle_update = proxy._SAGEProxy__handle_update
+    try:
+        handle_update("APPS", make_update("reset_to_zero"), {"state.executeInfo.executeFunc": "reset_to_zero"})
+        assert started.wait(5)
+        # moved while the action runs, the executeFunc it is about to clear is still set
+        handle_update("APPS", make_update("reset_to_zero", x=10), {"position": {"x": 10, "y": 0, "z": 0}})
+        assert proxy.smartbits[counter_doc["_id"]].data.position.x == 0
+        release.set()
+        proxy.executor.clean_up()
+        # applied after the action, which isn't run again
+        assert calls == [0]
+        assert proxy.smartbits[counter_doc["_id"]].data.position.x == 10
+    finally:
+        release.set()
+        proxy.executor.clean_up(wait=False)
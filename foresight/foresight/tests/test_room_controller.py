@@ -0,0 +1,82 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+from foresight._docker_scripts.monitor_room_activity import RoomController
+
+
+class FakeLauncher:
+    def __init__(self):
+        self.started = []
+        self.stopped = []
+
+    def start(self, name, room_id=None):
+        self.started.append(name)
+
+    def stop(self, name):
+        self.stopped.append(name)
+
+
+class FakeHandoff:
+    """rooms are taken by the proxies only when take is called"""
+
+    def __init__(self):
+        self.offered = []
+        self.owners = {}
+
+    def offer(self, room_id):
+        self.offered.append(room_id)
+
+    def take(self, name):
+        room_id = self.offered.pop(0)
+        self.owners[room_id] = name
+        return room_id
+
+    def owner(self, room_id):
+        return self.owners.get(room_id)
+
+    def release(self, room_id):
+        if room_id in self.offered:
+            self.offered.remove(room_id)
+        return self.owners.pop(room_id, None)
+
+
+def make_controller(**kwargs):
+    launcher, handoff = FakeLauncher(), FakeHandoff()
+    return RoomController(launcher, handoff=handoff, warm_pool_size=2, idle_timeout=0, **kwargs), launcher, handoff
+
+
+def test_room_released_before_taken_keeps_standby():
+    controller, launcher, handoff = make_controller()
+    controller.fill_pool()
+    controller.room_created("r1")
+    controller.room_created("r2")
+    handoff.take(launcher.started[0])
+
+    controller.room_deleted("r1")
+    assert launcher.stopped == [launcher.started[0]]
+    # r2 wasn't taken, the proxy waiting for it is in standby again
+    controller.room_deleted("r2")
+    assert launcher.stopped == [launcher.started[0]]
+    assert controller.nb_standby == 3
+
+
+def test_empty_waiting_rooms_skipped():
+    controller, launcher, handoff = make_controller(max_nb_supported_rooms=1)
+    controller.user_moved("u1", "r1")
+    controller.room_created("r1")
+    controller.room_created("r2")
+    controller.room_created("r3")
+    controller.user_moved("u3", "r3")
+    assert list(controller.waiting_rooms) == ["r2", "r3"]
+
+    controller.room_deleted("r1")
+    # nobody is in r2, the slot goes to r3
+    assert list(controller.active_rooms) == ["r3"]
+    assert not controller.waiting_rooms
+    controller.user_moved("u2", "r2")
+    assert list(controller.waiting_rooms) == ["r2"]
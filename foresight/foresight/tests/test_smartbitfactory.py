@@ -0,0 +1,63 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import copy
+
+import pytest
+
+import foresight.smartbitfactory as factory_module
+from foresight.smartbitfactory import SmartBitFactory, SchemaCheck
+from foresight.smartbits.counter import Counter
+from foresight.smartbits.genericsmartbit import GenericSmartBit
+from foresight.smartbits.tests.sample_sb_docs import counter_doc
+
+
+@pytest.fixture(autouse=True)
+def clean_registry(monkeypatch):
+    monkeypatch.setattr(SmartBitFactory, "_classes", {})
+    monkeypatch.setattr(SmartBitFactory, "_registered", dict(SmartBitFactory._registered))
+
+
+def test_class_resolved_once(monkeypatch):
+    calls = []
+    import_cls = factory_module.import_cls
+    monkeypatch.setattr(factory_module, "import_cls", lambda *args: calls.append(args) or import_cls(*args))
+
+    for _ in range(3):
+        assert isinstance(SmartBitFactory.create_smartbit(copy.deepcopy(counter_doc)), Counter)
+    assert sorted(calls) == [("foresight.smartbits.counter", "Counter"),
+                             ("foresight.smartbits.genericsmartbit", "GenericSmartBit")]
+
+
+def test_registered_class_wins():
+    @SmartBitFactory.register("Counter")
+    class MyCounter(Counter):
+        pass
+
+    assert SmartBitFactory.has_class("Counter")
+    assert type(SmartBitFactory.create_smartbit(copy.deepcopy(counter_doc))) is MyCounter
+
+
+def test_incompatible_doc_skips_the_class(monkeypatch):
+    doc = copy.deepcopy(counter_doc)
+    del doc["state"]["count"]
+    assert SchemaCheck.for_class(Counter).missing(doc) == "state.count"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Counter shouldn't be built")
+
+    monkeypatch.setattr(Counter, "__init__", fail)
+    smartbit = SmartBitFactory.create_smartbit(doc)
+    assert type(smartbit) is GenericSmartBit
+
+
+def test_unknown_type_is_generic():
+    doc = copy.deepcopy(counter_doc)
+    doc["data"]["type"] = "NotASmartBit"
+    assert not SmartBitFactory.has_class("NotASmartBit")
+    assert type(SmartBitFactory.create_smartbit(doc)) is GenericSmartBit
@@ -0,0 +1,148 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import os
+import tempfile
+import threading
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CellOutput:
+    """
+    Coalesces the outputs of one execution of a cell before they are sent to the server.
+
+    The text of consecutive stream messages (print...) is buffered and sent as a single
+    stream message holding only the text received since the previous one:
+     - flush_interval seconds after the first text buffered (SAGECELL_FLUSH_INTERVAL env.
+       variable, 0.25 by default)
+     - as soon as flush_size characters are buffered (SAGECELL_FLUSH_SIZE, 8192 by default)
+     - before any other output (execute_result, display_data, error), which is sent right away
+    At most max_output characters of stream text are sent per execution (SAGECELL_MAX_OUTPUT,
+    1000000 by default). The text that follows is written to a temporary file handed to
+    spill_fn(filename, file) once the execution is over, if any, and dropped otherwise.
+    """
+
+    def __init__(self, request_id, send_fn, spill_fn=None, flush_interval=None, flush_size=None,
+                 max_output=None):
+        """
+        :param send_fn: called with each message to send, in order
+        :param spill_fn: saves the text past max_output, e.g. as an asset of the room
+        """
+        if flush_interval is None:
+            flush_interval = float(os.getenv("SAGECELL_FLUSH_INTERVAL", 0.25))
+        if flush_size is None:
+            flush_size = int(os.getenv("SAGECELL_FLUSH_SIZE", 8192))
+        if max_output is None:
+            max_output = int(os.getenv("SAGECELL_MAX_OUTPUT", 1_000_000))
+        self.request_id = request_id
+        self.send_fn = send_fn
+        self.spill_fn = spill_fn
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_output = max_output
+        self.nb_received = 0
+        self.nb_sent = 0
+        # stream text sent so far, and past max_output
+        self.output_size = 0
+        self.spilled_size = 0
+
+        # [name, text] of the streams buffered, consecutive text of a stream merged
+        self.__pending = []
+        self.__pending_size = 0
+        self.__spill = None
+        self.__timer = None
+        self.__closed = False
+        # held while sending so the messages reach the server in order
+        self.__lock = threading.RLock()
+
+    def add(self, msg):
+        """
+        :param msg: output of the execution, as handed by JupyterKernelProxy to its callback
+        """
+        with self.__lock:
+            self.nb_received += 1
+            if "stream" not in msg:
+                self.flush()
+                self.__send(msg)
+                return
+            name, text = msg["stream"].get("name", "stdout"), msg["stream"].get("text", "")
+            self.request_id = msg.get("request_id", self.request_id)
+            room = self.max_output - self.output_size - self.__pending_size
+            if room < len(text):
+                self.__spill_text(text[max(room, 0):])
+                text = text[:max(room, 0)]
+            if not text:
+                return
+            if self.__pending and self.__pending[-1][0] == name:
+                self.__pending[-1][1] += text
+            else:
+                self.__pending.append([name, text])
+            self.__pending_size += len(text)
+            if self.__pending_size >= self.flush_size:
+                self.flush()
+            elif self.__timer is None and not self.__closed:
+                self.__timer = threading.Timer(self.flush_interval, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def flush(self):
+        """
+        Sends the stream text buffered, if any
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            pending, self.__pending = self.__pending, []
+            self.output_size += self.__pending_size
+            self.__pending_size = 0
+            for name, text in pending:
+                self.__send({"request_id": self.request_id, "stream": {"name": name, "text": text}})
+
+    def close(self):
+        """
+        Flushes what is buffered and hands the text past max_output to spill_fn
+        """
+        with self.__lock:
+            self.__closed = True
+            self.flush()
+            if self.__spill is None:
+                return
+            spill, self.__spill = self.__spill, None
+        filename = f"output-{self.request_id}.txt"
+        notice = f"\n[output truncated after {self.max_output} characters, {self.spilled_size} more "
+        try:
+            if self.spill_fn is None:
+                notice += "dropped]\n"
+            else:
+                spill.seek(0)
+                self.spill_fn(filename, spill)
+                notice += f"saved in {filename}]\n"
+        except Exception as e:
+            logger.error(f"Couldn't save the output of execution {self.request_id}. \n{e}")
+            notice += "dropped]\n"
+        finally:
+            spill.close()
+        with self.__lock:
+            self.__send({"request_id": self.request_id, "stream": {"name": "stderr", "text": notice}})
+
+    def __spill_text(self, text):
+        if self.__spill is None:
+            self.__spill = tempfile.TemporaryFile(mode="w+b")
+        self.__spill.write(text.encode("utf-8"))
+        self.spilled_size += len(text)
+
+    def __send(self, msg):
+        self.nb_sent += 1
+        try:
+            self.send_fn(msg)
+        except Exception as e:
+            logger.error(f"Couldn't send the output of execution {self.request_id}. \n{e}")
@@ -55,6 +55,25 @@ def create_dict(path, val, data={}):
     return data
 
 
+def group_updates_by_id(all_updates):
+    """
+    indexes the updates of a batched UPDATE message by document id in a single pass
+    so that each doc of the message can find its updates in constant time.
+
+    [{"id": "a", "updates": {...}}, {"id": "b", "updates": {...}}]
+    -> {"a": {...}, "b": {...}}
+
+    if the same id appears more than once, the first updates win.
+    :param all_updates: list of {id, updates} dicts as found in event.updates
+    :return: dict mapping ids to their updates
+    """
+    grouped = {}
+    for u in all_updates:
+        if u["id"] not in grouped:
+            grouped[u["id"]] = u["updates"]
+    return grouped
+
+
 def say_hi(first_name=None, last_name=None):
     if first_name is None:
         first_name = "John"
@@ -0,0 +1,204 @@
+# -----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+# -----------------------------------------------------------------------------
+
+import json
+import re
+
+_WHITESPACE = " \t\n\r"
+# characters that can end the value being scanned, outside and inside strings
+_STRUCTURE = re.compile(r'[\[\]{}"]')
+_STRING_END = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]}\s]')
+
+
+class JsonArrayStream:
+    """
+    Incremental decoder for the items of the array stored under `key` in a top-level
+    JSON object, such as the `data` array of the {"success": ..., "data": [...]} bodies
+    returned by the SAGE3 API.
+
+    Text is fed in chunks as it arrives and complete items are returned as soon as they
+    are decoded, so only one item (plus the undecoded tail of the last chunk) is held in
+    memory at a time. Items not matching `predicate` are dropped right after decoding.
+
+    Each chunk is scanned once for the end of the value it belongs to (bracket and string
+    nesting is tracked across chunks). The chunks of a value are joined and decoded only
+    once it is complete, so a large item received in many chunks is not decoded again
+    for each of them.
+
+    stream = JsonArrayStream("data", predicate=lambda doc: doc["data"]["roomId"] == room_id)
+    for chunk in chunks:
+        for doc in stream.feed(chunk):
+            ...
+    stream.close()
+    """
+
+    def __init__(self, key="data", predicate=None):
+        self.key = key
+        self.predicate = predicate
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ""
+        self.__pos = 0
+        # chunks received after __buffer while the value at __pos is incomplete
+        self.__chunks = []
+        # expect_object -> expect_key -> expect_colon -> (skip_value | expect_array)
+        # -> expect_item -> after_item -> ... -> done
+        self.__state = "expect_object"
+        self.__current_key = None
+        self.__eof = False
+        # scan of the value at __pos: None when not started, True once it is complete
+        self.__scanning = None
+        self.__depth = 0
+        self.__in_string = False
+        self.__escape = False
+        self.__scalar = False
+
+    def feed(self, text):
+        """
+        :param text: the next chunk of the body
+        :return: list of the items completed by this chunk
+        """
+        if self.__scanning is False:
+            self.__chunks.append(text)
+            if not self.__scan(text, 0):
+                return []
+            self.__scanning = True
+        self.__join(text)
+        return self.__parse()
+
+    def close(self):
+        """
+        Signals the end of the body and returns the last items, if any
+        """
+        self.__eof = True
+        self.__join()
+        items = self.__parse()
+        if self.__state != "done":
+            raise ValueError(f"Incomplete JSON body, no complete `{self.key}` array found")
+        return items
+
+    def __skip_whitespace(self):
+        buffer = self.__buffer
+        pos = self.__pos
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        self.__pos = pos
+        return pos < len(buffer)
+
+    def __join(self, text=""):
+        if self.__chunks:
+            text = "".join(self.__chunks)
+            self.__chunks = []
+        self.__buffer = self.__buffer[self.__pos:] + text
+        self.__pos = 0
+
+    def __scan(self, text, pos):
+        """scans text from pos for the end of the value at the current position, True once found"""
+        if self.__escape:
+            if pos >= len(text):
+                return False
+            self.__escape = False
+            pos += 1
+        while True:
+            if self.__scalar:
+                # a number might continue in the next chunk
+                return _SCALAR_END.search(text, pos) is not None
+            if self.__in_string:
+                match = _STRING_END.search(text, pos)
+                if match is None:
+                    return False
+                pos = match.end()
+                if match.group() == "\\":
+                    if pos >= len(text):
+                        self.__escape = True
+                        return False
+                    pos += 1
+                    continue
+                self.__in_string = False
+                if self.__depth == 0:
+                    return True
+                continue
+            match = _STRUCTURE.search(text, pos)
+            if match is None:
+                return False
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.__in_string = True
+            elif char in "[{":
+                self.__depth += 1
+            else:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    return True
+
+    def __decode(self):
+        """decodes the value at the current position, None if more text is needed"""
+        if self.__scanning is None:
+            char = self.__buffer[self.__pos]
+            self.__depth = 0
+            self.__in_string = self.__escape = False
+            self.__scalar = char not in '"[{'
+            self.__scanning = self.__scan(self.__buffer, self.__pos)
+        if not self.__scanning and not self.__eof:
+            return None
+        self.__scanning = None
+        value, end = self.__decoder.raw_decode(self.__buffer, self.__pos)
+        self.__pos = end
+        return (value,)
+
+    def __expect(self, char):
+        if self.__buffer[self.__pos] != char:
+            raise ValueError(f"Expected `{char}` at {self.__pos} but found `{self.__buffer[self.__pos]}`")
+        self.__pos += 1
+
+    def __parse(self):
+        items = []
+        while self.__state != "done" and self.__skip_whitespace():
+            state = self.__state
+            if state == "expect_object":
+                self.__expect("{")
+                self.__state = "expect_key"
+            elif state == "expect_key":
+                if self.__buffer[self.__pos] == ",":
+                    self.__pos += 1
+                    continue
+                if self.__buffer[self.__pos] == "}":
+                    raise ValueError(f"No `{self.key}` array found in the JSON body")
+                decoded = self.__decode()
+                if decoded is None:
+                    break
+                self.__current_key = decoded[0]
+                self.__state = "expect_colon"
+            elif state == "expect_colon":
+                self.__expect(":")
+                self.__state = "expect_array" if self.__current_key == self.key else "skip_value"
+            elif state == "skip_value":
+                if self.__decode() is None:
+                    break
+                self.__state = "expect_key"
+            elif state == "expect_array":
+                self.__expect("[")
+                self.__state = "expect_item"
+            elif state in ("expect_item", "after_item"):
+                char = self.__buffer[self.__pos]
+                if char == "]":
+                    self.__pos += 1
+                    self.__state = "done"
+                    continue
+                if state == "after_item":
+                    self.__expect(",")
+                    self.__state = "expect_item"
+                    continue
+                decoded = self.__decode()
+                if decoded is None:
+                    break
+                if self.predicate is None or self.predicate(decoded[0]):
+                    items.append(decoded[0])
+                self.__state = "after_item"
+        return items
@@ -1,7 +1,3 @@
-from rectpack import newPacker
-import rectpack.packer
-import networkx as nx
-import graphviz
 import json
 
 
@@ -16,6 +12,9 @@ class Layout:
 
     def graphviz_layout(self,  top_gutter=None, left_gutter=None,):
 
+        # imported here, it isn't needed to load a board
+        import graphviz
+
         self._layout = []
 
         g = graphviz.Graph()
@@ -55,6 +54,8 @@ class Layout:
 
 
     def fdp_graphviz_layout(self, app_to_type, top_gutter=None, left_gutter=None,):
+        import graphviz
+
         self._layout = []
 
         g = graphviz.Graph()
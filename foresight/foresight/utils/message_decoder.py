@@ -0,0 +1,124 @@
+# -----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+# -----------------------------------------------------------------------------
+
+import json
+import os
+from typing import List
+
+from foresight.utils.generic_utils import group_updates_by_id
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+if msgspec is not None:
+    class _Event(msgspec.Struct):
+        col: str
+        type: str
+        doc: List[dict]
+        updates: List[dict] = []
+
+    class _Message(msgspec.Struct):
+        event: _Event
+        id: str = ""
+
+
+def available_decoders():
+    """names of the JSON decoders that can be used, fastest first"""
+    decoders = []
+    if orjson is not None:
+        decoders.append("orjson")
+    if msgspec is not None:
+        decoders.append("msgspec")
+    decoders.append("json")
+    return decoders
+
+
+class DocEvent:
+    """
+    One doc of a websocket event: the collection, the event type, the doc and, for
+    UPDATE events, the updates of this doc. It points to the doc and updates of the
+    decoded message, nothing is copied.
+    """
+    __slots__ = ("col", "type", "doc", "updates")
+
+    def __init__(self, col, type, doc, updates=None):
+        self.col = col
+        self.type = type
+        self.doc = doc
+        self.updates = updates
+
+    def __repr__(self):
+        return f"DocEvent(col={self.col!r}, type={self.type!r}, doc={self.doc!r}, updates={self.updates!r})"
+
+
+class MessageDecoder:
+    """
+    Decodes the messages received on the websocket into one DocEvent per doc:
+    {id, event: {col, type, doc: [...], updates: [{id, updates}, ...]}}
+
+    The decoder is the fastest installed (orjson, msgspec, then the json module) unless
+    chosen with `name` or the SAGE3_JSON_DECODER env. variable. msgspec decodes the
+    envelope to typed structs directly; messages that don't have the expected shape
+    are decoded as plain JSON.
+    """
+
+    def __init__(self, name=None):
+        if name is None:
+            name = os.getenv("SAGE3_JSON_DECODER")
+        decoders = available_decoders()
+        if name is None:
+            name = decoders[0]
+        elif name not in decoders:
+            logger.warning(f"JSON decoder {name} is not installed, using {decoders[0]}")
+            name = decoders[0]
+        self.name = name
+        self.__typed_decoder = msgspec.json.Decoder(_Message) if name == "msgspec" else None
+        if name == "msgspec":
+            self.loads = msgspec.json.decode
+        elif name == "orjson":
+            self.loads = orjson.loads
+        else:
+            self.loads = json.loads
+
+    def decode(self, raw):
+        """
+        :param raw: message as received on the websocket, str or bytes
+        :return: list of DocEvent
+        """
+        if self.__typed_decoder is not None:
+            try:
+                event = self.__typed_decoder.decode(raw).event
+                return self.__doc_events(event.col, event.type, event.doc, event.updates)
+            except msgspec.ValidationError:
+                pass
+        event = self.loads(raw)["event"]
+        docs = event["doc"]
+        if isinstance(docs, dict):
+            docs = [docs]
+        return self.__doc_events(event["col"], event["type"], docs, event.get("updates"))
+
+    @staticmethod
+    def __doc_events(col, type, docs, updates):
+        if type == "UPDATE":
+            # all updates for this message [{id: string, updates: {}}, {id:string, updates: {}}...]
+            # indexed once by id instead of scanned for every doc
+            updates_by_id = group_updates_by_id(updates or [])
+            return [DocEvent(col, type, doc, updates_by_id.get(doc["_id"], {})) for doc in docs]
+        return [DocEvent(col, type, doc) for doc in docs]
@@ -0,0 +1,101 @@
+# -----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+# -----------------------------------------------------------------------------
+
+import time
+
+import redis
+
+from foresight.config import config as conf, prod_type
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RoomHandoff:
+    """
+    Hands rooms to standby proxies through redis. The controller pushes the room id
+    on a list; the first standby proxy blocked on the list takes it and records itself
+    as the owner of the room, so the controller knows which proxy to stop later.
+
+    A room offered has an empty owner until it is claimed. Claiming and releasing are
+    atomic (lua scripts), so a room released while a proxy is popping it is either
+    returned to the controller with its owner, or dropped by the proxy.
+    """
+    queue_key = "PROXY:HANDOFF"
+    owners_key = "PROXY:ROOMS"
+
+    # KEYS: owners_key, ARGV: room_id, proxy_name
+    claim_script = """
+    if redis.call('hget', KEYS[1], ARGV[1]) == '' then
+        redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    # KEYS: owners_key, queue_key, ARGV: room_id
+    release_script = """
+    redis.call('lrem', KEYS[2], 0, ARGV[1])
+    local owner = redis.call('hget', KEYS[1], ARGV[1])
+    redis.call('hdel', KEYS[1], ARGV[1])
+    return owner
+    """
+
+    def __init__(self, redis_server=None):
+        if redis_server is None:
+            redis_server = redis.StrictRedis(host=conf[prod_type]["redis_server"], port=6379, db=0)
+        self.redis_server = redis_server
+        self.__claim = redis_server.register_script(self.claim_script)
+        self.__release = redis_server.register_script(self.release_script)
+
+    def offer(self, room_id):
+        """
+        Controller side: makes room_id available to the next standby proxy
+        """
+        pipe = self.redis_server.pipeline()
+        pipe.hset(self.owners_key, room_id, "")
+        pipe.rpush(self.queue_key, room_id)
+        pipe.execute()
+
+    def take(self, proxy_name, timeout=0):
+        """
+        Proxy side: blocks until a room is offered
+        :param proxy_name: name the controller uses to stop the proxy
+        :param timeout: seconds to wait, 0 waits forever
+        :return: the room id, None after timeout
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return None
+            item = self.redis_server.blpop(self.queue_key, timeout=timeout)
+            if item is None:
+                return None
+            room_id = item[1].decode()
+            if self.__claim(keys=[self.owners_key], args=[room_id, proxy_name]):
+                logger.info(f"{proxy_name} took room {room_id}")
+                return room_id
+            # released after being popped, waits for the next one
+            logger.info(f"{proxy_name} dropped room {room_id}, released meanwhile")
+
+    def owner(self, room_id):
+        """
+        :return: name of the proxy serving room_id, None if it wasn't taken
+        """
+        name = self.redis_server.hget(self.owners_key, room_id)
+        return name.decode() if name else None
+
+    def release(self, room_id):
+        """
+        Forgets room_id, whether it was taken or is still waiting for a proxy
+        :return: name of the proxy that was serving room_id, None if it wasn't taken
+        """
+        name = self.__release(keys=[self.owners_key, self.queue_key], args=[room_id])
+        return name.decode() if name else None
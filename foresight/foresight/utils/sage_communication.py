@@ -6,16 +6,56 @@
 #  the file LICENSE, distributed as part of this software.
 # -----------------------------------------------------------------------------
 
+import asyncio
+import threading
 import uuid
 import httpx
 import os
 
+from foresight.utils.json_stream import JsonArrayStream
 # from utils.sage_websocket import SageWebsocket
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# TODO: laod this from config file
+ROUTES = {
+    "get_rooms": "/api/rooms/",
+    "get_apps": "/api/apps/",
+    "get_app": "/api/apps/{}",
+    "get_boards": "/api/boards/",
+    "get_tags": "/api/insight/",
+    "get_tag": "/api/insight/{}",
+    "send_update": "/api/apps/{}",
+    "delete_app": "/api/apps/{}",
+    "send_batch_update": "/api/apps/",
+    "create_app": "/api/apps/",
+    "get_assets": "/api/assets/",
+    "get_asset": "/api/assets/{}",
+    "upload_file": "/api/assets/upload",
+    "get_time": "/api/time",
+    "get_configuration": "/api/configuration",
+}
+
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# routes that need something else than the default timeout
+ROUTE_TIMEOUTS = {
+    "get_rooms": httpx.Timeout(60.0, connect=5.0),
+    "get_apps": httpx.Timeout(60.0, connect=5.0),
+    "get_boards": httpx.Timeout(60.0, connect=5.0),
+    "get_assets": httpx.Timeout(60.0, connect=5.0),
+    "get_asset": httpx.Timeout(60.0, connect=5.0),
+    "get_app": httpx.Timeout(60.0, connect=5.0),
+    "upload_file": httpx.Timeout(None, connect=5.0),
+    "get_time": httpx.Timeout(5.0),
+}
+
+# methods that are safe to send again when the first attempt failed
+IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
 
 class Borg:
     _shared_state = {}
@@ -24,180 +64,297 @@ class Borg:
         self.__dict__ = self._shared_state
 
 
-class SageCommunication(Borg):
-    # The borg pattern allows us to init the config in the proxy and not have to worry about
-    # passing it in the smartbits, i.e. no need to pass it in the smartbis!
+def _reset_after_fork():
+    # the event loop thread of the parent doesn't exist in a forked child (see
+    # ProxyPool) and its connections are shared with the parent. The state is rebuilt
+    # in the same dict since the instances created before the fork share it, e.g.
+    # SmartBit._s3_comm, the first request made in the child starts a new loop
+    state = Borg._shared_state
+    if "async_comm" not in state:
+        return
+    web_config = state["async_comm"].web_config
+    state["_loop"] = None
+    state["loop_thread"] = None
+    state["_loop_lock"] = threading.Lock()
+    state["async_comm"] = AsyncSageCommunication(state["conf"], state["prod_type"])
+    state["async_comm"].web_config = web_config
+    state["routes"] = state["async_comm"].routes
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
-    def __init__(self, conf, prod_type):
-        Borg.__init__(self)
 
+class AsyncSageCommunication:
+    """
+    asyncio client for the SAGE3 REST API. Requests from many callers share a pool of
+    keep-alive connections and can be in flight at the same time.
+
+    Every request uses the timeout configured for its route in ROUTE_TIMEOUTS. GET, PUT
+    and DELETE requests failing with a transport error or a 502/503/504 are retried
+    max_retries times with an exponential backoff.
+
+    HTTP/2 is used when http2 is True (or the SAGE3_HTTP2 env. variable is set) and the
+    h2 package is installed.
+    """
+
+    def __init__(self, conf, prod_type, max_connections=20, max_keepalive_connections=10,
+                 http2=None, max_retries=3, backoff=0.25):
         self.conf = conf
         self.prod_type = prod_type
         if conf is None:
             raise Exception("confifuration not found")
         self.__headers = {"Authorization": f"Bearer {os.getenv('TOKEN')}"}
-        self.httpx_client = httpx.Client(timeout=None)
-
-        # TODO: laod this from config file
-        self.routes = {
-            "get_rooms": "/api/rooms/",
-            "get_apps": "/api/apps/",
-            "get_boards": "/api/boards/",
-            "get_tags": "/api/insight/",
-            "get_tag": "/api/insight/{}",
-            "send_update": "/api/apps/{}",
-            "delete_app": "/api/apps/{}",
-            "send_batch_update": "/api/apps/",
-            "create_app": "/api/apps/",
-            "get_assets": "/api/assets/",
-            "upload_file": "/api/assets/upload",
-            "get_time": "/api/time",
-            "get_configuration": "/api/configuration",
-        }
-        self.web_config = self.get_configuration()
+        self.routes = ROUTES
+        self.max_retries = max_retries
+        self.backoff = backoff
 
-    def send_app_update(self, app_id, data):
+        if http2 is None:
+            http2 = bool(os.getenv("SAGE3_HTTP2"))
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 is not installed, falling back to HTTP/1.1")
+                http2 = False
+
+        self.httpx_client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections),
+            http2=http2,
+        )
+        self.web_config = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.httpx_client.aclose()
+
+    async def request(self, method, route_name, *route_args, **kwargs):
         """
-        :param app_id:
-        :param data: data
-        :return:
+        Sends a request to the route named route_name in ROUTES
+        :param method: http method
+        :param route_name: key in ROUTES
+        :param route_args: values used to format the route, such as the app id
+        :param kwargs: passed to httpx (json, params, files, ...)
+        :return: the httpx.Response
         """
-        # print(logging.getLogger().handlers)
-        logger.debug(f"sending following update: {data}")
-        r = self.httpx_client.put(
-            self.conf[self.prod_type]["web_server"]
-            + self.routes["send_update"].format(app_id),
-            headers=self.__headers,
-            json=data,
-        )
-        # TODO temp fix for this: https://github.com/ipython/ipython/issues/13904
-        #  I assume it's an issue with the logging library since we're logging from a thread
-        #  will need to replace the print with a better solution
-        return r
+        url = self.conf[self.prod_type]["web_server"] + self.routes[route_name].format(*route_args)
+        timeout = ROUTE_TIMEOUTS.get(route_name, DEFAULT_TIMEOUT)
+        retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
 
-    def send_app_batch_update(self, data):
+        for attempt in range(retries + 1):
+            try:
+                r = await self.httpx_client.request(method, url, headers=self.__headers,
+                                                    timeout=timeout, **kwargs)
+                if r.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                    return r
+                logger.warning(f"{method} {url} returned {r.status_code}, retrying")
+            except httpx.TransportError as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"{method} {url} failed with {e!r}, retrying")
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def stream_docs(self, route_name, *route_args, predicate=None, params=None):
         """
-        :param app_id:
-        :param data: data
-        :return:
+        Async generator over the docs of a collection route. The body is decoded as it is
+        received and the docs not matching predicate are dropped right away, so the full
+        collection is never held in memory.
+        :param route_name: key in ROUTES
+        :param predicate: function taking a doc and returning whether to keep it
+        :param params: query parameters
         """
-        # print(logging.getLogger().handlers)
-        logger.debug(f"sending following update: {data}")
-        route = (
-            self.conf[self.prod_type]["web_server"] + self.routes["send_batch_update"]
-        )
-        r = self.httpx_client.put(route, headers=self.__headers, json=data)
-        # TODO temp fix for this: https://github.com/ipython/ipython/issues/13904
-        #  I assume it's an issue with the logging library since we're logging from a thread
-        #  will need to replace the print with a better solution
-        return r
+        url = self.conf[self.prod_type]["web_server"] + self.routes[route_name].format(*route_args)
+        timeout = ROUTE_TIMEOUTS.get(route_name, DEFAULT_TIMEOUT)
+        async with self.httpx_client.stream("GET", url, headers=self.__headers, params=params,
+                                            timeout=timeout) as r:
+            r.raise_for_status()
+            stream = JsonArrayStream("data", predicate=predicate)
+            async for chunk in r.aiter_text():
+                for doc in stream.feed(chunk):
+                    yield doc
+            for doc in stream.close():
+                yield doc
 
-    def create_app(self, data):
+    async def get_filtered(self, route_name, field, value, predicate):
         """
-        :return:
+        Gets the docs of a collection whose data.<field> is value. The server filters the
+        docs when it has an index on field. Otherwise, the whole collection is streamed
+        and filtered locally with predicate.
         """
-        r = self.httpx_client.post(
-            self.conf[self.prod_type]["web_server"] + self.routes["create_app"],
-            headers=self.__headers,
-            json=data,
-        )
-        return r
+        r = await self.request("GET", route_name, params={field: value})
+        if r.is_success:
+            return r.json()["data"]
+        logger.debug(f"server side filter on {field} failed for {route_name}, filtering locally")
+        return [doc async for doc in self.stream_docs(route_name, predicate=predicate)]
 
-    def upload_file(self, files, payload):
+    async def stream_filtered(self, route_name, field, value, predicate):
         """
-        :return:
+        Streaming version of get_filtered
         """
-        r = self.httpx_client.post(
-            self.conf[self.prod_type]["web_server"] + self.routes["upload_file"],
-            headers=self.__headers,
-            files=files,
-            data=payload,
-        )
-        return r
+        try:
+            async for doc in self.stream_docs(route_name, params={field: value}):
+                yield doc
+            return
+        except httpx.HTTPStatusError:
+            logger.debug(f"server side filter on {field} failed for {route_name}, filtering locally")
+        async for doc in self.stream_docs(route_name, predicate=predicate):
+            yield doc
 
-    def get_alltags(self):
+    async def stream_room_trees(self, emit, max_concurrent_rooms=4, room_ids=None, board_id=None):
         """
-        :return:
+        Fetches the rooms and, for several rooms at a time, their boards and apps. Calls
+        emit(collection, doc) for each doc in an order where parents always come before
+        their children (room, then its boards, then its apps), followed by
+        emit("READY", room_id) once everything in the room was emitted.
+        :param emit: coroutine function called with (collection, doc)
+        :param max_concurrent_rooms: number of rooms fetched at the same time
+        :param room_ids: only fetch these rooms
+        :param board_id: only fetch this board, its room and its apps
         """
-        r = self.httpx_client.get(
-            self.conf[self.prod_type]["web_server"] + self.routes["get_tags"],
-            headers=self.__headers,
-        )
-        return r
+        semaphore = asyncio.Semaphore(max_concurrent_rooms)
 
-    def get_tags(self, app_id):
+        if board_id is not None and room_ids is None:
+            board = next((b for b in await self.get_boards() if b["_id"] == board_id), None)
+            if board is None:
+                logger.error(f"Board {board_id} not found")
+                return
+            room_ids = [board["data"]["roomId"]]
+
+        async def get_boards(room_id):
+            boards = await self.get_boards(room_id)
+            if board_id is not None:
+                boards = [board for board in boards if board["_id"] == board_id]
+            return boards
+
+        def stream_apps(room_id):
+            if board_id is not None:
+                return self.stream_filtered("get_apps", "boardId", board_id,
+                                            lambda app: app["data"]["boardId"] == board_id)
+            return self.stream_filtered("get_apps", "roomId", room_id,
+                                        lambda app: app["data"]["roomId"] == room_id)
+
+        async def stream_room(room):
+            async with semaphore:
+                room_id = room["_id"]
+                await emit("ROOMS", room)
+                # boards and apps are fetched at the same time, the apps are only emitted
+                # after the boards they belong to
+                boards = asyncio.ensure_future(get_boards(room_id))
+                boards_emitted = False
+                try:
+                    async for app in stream_apps(room_id):
+                        if not boards_emitted:
+                            for board in await boards:
+                                await emit("BOARDS", board)
+                            boards_emitted = True
+                        await emit("APPS", app)
+                    if not boards_emitted:
+                        for board in await boards:
+                            await emit("BOARDS", board)
+                finally:
+                    boards.cancel()
+                await emit("READY", room_id)
+
+        rooms = await self.get_rooms()
+        if room_ids is not None:
+            room_ids = set(room_ids)
+            rooms = [room for room in rooms if room["_id"] in room_ids]
+        await asyncio.gather(*[stream_room(room) for room in rooms])
+
+    async def send_app_update(self, app_id, data):
         """
+        :param app_id:
+        :param data: data
         :return:
         """
-        r = self.httpx_client.get(
-            self.conf[self.prod_type]["web_server"]
-            + self.routes["get_tag"].format(app_id),
-            headers=self.__headers,
-        )
-        return r
+        logger.debug(f"sending following update: {data}")
+        return await self.request("PUT", "send_update", app_id, json=data)
 
-    def update_tags(self, app_id, data):
+    async def send_app_batch_update(self, data):
         """
+        :param data: list of updates, one per app: [{"id": app_id, "updates": {...}}, ...]
         :return:
         """
-        r = self.httpx_client.put(
-            self.conf[self.prod_type]["web_server"]
-            + self.routes["get_tag"].format(app_id),
-            headers=self.__headers,
-            json=data,
-        )
-        return r
+        logger.debug(f"sending following update: {data}")
+        return await self.request("PUT", "send_batch_update", json={"batch": data})
 
-    def delete_app(self, app_id):
-        r = self.httpx_client.delete(
-            self.conf[self.prod_type]["web_server"]
-            + self.routes["delete_app"].format(app_id),
-            headers=self.__headers,
-        )
-        return r
+    async def create_app(self, data):
+        return await self.request("POST", "create_app", json=data)
 
-    def get_asset(self, asset_id, room_id=None, board_id=None):
-        asset = self.get_assets(room_id, board_id, asset_id)
+    async def upload_file(self, files, payload):
+        return await self.request("POST", "upload_file", files=files, data=payload)
+
+    async def get_alltags(self):
+        return await self.request("GET", "get_tags")
+
+    async def get_tags(self, app_id):
+        return await self.request("GET", "get_tag", app_id)
+
+    async def update_tags(self, app_id, data):
+        return await self.request("PUT", "get_tag", app_id, json=data)
+
+    async def delete_app(self, app_id):
+        return await self.request("DELETE", "delete_app", app_id)
+
+    async def get_asset(self, asset_id, room_id=None, board_id=None):
+        asset = await self.get_assets(room_id, board_id, asset_id)
         if asset:
             return asset[0]
 
-    def get_configuration(self):
-        r = self.httpx_client.get(
-            self.conf[self.prod_type]["web_server"] + self.routes["get_configuration"],
-            headers=self.__headers,
-        )
+    async def get_configuration(self):
+        r = await self.request("GET", "get_configuration")
         json_data = r.json()
+        self.web_config = json_data
         return json_data
 
-    def format_public_url(self, asset_id):
+    async def format_public_url(self, asset_id):
+        if self.web_config is None:
+            await self.get_configuration()
         web_server = self.conf[self.prod_type]["web_server"]
         sage3_namespace = uuid.UUID(self.web_config["namespace"])
         token = uuid.uuid5(sage3_namespace, asset_id)
         public_url = f"{web_server}/api/files/{asset_id}/{token}"
         return public_url
 
-    def get_assets(self, room_id=None, board_id=None, asset_id=None):
-        url = self.conf[self.prod_type]["web_server"] + self.routes["get_assets"]
+    async def get_assets(self, room_id=None, board_id=None, asset_id=None):
         if asset_id:
-            url += asset_id
-        r = self.httpx_client.get(url, headers=self.__headers)
-        json_data = r.json()
-        data = json_data["data"]
-        if r.is_success:
-            if room_id is not None:
-                data = [app for app in data if app["data"]["roomId"] == room_id]
-            if board_id is not None:
-                data = [app for app in data if app["data"]["boardId"] == board_id]
-        return data
+            r = await self.request("GET", "get_asset", asset_id)
+            data = r.json()["data"] if r.is_success else []
+            return [asset for asset in data if self.__matches(asset, room_id, board_id, "room")]
+        # assets can't be queried by room on the server
+        try:
+            return [asset async for asset in self.stream_docs(
+                "get_assets", predicate=lambda asset: self.__matches(asset, room_id, board_id, "room"))]
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Couldn't get the assets. \n{e}")
+            return []
 
-    def get_app(self, app_id=None, room_id=None, board_id=None):
-        apps = self.get_apps(room_id, board_id, app_id)
-        if apps:
-            return apps[0]
-        else:
+    @staticmethod
+    def __matches(doc, room_id, board_id, room_field="roomId"):
+        if room_id is not None and doc["data"].get(room_field) != room_id:
+            return False
+        if board_id is not None and doc["data"].get("boardId") != board_id:
+            return False
+        return True
+
+    async def get_app(self, app_id=None, room_id=None, board_id=None):
+        if app_id is None:
+            apps = await self.get_apps(room_id, board_id)
+            return apps[0] if apps else None
+        r = await self.request("GET", "get_app", app_id)
+        if not r.is_success:
             return None
+        apps = [app for app in r.json()["data"] if self.__matches(app, room_id, board_id)]
+        return apps[0] if apps else None
 
-    def get_apps(self, room_id=None, board_id=None, app_id=None):
+    async def get_apps(self, room_id=None, board_id=None, app_id=None):
         """
         list all the rerouces belonging to room_id
         :param room_id: the id of the room to list
@@ -205,42 +362,38 @@ class SageCommunication(Borg):
         :param board_id:
         :return: dict representing the
         """
-        url = self.conf[self.prod_type]["web_server"] + self.routes["get_apps"]
         if app_id is not None:
-            url += app_id
-        r = self.httpx_client.get(url, headers=self.__headers)
-        json_data = r.json()
-        logger.debug(f"received apps info: {json_data}")
-        data = json_data["data"]
-        if r.is_success:
-            if room_id is not None:
-                data = [app for app in data if app["data"]["roomId"] == room_id]
-            if board_id is not None:
-                data = [app for app in data if app["data"]["boardId"] == board_id]
+            app = await self.get_app(app_id, room_id, board_id)
+            return [app] if app is not None else []
 
-        return data
+        def predicate(app):
+            return self.__matches(app, room_id, board_id)
 
-    def get_rooms(self):
-        r = self.httpx_client.get(
-            self.conf[self.prod_type]["web_server"] + self.routes["get_rooms"],
-            headers=self.__headers,
-        )
+        # the server supports one query parameter, the board is the most selective
+        if board_id is not None:
+            data = await self.get_filtered("get_apps", "boardId", board_id, predicate)
+        elif room_id is not None:
+            data = await self.get_filtered("get_apps", "roomId", room_id, predicate)
+        else:
+            r = await self.request("GET", "get_apps")
+            data = r.json()["data"] if r.is_success else []
+        logger.debug(f"received apps info: {data}")
+        return [app for app in data if predicate(app)]
+
+    async def get_rooms(self):
+        r = await self.request("GET", "get_rooms")
         json_data = r.json()
-        # print(json_data)
         data = {}
         if r.is_success:
             data = json_data["data"]
         return data
 
-    def get_time(self):
-        r = self.httpx_client.get(
-            self.conf[self.prod_type]["web_server"] + self.routes["get_time"],
-            headers=self.__headers,
-        )
+    async def get_time(self):
+        r = await self.request("GET", "get_time")
         json_data = r.json()
         return json_data
 
-    def get_boards(self, room_id=None):
+    async def get_boards(self, room_id=None):
         """
         list all the resources belonging to room_id
         :param room_id: the id of the room to list
@@ -248,14 +401,173 @@ class SageCommunication(Borg):
         :param board_id:
         :return: dict representing the
         """
-        r = self.httpx_client.get(
-            self.conf[self.prod_type]["web_server"] + self.routes["get_boards"],
-            headers=self.__headers,
-        )
-        json_data = r.json()
-        data = json_data["data"]
-        if r.is_success:
-            if room_id is not None:
-                data = [app for app in data if app["data"]["roomId"] == room_id]
+        if room_id is not None:
+            return await self.get_filtered("get_boards", "roomId", room_id,
+                                           lambda board: board["data"]["roomId"] == room_id)
+        r = await self.request("GET", "get_boards")
+        return r.json()["data"] if r.is_success else []
 
-        return data
+
+class SageCommunication(Borg):
+    # The borg pattern allows us to init the config in the proxy and not have to worry about
+    # passing it in the smartbits, i.e. no need to pass it in the smartbis!
+    """
+    Blocking facade over AsyncSageCommunication. All the instances share one
+    AsyncSageCommunication running on a background event loop, so requests made
+    from different threads (proxy, action workers, kernel callbacks) overlap on the
+    same connection pool instead of serializing.
+    """
+
+    def __init__(self, conf, prod_type):
+        Borg.__init__(self)
+
+        self.conf = conf
+        self.prod_type = prod_type
+        if conf is None:
+            raise Exception("confifuration not found")
+
+        if getattr(self, "async_comm", None) is None:
+            # nothing is started nor requested until the first request, so creating an
+            # instance (e.g. when importing smartbit.py) is cheap
+            self._loop = None
+            self.loop_thread = None
+            self._loop_lock = threading.Lock()
+            self.async_comm = AsyncSageCommunication(conf, prod_type)
+            self.routes = self.async_comm.routes
+
+    @property
+    def loop(self):
+        """event loop running the requests, started by the first request"""
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self.loop_thread = threading.Thread(target=loop.run_forever,
+                                                        name="sage-communication", daemon=True)
+                    self.loop_thread.start()
+                    self._loop = loop
+        return self._loop
+
+    @property
+    def web_config(self):
+        """configuration of the server, fetched by the first access"""
+        if self.async_comm.web_config is None:
+            self.get_configuration()
+        return self.async_comm.web_config
+
+    def run(self, coro):
+        """
+        Runs coro on the shared event loop and waits for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def stream_existing(self, max_queued=1000, room_ids=None, board_id=None):
+        """
+        Generator over all the rooms, boards and apps on the server, as (collection, doc)
+        tuples. Docs are yielded while the rest is still being fetched and decoded, with
+        parents before children and ("READY", room_id) after the last doc of each room.
+        :param max_queued: number of docs fetched ahead of the consumer
+        :param room_ids: only yield these rooms, their boards and apps
+        :param board_id: only yield this board, its room and its apps
+        """
+        docs = asyncio.Queue()
+        # taken by each doc queued, given back when the consumer takes it
+        slots = asyncio.Semaphore(max_queued)
+        done = object()
+
+        async def emit(collection, doc):
+            # waits on the event loop, without blocking it, when the consumer falls behind
+            await slots.acquire()
+            docs.put_nowait((collection, doc))
+
+        async def fetch():
+            try:
+                await self.async_comm.stream_room_trees(emit, room_ids=room_ids, board_id=board_id)
+            finally:
+                docs.put_nowait(done)
+
+        async def take():
+            # all the docs queued so far, in one hop to the event loop
+            items = [await docs.get()]
+            while not docs.empty():
+                items.append(docs.get_nowait())
+            for _ in items:
+                slots.release()
+            return items
+
+        future = asyncio.run_coroutine_threadsafe(fetch(), self.loop)
+        try:
+            while True:
+                items = self.run(take())
+                finished = items[-1] is done
+                for item in (items[:-1] if finished else items):
+                    yield item
+                if finished:
+                    break
+        finally:
+            future.cancel()
+        # raises the exception that stopped the fetch, if any
+        future.result()
+
+    def send_app_update(self, app_id, data):
+        """
+        :param app_id:
+        :param data: data
+        :return:
+        """
+        # TODO temp fix for this: https://github.com/ipython/ipython/issues/13904
+        #  I assume it's an issue with the logging library since we're logging from a thread
+        #  will need to replace the print with a better solution
+        return self.run(self.async_comm.send_app_update(app_id, data))
+
+    def send_app_batch_update(self, data):
+        """
+        :param data: list of updates, one per app: [{"id": app_id, "updates": {...}}, ...]
+        :return:
+        """
+        return self.run(self.async_comm.send_app_batch_update(data))
+
+    def create_app(self, data):
+        return self.run(self.async_comm.create_app(data))
+
+    def upload_file(self, files, payload):
+        return self.run(self.async_comm.upload_file(files, payload))
+
+    def get_alltags(self):
+        return self.run(self.async_comm.get_alltags())
+
+    def get_tags(self, app_id):
+        return self.run(self.async_comm.get_tags(app_id))
+
+    def update_tags(self, app_id, data):
+        return self.run(self.async_comm.update_tags(app_id, data))
+
+    def delete_app(self, app_id):
+        return self.run(self.async_comm.delete_app(app_id))
+
+    def get_asset(self, asset_id, room_id=None, board_id=None):
+        return self.run(self.async_comm.get_asset(asset_id, room_id, board_id))
+
+    def get_configuration(self):
+        return self.run(self.async_comm.get_configuration())
+
+    def format_public_url(self, asset_id):
+        return self.run(self.async_comm.format_public_url(asset_id))
+
+    def get_assets(self, room_id=None, board_id=None, asset_id=None):
+        return self.run(self.async_comm.get_assets(room_id, board_id, asset_id))
+
+    def get_app(self, app_id=None, room_id=None, board_id=None):
+        return self.run(self.async_comm.get_app(app_id, room_id, board_id))
+
+    def get_apps(self, room_id=None, board_id=None, app_id=None):
+        return self.run(self.async_comm.get_apps(room_id, board_id, app_id))
+
+    def get_rooms(self):
+        return self.run(self.async_comm.get_rooms())
+
+    def get_time(self):
+        return self.run(self.async_comm.get_time())
+
+    def get_boards(self, room_id=None):
+        return self.run(self.async_comm.get_boards(room_id))
@@ -6,59 +6,99 @@
 #  the file LICENSE, distributed as part of this software.
 # -----------------------------------------------------------------------------
 from foresight.config import config as conf, prod_type
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
+import asyncio
 import os
-import websocket
+import random
 import threading
 import json
 import uuid
 import time
-import sys
+
+try:
+    # websockets >= 13
+    from websockets.asyncio.client import connect as _ws_connect
+    _HEADERS_KWARG = "additional_headers"
+except ImportError:
+    from websockets import connect as _ws_connect
+    _HEADERS_KWARG = "extra_headers"
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def connect_websocket(uri, headers=None, **kwargs):
+    """
+    websockets.connect accepting the headers whatever the version of websockets
+    """
+    if headers:
+        kwargs[_HEADERS_KWARG] = headers
+    return _ws_connect(uri, **kwargs)
+
+
 class SageWebsocket:
-    def __init__(self, on_message_fn: Callable = None):
-        self.connected = False
-        self.ws = websocket.WebSocketApp(
-            conf[prod_type]["ws_server"] + "/api",
-            header={"Authorization": "Bearer " + os.getenv("TOKEN")},
-            on_message=lambda ws, msg: self.on_message(ws, msg),
-            on_error=lambda ws, msg: self.on_error(ws, msg),
-            # on_close=lambda ws: self.on_close(ws),
-            on_open=lambda ws: self.on_open(ws),
-        )
+    """
+    Websocket connection to the SAGE3 server, run by an asyncio event loop on a daemon
+    thread.
 
-        self.wst = None
+    The connection is re-established whenever it drops, waiting backoff seconds before
+    the first attempt and doubling the wait after each failure, up to max_backoff. The
+    routes passed to subscribe are subscribed again on every new connection, then
+    on_reconnect_fn, if any, is called so the missed events can be recovered (see
+    SAGEProxy.resync).
 
-        self.received_msg_log = {}
-        self.queue_list = {}
-        self.run()
+    Messages are handed to on_message_fn(ws, message) one at a time, in order, on a
+    separate thread so a slow handler doesn't keep the connection from answering pings.
+    """
+
+    def __init__(self, on_message_fn: Callable = None, on_reconnect_fn: Callable = None,
+                 backoff=0.5, max_backoff=30, ping_interval=20, url=None):
+        self.connected = False
+        self.url = url if url is not None else conf[prod_type]["ws_server"] + "/api"
+        self.headers = {"Authorization": "Bearer " + os.getenv("TOKEN")}
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ping_interval = ping_interval
+        self.on_reconnect = on_reconnect_fn
         if on_message_fn is not None:
             self.on_message = on_message_fn
 
-    # def subscribe(self, route):
-    #     return self.socket.setup_sub_queue(route)
+        self.ws = None
+        self.routes = []
+        # id of the current subscription to each route, needed to unsubscribe
+        self.subscription_ids = {}
+        self.received_msg_log = {}
+        self.queue_list = {}
+        self.metrics = {
+            "connects": 0,
+            "reconnects": 0,
+            "disconnects": 0,
+            "failed_attempts": 0,
+            "messages_received": 0,
+            "last_connected_at": None,
+            "last_disconnected_at": None,
+            "last_message_at": None,
+            "last_error": None,
+        }
+
+        self.__closing = False
+        self.__connected_event = threading.Event()
+        # single thread so the messages are handled in the order they were received
+        self.__dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sage-websocket-dispatch")
+        self.__loop = asyncio.new_event_loop()
+        self.wst = None
+        self.__task = None
+        self.run()
 
     def on_open(self, ws):
         logger.debug("Websocket connected")
-        self.connected = True
 
     def on_message(self, ws, message):
         logger.warning(
             f"received message in default func on_message {message}, WRANIGN---not doing anything"
         )
-        # msg = json.loads(message)
-        # sub_id = msg['id']
-        # if self.queue_list[sub_id]:
-        #     # Put into proper queue
-        #     self.queue_list[sub_id].put(msg)
-        #     # Add to message log
-        #     self.received_msg_log[msg['id']] = (
-        #         msg['event']['type'], msg['event']['doc']['_updatedAt'])
 
     def on_error(self, ws, error):
         logger.error(f"error in webserver websocket connection {error}")
@@ -66,48 +106,152 @@ class SageWebsocket:
     # Check if the ws has connected
     # attempts (number of times to attempt) 2 attempt per second default 10
     def check_connection(self, attempts=10):
-        if self.connected == True:
+        if self.connected:
             return True
-        count = 0
-        while self.connected == False:
-            logger.info("Websocket still not connected")
-            count = count + 1
-            if count > attempts:
-                logger.error(
-                    "Could not establish a connection to the server after {attempts} attempts"
-                )
-                return False
-            time.sleep(0.05)
+        if not self.__connected_event.wait(attempts * 0.5):
+            logger.error(f"Could not establish a connection to the server after {attempts} attempts")
+            return False
         return True
 
     # Subscribe to a route
     def subscribe(self, routes):
+        """
+        Subscribes to the routes now if connected, and again after every reconnection
+        :param routes: list of routes, e.g. ['/api/apps', '/api/rooms']
+        """
         logger.debug(f"Subscribing to {routes}")
+        future = asyncio.run_coroutine_threadsafe(self.__subscribe(routes), self.__loop)
+        try:
+            future.result()
+        except Exception as e:
+            # the connection dropped, the routes are subscribed when it is back
+            logger.warning(f"Couldn't subscribe to {routes} yet. \n{e}")
         if not self.check_connection():
-            return
+            logger.warning(f"Websocket not connected yet, {routes} will be subscribed once it is")
+
+    def unsubscribe(self, routes):
+        """
+        Unsubscribes from the routes and stops subscribing to them after reconnections
+        :param routes: list of routes passed to subscribe
+        """
+        logger.debug(f"Unsubscribing from {routes}")
+        future = asyncio.run_coroutine_threadsafe(self.__unsubscribe(routes), self.__loop)
+        try:
+            future.result()
+        except Exception as e:
+            # the connection dropped, the routes won't be subscribed again when it is back
+            logger.warning(f"Couldn't unsubscribe from {routes}. \n{e}")
+
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        metrics["connected"] = self.connected
+        metrics["subscriptions"] = list(self.routes)
+        if metrics["last_message_at"] is not None:
+            metrics["seconds_since_last_message"] = time.time() - metrics["last_message_at"]
+        return metrics
+
+    async def __subscribe(self, routes):
+        # runs on the loop so a route is never sent twice, or missed, while connecting
+        routes = [route for route in routes if route not in self.routes]
+        self.routes.extend(routes)
+        if self.connected:
+            await self.__send_subscriptions(routes)
+
+    async def __unsubscribe(self, routes):
+        for route in routes:
+            if route not in self.routes:
+                continue
+            self.routes.remove(route)
+            subscription_id = self.subscription_ids.pop(route, None)
+            if self.connected and subscription_id is not None:
+                msg_unsub = {"route": route, "id": subscription_id, "method": "UNSUB"}
+                await self.ws.send(json.dumps(msg_unsub))
 
-        # WS Message
+    async def __send_subscriptions(self, routes):
         for route in routes:
             # # Generate id for subscription
             subscription_id = str(uuid.uuid4())
+            self.subscription_ids[route] = subscription_id
             msg_sub = {"route": route, "id": subscription_id, "method": "SUB"}
-            self.ws.send(json.dumps(msg_sub))
+            await self.ws.send(json.dumps(msg_sub))
+
+    async def __connect_forever(self):
+        loop = asyncio.get_running_loop()
+        delay = self.backoff
+        while not self.__closing:
+            try:
+                async with connect_websocket(self.url, self.headers, ping_interval=self.ping_interval) as ws:
+                    self.ws = ws
+                    reconnected = self.metrics["connects"] > 0
+                    self.metrics["connects"] += 1
+                    self.metrics["last_connected_at"] = time.time()
+                    delay = self.backoff
+                    self.connected = True
+                    # routes added while these are sent are sent by __subscribe
+                    await self.__send_subscriptions(list(self.routes))
+                    self.__connected_event.set()
+                    self.on_open(ws)
+                    if reconnected:
+                        self.metrics["reconnects"] += 1
+                        logger.info(f"Websocket reconnected, resubscribed to {self.routes}")
+                        if self.on_reconnect is not None:
+                            # queued with the messages so it runs before the ones that follow
+                            loop.run_in_executor(self.__dispatcher, self.__call_safely, self.on_reconnect)
+                    async for message in ws:
+                        self.metrics["messages_received"] += 1
+                        self.metrics["last_message_at"] = time.time()
+                        await loop.run_in_executor(self.__dispatcher, self.__call_safely, self.on_message, self,
+                                                   message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self.__closing:
+                    self.metrics["last_error"] = repr(e)
+                    self.on_error(self.ws, e)
+                if not self.connected:
+                    self.metrics["failed_attempts"] += 1
+            finally:
+                if self.connected:
+                    self.metrics["disconnects"] += 1
+                    self.metrics["last_disconnected_at"] = time.time()
+                self.connected = False
+                self.__connected_event.clear()
+
+            if self.__closing:
+                break
+            # jitter so the proxies don't all come back at the same time
+            wait = delay * (0.5 + random.random() / 2)
+            logger.warning(f"Websocket disconnected, reconnecting in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.max_backoff)
+
+    @staticmethod
+    def __call_safely(func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Error handling websocket message in {func}. \n{e}")
 
     def run(self):
-        self.wst = threading.Thread(target=self.ws.run_forever)
-        self.wst.daemon = True
+        self.wst = threading.Thread(target=self.__loop.run_forever, name="sage-websocket", daemon=True)
         self.wst.start()
+        self.__task = asyncio.run_coroutine_threadsafe(self.__connect_forever(), self.__loop)
 
     def clean_up(self):
-        self.ws.close()
-        # try to jon thread
-        nb_tries = 3
-        for _ in range(nb_tries):
-            if self.wst.is_alive():
-                time.sleep(0.2)
-            else:
-                self.wst.join()
-                break
-        else:
+        self.__closing = True
+
+        async def close():
+            if self.ws is not None:
+                await self.ws.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close(), self.__loop).result(timeout=5)
+            self.__task.result(timeout=5)
+        except Exception as e:
+            logger.debug(f"websocket closed with {e}")
+            self.__task.cancel()
+        self.__dispatcher.shutdown(wait=True)
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.wst.join(timeout=5)
+        if self.wst.is_alive():
             logger.error("Couldn't cleanly terminate the websocket")
-            sys.exit(1)
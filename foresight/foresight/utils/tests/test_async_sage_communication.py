@@ -0,0 +1,174 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import asyncio
+
+import httpx
+import pytest
+
+from foresight.utils.sage_communication import AsyncSageCommunication, SageCommunication
+
+test_conf = {"test": {"web_server": "http://sage3.test"}}
+
+
+def make_client(handler):
+    comm = AsyncSageCommunication(test_conf, "test", backoff=0)
+    comm.httpx_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return comm
+
+
+def test_get_retried_on_unavailable():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) < 3:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"epoch": 42})
+
+    comm = make_client(handler)
+    assert asyncio.run(comm.get_time()) == {"epoch": 42}
+    assert len(calls) == 3
+
+
+def test_post_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("down", request=request)
+
+    comm = make_client(handler)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(comm.create_app({"type": "Stickie"}))
+    assert len(calls) == 1
+
+
+def test_batch_update_body():
+    bodies = []
+
+    def handler(request):
+        bodies.append(request.read())
+        return httpx.Response(200, json={"success": True})
+
+    comm = make_client(handler)
+    asyncio.run(comm.send_app_batch_update([{"id": "a", "updates": {"raised": True}}]))
+    assert bodies == [b'{"batch": [{"id": "a", "updates": {"raised": true}}]}']
+
+
+def test_get_apps_filtered_on_server():
+    queries = []
+
+    def handler(request):
+        queries.append(dict(request.url.params))
+        return httpx.Response(200, json={"success": True, "data": [
+            {"_id": "a", "data": {"roomId": "r1", "boardId": "b1"}}]})
+
+    comm = make_client(handler)
+    apps = asyncio.run(comm.get_apps(room_id="r1", board_id="b1"))
+    assert [app["_id"] for app in apps] == ["a"]
+    assert queries == [{"boardId": "b1"}]
+
+
+def test_get_apps_filtered_locally_when_query_fails():
+    docs = [{"_id": str(i), "data": {"roomId": f"r{i % 3}", "boardId": "b"}} for i in range(30)]
+
+    def handler(request):
+        if request.url.params:
+            return httpx.Response(500, json={"success": False})
+        return httpx.Response(200, json={"success": True, "data": docs})
+
+    comm = make_client(handler)
+    apps = asyncio.run(comm.get_apps(room_id="r1"))
+    assert apps == [doc for doc in docs if doc["data"]["roomId"] == "r1"]
+
+
+def test_stream_room_trees_emits_parents_first():
+    rooms = [{"_id": f"r{i}", "data": {}} for i in range(3)]
+    boards = [{"_id": f"b{i}", "data": {"roomId": f"r{i % 3}"}} for i in range(6)]
+    apps = [{"_id": f"a{i}", "data": {"roomId": f"r{i % 3}", "boardId": f"b{i % 6}"}} for i in range(12)]
+
+    def handler(request):
+        collection = {"/api/rooms": rooms, "/api/boards": boards, "/api/apps": apps}[request.url.path.rstrip("/")]
+        room_id = request.url.params.get("roomId")
+        docs = [doc for doc in collection if room_id is None or doc["data"]["roomId"] == room_id]
+        return httpx.Response(200, json={"success": True, "data": docs})
+
+    emitted = []
+
+    async def emit(collection, doc):
+        emitted.append((collection, doc if collection == "READY" else doc["_id"]))
+
+    comm = make_client(handler)
+    asyncio.run(comm.stream_room_trees(emit, max_concurrent_rooms=2))
+
+    assert len(emitted) == len(rooms) + len(boards) + len(apps) + len(rooms)
+    seen = set()
+    for collection, value in emitted:
+        if collection == "BOARDS":
+            assert boards[int(value[1:])]["data"]["roomId"] in seen
+        elif collection == "APPS":
+            app = apps[int(value[1:])]
+            assert app["data"]["boardId"] in seen and ("READY", app["data"]["roomId"]) not in seen
+        seen.add(value if collection != "READY" else (collection, value))
+
+
+def test_stream_room_trees_scoped_to_board():
+    rooms = [{"_id": f"r{i}", "data": {}} for i in range(3)]
+    boards = [{"_id": f"b{i}", "data": {"roomId": f"r{i % 3}"}} for i in range(6)]
+    apps = [{"_id": f"a{i}", "data": {"roomId": f"r{i % 3}", "boardId": f"b{i % 6}"}} for i in range(12)]
+    queries = []
+
+    def handler(request):
+        collection = {"/api/rooms": rooms, "/api/boards": boards, "/api/apps": apps}[request.url.path.rstrip("/")]
+        queries.append((request.url.path, dict(request.url.params)))
+        docs = [doc for doc in collection
+                if all(doc["data"].get(field) == value for field, value in request.url.params.items())]
+        return httpx.Response(200, json={"success": True, "data": docs})
+
+    emitted = []
+
+    async def emit(collection, doc):
+        emitted.append((collection, doc if collection == "READY" else doc["_id"]))
+
+    comm = make_client(handler)
+    asyncio.run(comm.stream_room_trees(emit, board_id="b4"))
+    assert emitted == [("ROOMS", "r1"), ("BOARDS", "b4"), ("APPS", "a4"), ("APPS", "a10"), ("READY", "r1")]
+    assert ("/api/apps/", {"boardId": "b4"}) in queries
+
+
+def test_stream_existing_bounded(monkeypatch):
+    queued = []
+
+    async def stream_room_trees(emit, room_ids=None, board_id=None):
+        for i in range(200):
+            await emit("APPS", {"_id": f"a{i}"})
+            queued.append(i)
+
+    comm = SageCommunication(test_conf, "test")
+    monkeypatch.setattr(comm.async_comm, "stream_room_trees", stream_room_trees)
+    consumed = []
+    for collection, doc in comm.stream_existing(max_queued=10):
+        # docs are fetched ahead of the consumer, but not all of them
+        assert len(queued) - len(consumed) <= 2 * 10
+        consumed.append(doc["_id"])
+    assert consumed == [f"a{i}" for i in range(200)]
+
+
+def test_stream_existing_raises(monkeypatch):
+    async def stream_room_trees(emit, room_ids=None, board_id=None):
+        await emit("ROOMS", {"_id": "r0"})
+        raise httpx.ConnectError("down")
+
+    comm = SageCommunication(test_conf, "test")
+    monkeypatch.setattr(comm.async_comm, "stream_room_trees", stream_room_trees)
+    consumed = []
+    with pytest.raises(httpx.ConnectError):
+        for item in comm.stream_existing():
+            consumed.append(item)
+    assert consumed == [("ROOMS", {"_id": "r0"})]
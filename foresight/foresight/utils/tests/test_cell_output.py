@@ -0,0 +1,62 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import time
+
+from foresight.utils.cell_output import CellOutput
+
+
+def stream(text, name="stdout"):
+    return {"request_id": "r1", "stream": {"name": name, "text": text}}
+
+
+def test_stream_coalesced_in_deltas():
+    sent = []
+    output = CellOutput("r1", sent.append, flush_interval=60, flush_size=100)
+    for i in range(10000):
+        output.add(stream(f"{i % 10}\n"))
+    output.close()
+    assert output.nb_received == 10000
+    # 20000 characters sent 100 at a time
+    assert len(sent) == 200
+    assert "".join(msg["stream"]["text"] for msg in sent) == "".join(f"{i % 10}\n" for i in range(10000))
+
+
+def test_other_outputs_keep_their_order():
+    sent = []
+    output = CellOutput("r1", sent.append, flush_interval=60)
+    output.add(stream("a"))
+    output.add(stream("b", "stderr"))
+    output.add({"request_id": "r1", "execute_result": {"data": {"text/plain": "3"}}})
+    output.add(stream("c"))
+    output.close()
+    assert sent == [stream("a"), stream("b", "stderr"),
+                    {"request_id": "r1", "execute_result": {"data": {"text/plain": "3"}}}, stream("c")]
+
+
+def test_flushed_after_interval():
+    sent = []
+    output = CellOutput("r1", sent.append, flush_interval=0.05)
+    output.add(stream("a"))
+    output.add(stream("b"))
+    assert not sent
+    time.sleep(0.5)
+    assert sent == [stream("ab")]
+
+
+def test_output_past_the_cap_spilled():
+    sent, spilled = [], {}
+    output = CellOutput("r1", sent.append, spill_fn=lambda name, f: spilled.update({name: f.read()}),
+                        flush_interval=60, max_output=5)
+    output.add(stream("0123"))
+    output.add(stream("4567"))
+    output.add(stream("89"))
+    output.close()
+    assert sent[0] == stream("01234")
+    assert "5 more saved in output-r1.txt" in sent[1]["stream"]["text"]
+    assert spilled == {"output-r1.txt": b"56789"}
@@ -0,0 +1,22 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+from foresight.utils.generic_utils import group_updates_by_id
+
+
+def test_group_updates_by_id():
+    all_updates = [{"id": "a", "updates": {"state.count": 1}},
+                   {"id": "b", "updates": {"position": {"x": 1}}}]
+    grouped = group_updates_by_id(all_updates)
+    assert grouped == {"a": {"state.count": 1}, "b": {"position": {"x": 1}}}
+
+
+def test_group_updates_by_id_keeps_first():
+    all_updates = [{"id": "a", "updates": {"state.count": 1}},
+                   {"id": "a", "updates": {"state.count": 2}}]
+    assert group_updates_by_id(all_updates)["a"] == {"state.count": 1}
@@ -0,0 +1,57 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import json
+
+import pytest
+
+from foresight.utils.json_stream import JsonArrayStream
+
+docs = [{"_id": str(i), "data": {"roomId": f"r{i % 3}", "text": "a, ] } \"quoted\"", "x": i * 1.5}}
+        for i in range(50)]
+body = json.dumps({"success": True, "message": "data", "count": 1234, "data": docs, "after": [1]})
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(body)])
+def test_items_decoded_across_chunks(chunk_size):
+    stream = JsonArrayStream("data")
+    items = []
+    for i in range(0, len(body), chunk_size):
+        items += stream.feed(body[i:i + chunk_size])
+    items += stream.close()
+    assert items == docs
+
+
+def test_predicate_drops_items():
+    stream = JsonArrayStream("data", predicate=lambda doc: doc["data"]["roomId"] == "r1")
+    items = stream.feed(body) + stream.close()
+    assert items == [doc for doc in docs if doc["data"]["roomId"] == "r1"]
+
+
+def test_missing_array():
+    stream = JsonArrayStream("data")
+    with pytest.raises(ValueError):
+        stream.feed('{"success": false, "message": "failed"}')
+        stream.close()
+
+
+def test_large_item_decoded_once():
+    item = {"_id": "big", "data": {"text": "\\\"[{" * 10000, "list": list(range(5000))}}
+    text = json.dumps({"data": [item]})
+    stream = JsonArrayStream("data")
+    decoder = stream._JsonArrayStream__decoder
+    decoded = []
+    stream._JsonArrayStream__decoder = type("Decoder", (), {
+        "raw_decode": lambda self, s, idx: decoded.append(idx) or decoder.raw_decode(s, idx)})()
+    items = []
+    for i in range(0, len(text), 16):
+        items += stream.feed(text[i:i + 16])
+    items += stream.close()
+    assert items == [item]
+    # the key and the item, not once per chunk
+    assert len(decoded) == 2
@@ -0,0 +1,39 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import json
+
+import pytest
+
+from foresight.utils.message_decoder import MessageDecoder, available_decoders
+
+docs = [{"_id": f"a{i}", "data": {"roomId": "r", "boardId": "b", "state": {"count": i}}} for i in range(3)]
+update_msg = json.dumps({"id": "sub", "event": {
+    "col": "APPS", "type": "UPDATE", "doc": docs,
+    "updates": [{"id": "a2", "updates": {"state.count": 2}}, {"id": "a0", "updates": {"state.count": 0}}]}})
+
+
+@pytest.mark.parametrize("name", available_decoders())
+def test_one_event_per_doc(name):
+    events = MessageDecoder(name).decode(update_msg)
+    assert [(e.col, e.type, e.doc["_id"]) for e in events] == [("APPS", "UPDATE", f"a{i}") for i in range(3)]
+    assert [e.updates for e in events] == [{"state.count": 0}, {}, {"state.count": 2}]
+    assert [e.doc for e in events] == docs
+
+
+@pytest.mark.parametrize("name", available_decoders())
+def test_create_and_single_doc(name):
+    events = MessageDecoder(name).decode(json.dumps({"id": "sub", "event": {
+        "col": "ROOMS", "type": "CREATE", "doc": {"_id": "r", "data": {}}}}))
+    assert len(events) == 1
+    assert events[0].doc == {"_id": "r", "data": {}}
+    assert events[0].updates is None
+
+
+def test_unknown_decoder_falls_back():
+    assert MessageDecoder("not-a-decoder").name == available_decoders()[0]
@@ -0,0 +1,75 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+try:
+    # websockets >= 13, as in connect_websocket
+    from websockets.asyncio.server import serve
+except ImportError:
+    from websockets import serve
+
+from foresight.utils.sage_websocket import SageWebsocket
+
+
+class Server:
+    """websocket server dropping each connection after sending one message"""
+
+    def __init__(self):
+        self.subscriptions = []
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop)
+        self.started.wait(5)
+
+    async def handler(self, ws):
+        sub = json.loads(await ws.recv())
+        self.subscriptions.append(sub["route"])
+        await ws.send(json.dumps({"id": sub["id"], "event": {"nb": len(self.subscriptions)}}))
+        await asyncio.sleep(0.1)
+
+    async def start(self):
+        self.server = await serve(self.handler, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+
+
+def wait_for(predicate, timeout=5):
+    end = time.time() + timeout
+    while not predicate() and time.time() < end:
+        time.sleep(0.02)
+    return predicate()
+
+
+@pytest.fixture()
+def server():
+    yield Server()
+
+
+def test_reconnects_and_resubscribes(server, monkeypatch):
+    monkeypatch.setenv("TOKEN", "x")
+    messages = []
+    reconnects = []
+    ws = SageWebsocket(on_message_fn=lambda _, msg: messages.append(json.loads(msg)),
+                       on_reconnect_fn=lambda: reconnects.append(True),
+                       backoff=0.01, url=f"ws://127.0.0.1:{server.port}")
+    ws.subscribe(["/api/apps"])
+    try:
+        assert wait_for(lambda: len(messages) >= 3)
+        assert server.subscriptions[:3] == ["/api/apps"] * 3
+        assert reconnects
+        metrics = ws.get_metrics()
+        assert metrics["reconnects"] >= 2
+        assert metrics["subscriptions"] == ["/api/apps"]
+    finally:
+        ws.clean_up()
@@ -0,0 +1,70 @@
+#-----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+#-----------------------------------------------------------------------------
+
+import time
+
+import pytest
+
+from foresight.utils.update_coalescer import UpdateCoalescer
+
+
+class RecordingCommunication:
+    def __init__(self):
+        self.single = []
+        self.batches = []
+
+    def send_app_update(self, app_id, data):
+        self.single.append((app_id, data))
+
+    def send_app_batch_update(self, data):
+        self.batches.append(data)
+
+
+@pytest.fixture()
+def comm():
+    return RecordingCommunication()
+
+
+def test_sends_right_away_outside_batch(comm):
+    coalescer = UpdateCoalescer(comm, window=0)
+    coalescer.send("a", {"position.x": 1})
+    coalescer.send("a", {})
+    assert comm.single == [("a", {"position.x": 1})]
+
+
+def test_batch_merges_updates(comm):
+    coalescer = UpdateCoalescer(comm, window=0)
+    with coalescer.batch():
+        for i in range(100):
+            coalescer.send("a", {"position.x": i})
+            coalescer.send("b", {"position.y": i})
+        with coalescer.batch():
+            coalescer.send("b", {"raised": True})
+        assert comm.batches == []
+    assert comm.single == []
+    assert comm.batches == [[{"id": "a", "updates": {"position.x": 99}},
+                             {"id": "b", "updates": {"position.y": 99, "raised": True}}]]
+    assert coalescer.nb_requests == 1
+
+
+def test_flush_inside_batch(comm):
+    coalescer = UpdateCoalescer(comm, window=0)
+    with coalescer.batch():
+        coalescer.send("a", {"raised": True})
+        coalescer.flush()
+        coalescer.send("a", {"raised": False})
+    assert comm.single == [("a", {"raised": True}), ("a", {"raised": False})]
+
+
+def test_window_flush(comm):
+    coalescer = UpdateCoalescer(comm, window=0.05)
+    coalescer.send("a", {"state.count": 1})
+    coalescer.send("a", {"state.count": 2})
+    assert comm.single == []
+    time.sleep(0.2)
+    assert comm.single == [("a", {"state.count": 2})]
@@ -0,0 +1,117 @@
+# -----------------------------------------------------------------------------
+#  Copyright (c) SAGE3 Development Team 2022. All Rights Reserved
+#  University of Hawaii, University of Illinois Chicago, Virginia Tech
+#
+#  Distributed under the terms of the SAGE3 License.  The full license is in
+#  the file LICENSE, distributed as part of this software.
+# -----------------------------------------------------------------------------
+
+import os
+import threading
+from contextlib import contextmanager
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateCoalescer:
+    """
+    Collects the fields touched on each app and sends them to the server as a single
+    batch request instead of one PUT per send_updates call.
+
+    Updates are buffered:
+     - inside a `with coalescer.batch():` block, for the thread that opened it. The
+       buffer is sent when the outermost block exits.
+     - for `window` seconds after the first buffered update, when window > 0
+       (SAGE3_UPDATE_WINDOW env. variable, in seconds).
+    Otherwise, updates are sent right away as before.
+
+    Repeated writes to the same field of the same app are merged, the last value wins.
+    """
+
+    def __init__(self, s3_comm, window=None):
+        if window is None:
+            window = float(os.getenv("SAGE3_UPDATE_WINDOW", 0))
+        self.s3_comm = s3_comm
+        self.window = window
+        self.nb_updates = 0
+        self.nb_requests = 0
+
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__timer = None
+
+    @contextmanager
+    def batch(self):
+        local = self.__local
+        depth = getattr(local, "depth", 0)
+        if depth == 0:
+            local.pending = {}
+        local.depth = depth + 1
+        try:
+            yield self
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                pending, local.pending = local.pending, {}
+                self.__send(pending)
+
+    def send(self, app_id, updates):
+        """
+        Sends or buffers the updates of app_id
+        :param app_id: id of the app that was updated
+        :param updates: dict of the updated fields, as built by get_all_touched_fields_dict
+        """
+        if not updates:
+            return
+        self.nb_updates += 1
+        if getattr(self.__local, "depth", 0) > 0:
+            self.__merge(self.__local.pending, app_id, updates)
+        elif self.window > 0:
+            with self.__lock:
+                self.__merge(self.__pending, app_id, updates)
+                if self.__timer is None:
+                    self.__timer = threading.Timer(self.window, self.flush)
+                    self.__timer.daemon = True
+                    self.__timer.start()
+        else:
+            self.__send({app_id: updates})
+
+    def flush(self):
+        """
+        Sends what is buffered now: the current thread's batch, if any, and the updates
+        waiting for the window to expire
+        """
+        local = self.__local
+        if getattr(local, "depth", 0) > 0:
+            pending, local.pending = local.pending, {}
+            self.__send(pending)
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+        self.__send(pending)
+
+    @staticmethod
+    def __merge(pending, app_id, updates):
+        if app_id in pending:
+            pending[app_id].update(updates)
+        else:
+            pending[app_id] = dict(updates)
+
+    def __send(self, pending):
+        if not pending:
+            return
+        self.nb_requests += 1
+        try:
+            if len(pending) == 1:
+                app_id, updates = next(iter(pending.items()))
+                self.s3_comm.send_app_update(app_id, updates)
+            else:
+                batch = [{"id": app_id, "updates": updates} for app_id, updates in pending.items()]
+                self.s3_comm.send_app_batch_update(batch)
+        except Exception as e:
+            logger.error(f"Couldn't send updates for apps {list(pending.keys())}. \n{e}")